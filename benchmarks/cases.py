@@ -0,0 +1,207 @@
+"""
+Benchmarks of the verification hot paths. Each benchmark is a setup function returning the callable that is timed,
+attestations are created with the factories of the unit tests so no network access is needed.
+"""
+
+import base64
+import json
+import os
+import pkgutil
+import uuid
+from collections.abc import Callable
+from hashlib import sha256
+from unittest.mock import patch
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.http import HttpResponse
+from django.test import RequestFactory
+from pyattest.configs.apple import AppleConfig
+from pyattest.configs.google import GoogleConfig
+from tests.factory import apple as apple_factory
+from tests.factory import google as google_factory
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.decorators import signature_required, verify_assertion
+from dreiattest.helpers import request_hash
+from dreiattest.key import get_key_id, key_fields, key_from_request
+from dreiattest.models import DeviceSession, Key
+from dreiattest.nonce import create_nonce
+from dreiattest.nonce_stores import get_nonce_store
+
+benchmarks: dict[str, Callable[[], Callable[[], object]]] = {}
+
+rf = RequestFactory()
+root_ca = pkgutil.get_data("pyattest", "testutils/fixtures/root_cert.pem")
+
+
+def benchmark(name: str):
+    def decorator(setup):
+        benchmarks[name] = setup
+        return setup
+
+    return decorator
+
+
+def new_device_session() -> DeviceSession:
+    return DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="benchmark")
+
+
+def new_key(device_session: DeviceSession) -> tuple[Key, ec.EllipticCurvePrivateKey]:
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    public_key = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    key = Key.objects.create(
+        device_session=device_session,
+        public_key=public_key.decode(),
+        public_key_id=get_key_id(public_key.decode()),
+        driver="apple",
+    )
+
+    return key, private_key
+
+
+def signed_request_factory(size: int) -> Callable[[], object]:
+    """Return a factory for a signed POST request with a body of given size, signed with a new key."""
+    device_session = new_device_session()
+    _, private_key = new_key(device_session)
+    body = os.urandom(size)
+    headers = {
+        "HTTP_DREIATTEST_UID": str(device_session),
+        "HTTP_DREIATTEST_NONCE": "benchmark",
+        "HTTP_DREIATTEST_APP_IDENTIFIER": "foo",
+    }
+
+    def make_request(**extra):
+        return rf.post("/foo", body, content_type="application/octet-stream", **headers, **extra)
+
+    assertion = apple_factory.assertion(private_key, request_hash(make_request(), []), b"benchmark")
+
+    return lambda: make_request(HTTP_DREIATTEST_SIGNATURE=assertion)
+
+
+@benchmark("request_hash_1kb")
+def bench_request_hash_small():
+    make_request = signed_request_factory(1024)
+
+    return lambda: request_hash(make_request(), [])
+
+
+@benchmark("request_hash_1mb")
+def bench_request_hash_large():
+    make_request = signed_request_factory(1024 * 1024)
+
+    return lambda: request_hash(make_request(), [])
+
+
+@benchmark("get_key_id")
+def bench_get_key_id():
+    public_key = ec.generate_private_key(ec.SECP256R1()).public_key()
+    pem = public_key.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    return lambda: get_key_id(pem.decode())
+
+
+@benchmark("load_public_key_pem")
+def bench_load_public_key_pem():
+    key, _ = new_key(new_device_session())
+
+    return key.load_public_key
+
+
+@benchmark("load_public_key_binary")
+def bench_load_public_key_binary():
+    key, _ = new_key(new_device_session())
+    der = key.load_pem().public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    with patch.object(dreiattest_settings, "DREIATTEST_KEY_STORAGE", "binary"):
+        binary_key = Key(**key_fields(der), driver="apple")
+
+    return binary_key.load_public_key
+
+
+@benchmark("verify_assertion")
+def bench_verify_assertion():
+    key, private_key = new_key(new_device_session())
+    expected_hash = sha256(b"request").digest()
+    assertion = apple_factory.assertion(private_key, expected_hash, b"benchmark")
+
+    return lambda: verify_assertion("foo", key, b"benchmark", assertion, expected_hash)
+
+
+@benchmark("signature_required")
+def bench_signature_required():
+    make_request = signed_request_factory(1024)
+    view = signature_required()(lambda request: HttpResponse())
+
+    return lambda: view(make_request())
+
+
+@benchmark("key_from_request_apple")
+def bench_key_from_request_apple():
+    device_session = new_device_session()
+    nonce = create_nonce(device_session)
+    attestation, public_key = apple_factory.get(app_id="foo", nonce=nonce, device_session=device_session)
+    key_id = sha256(public_key).digest()
+    config = AppleConfig(key_id=key_id, app_id="foo", production=False, root_ca=root_ca)
+    body = {
+        "driver": "apple",
+        "key_id": base64.b64encode(key_id).decode(),
+        "attestation": base64.b64encode(attestation).decode(),
+    }
+
+    def run():
+        # The nonce is consumed by the view before key_from_request, so the same attestation can be registered again
+        request = rf.post("/key", json.dumps(body), content_type="application/json")
+        with patch("dreiattest.key.apple_config", return_value=[config]):
+            return key_from_request(request, nonce, device_session)
+
+    return run
+
+
+@benchmark("key_from_request_google")
+def bench_key_from_request_google():
+    device_session = new_device_session()
+    nonce = create_nonce(device_session)
+    apk_cert_digest = bytes.fromhex("90f283bdab972dab7524b9208de4ef8f")
+    attestation, public_key = google_factory.get(
+        apk_package_name="foo", nonce=nonce, device_session=device_session, apk_cert_digest=apk_cert_digest
+    )
+    config = GoogleConfig(
+        key_ids=[base64.b64encode(apk_cert_digest)],
+        apk_package_name="foo",
+        root_cn="pyattest-testing-leaf.ch",
+        root_ca=root_ca,
+        production=False,
+    )
+    body = {
+        "driver": "google",
+        "public_key": base64.b64encode(public_key).decode(),
+        "attestation": attestation,
+    }
+
+    def run():
+        request = rf.post("/key", json.dumps(body), content_type="application/json")
+        with patch("dreiattest.key.google_safety_net_config", return_value=[config]):
+            return key_from_request(request, nonce, device_session)
+
+    return run
+
+
+@benchmark("nonce_issue")
+def bench_nonce_issue():
+    device_session = new_device_session()
+
+    return lambda: create_nonce(device_session)
+
+
+@benchmark("nonce_issue_and_consume")
+def bench_nonce_issue_and_consume():
+    device_session = new_device_session()
+    store = get_nonce_store()
+
+    def run():
+        nonce = create_nonce(device_session)
+        return store.consume(device_session, nonce.value)
+
+    return run
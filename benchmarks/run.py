@@ -0,0 +1,114 @@
+"""
+Run the benchmarks of the verification hot paths and compare them with a stored baseline.
+
+    python -m benchmarks.run                    # run and compare with benchmarks/baseline.json
+    python -m benchmarks.run --save-baseline    # run and store the results as the new baseline
+    python -m benchmarks.run --filter nonce     # only run benchmarks containing "nonce"
+
+The exit code is 1 if a benchmark is slower than its baseline by more than the threshold.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import timeit
+from pathlib import Path
+
+import django
+from django.conf import settings
+
+BASELINE = Path(__file__).parent / "baseline.json"
+
+settings.configure(
+    INSTALLED_APPS=["dreiattest"],
+    DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+    ALLOWED_HOSTS=["testserver"],
+    DREIATTEST_APPLE_APPIDS=["0000000000.foo"],
+    DREIATTEST_GOOGLE_APK_CERTIFICATE_DIGEST="90f283bdab972dab7524b9208de4ef8f",  # dummy value
+)
+django.setup()
+
+
+def measure(func, repeat: int) -> dict:
+    """Time given function and return the min and median duration of a single call in microseconds."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    timings = [timing / number * 1e6 for timing in timer.repeat(repeat=repeat, number=number)]
+
+    return {
+        "min_us": round(min(timings), 3),
+        "median_us": round(statistics.median(timings), 3),
+        "number": number,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Return the names of the benchmarks whose median is slower than the baseline by more than the threshold."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<40} {result['median_us']:>12.1f}us  (no baseline)")
+            continue
+
+        ratio = result["median_us"] / baseline[name]["median_us"]
+        marker = "REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{name:<40} {result['median_us']:>12.1f}us  {ratio:>6.2f}x  {marker}")
+        if marker:
+            regressions.append(name)
+
+    return regressions
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", type=Path, default=BASELINE, help="Baseline to compare the results with")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timing runs per benchmark")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="Allowed slowdown compared to the baseline (0.25 = 25%%)"
+    )
+    options = parser.parse_args(argv)
+
+    from django.core.management import call_command
+
+    from benchmarks.cases import benchmarks
+
+    call_command("migrate", verbosity=0)
+
+    results = {}
+    for name, setup in benchmarks.items():
+        if options.filter in name:
+            results[name] = measure(setup(), options.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "benchmarks": results,
+    }
+
+    if options.output:
+        options.output.write_text(json.dumps(report, indent=2) + "\n")
+
+    if options.save_baseline:
+        options.baseline.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Stored {len(results)} results in {options.baseline}")
+        return 0
+
+    baseline = {}
+    if options.baseline.exists():
+        baseline = json.loads(options.baseline.read_text())["benchmarks"]
+
+    regressions = compare(results, baseline, options.threshold)
+    if regressions:
+        print(f"{len(regressions)} benchmarks are slower than the baseline: {', '.join(regressions)}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,185 @@
+import base64
+import json
+import logging
+from inspect import iscoroutinefunction
+from io import BytesIO
+from json import JSONDecodeError
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync
+from django.core.handlers.exception import response_for_exception
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import Http404, HttpResponse
+from django.urls import resolve
+
+from . import settings as dreiattest_settings
+from .decorators import verify_with_replica_key
+from .device_session import session_and_key_from_request, uid_from_request
+from .exceptions import (
+    InvalidPayloadException,
+    NoKeyForSessionException,
+    TooManyFailuresException,
+)
+from .helpers import close_body_spool
+from .metrics import start_request_metrics
+from .middlewares import HandleDreiattestExceptionsMiddleware, relevant_base
+from .models import Key
+from .throttling import is_throttled, record_failure, verification_failures
+
+logger = logging.getLogger("dreiattest")
+
+# Headers of the batch request which are specific to a single signed request and not passed on to the items
+_per_request_meta = {
+    "CONTENT_TYPE",
+    "CONTENT_LENGTH",
+    "QUERY_STRING",
+    "PATH_INFO",
+    "REQUEST_METHOD",
+    "wsgi.input",
+    dreiattest_settings.DREIATTEST_ASSERTION_HEADER,
+    dreiattest_settings.DREIATTEST_NONCE_HEADER,
+    dreiattest_settings.DREIATTEST_USER_HEADERS_HEADER,
+}
+
+# Attributes set by middlewares on the batch request which the target views may rely on
+_inherited_attributes = ("user", "session")
+
+
+def items_from_request(request: WSGIRequest) -> list[dict]:
+    """
+    Parse the signed requests of a batch request, each needs a method and path, headers and body are optional. All
+    items are validated before any of them is dispatched, the body of the returned items is decoded already.
+    """
+    try:
+        items = json.loads(request.body.decode())["requests"]
+    except (JSONDecodeError, UnicodeDecodeError, KeyError, TypeError) as error:
+        raise InvalidPayloadException from error
+
+    if not isinstance(items, list) or len(items) > dreiattest_settings.DREIATTEST_BATCH_MAX_SIZE:
+        raise InvalidPayloadException
+
+    return [_parse_item(item) for item in items]
+
+
+def _parse_item(item) -> dict:
+    if not isinstance(item, dict):
+        raise InvalidPayloadException
+
+    method, path, headers = item.get("method"), item.get("path"), item.get("headers") or {}
+    if not method or not isinstance(method, str) or not path or not isinstance(path, str):
+        raise InvalidPayloadException
+
+    if not isinstance(headers, dict):
+        raise InvalidPayloadException
+
+    try:
+        body = base64.b64decode(item.get("body") or "", validate=True)
+    except (TypeError, ValueError) as error:
+        raise InvalidPayloadException from error
+
+    return {"method": method, "path": path, "headers": headers, "body": body}
+
+
+def dispatch_batch(request: WSGIRequest) -> list[dict]:
+    """
+    Verify and dispatch all signed requests of given batch request. The device session and its key are looked up once
+    for the whole batch, the result of every request is returned in order.
+    """
+    items = items_from_request(request)
+
+    with start_request_metrics(request, "batch") as metrics:
+        user_id, session_id = uid_from_request(request)
+        if is_throttled(user_id, session_id):
+            raise TooManyFailuresException
+
+        with metrics.phase("key_lookup"):
+            _, public_key = session_and_key_from_request(request, replica=True)
+        if not public_key:
+            record_failure(user_id, session_id)
+            raise NoKeyForSessionException
+
+        results = []
+        for item in items:
+            sub_request = build_sub_request(request, item)
+            with metrics.phase("dispatch"):
+                response = dispatch(sub_request, public_key, user_id, session_id, metrics)
+            results.append(serialize_response(response))
+            close_body_spool(sub_request)
+
+    return results
+
+
+def build_sub_request(request: WSGIRequest, item: dict) -> WSGIRequest:
+    """
+    Build the request of a batch item parsed by items_from_request. It inherits the environment and headers of the
+    batch request.
+    """
+    body = item["body"]
+    url = urlsplit(item["path"])
+    script_name = request.META.get("SCRIPT_NAME", "")
+    environ = {key: value for key, value in request.META.items() if key not in _per_request_meta}
+    environ.update(
+        {
+            "REQUEST_METHOD": item["method"].upper(),
+            "PATH_INFO": url.path.removeprefix(script_name) or "/",
+            "QUERY_STRING": url.query,
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": BytesIO(body),
+            "wsgi.url_scheme": request.scheme,
+        }
+    )
+
+    for name, value in item["headers"].items():
+        meta_key = name.upper().replace("-", "_")
+        if meta_key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            meta_key = f"HTTP_{meta_key}"
+        environ[meta_key] = str(value)
+
+    # All items belong to the device session of the batch request, its key is used to verify them
+    environ[dreiattest_settings.DREIATTEST_UID_HEADER] = request.META[dreiattest_settings.DREIATTEST_UID_HEADER]
+
+    sub_request = WSGIRequest(environ)
+    for attribute in _inherited_attributes:
+        if hasattr(request, attribute):
+            setattr(sub_request, attribute, getattr(request, attribute))
+
+    return sub_request
+
+
+def dispatch(sub_request: WSGIRequest, public_key: Key, user_id: str, session_id, metrics) -> HttpResponse:
+    """Verify the signature of a batch item and call its view. Errors are turned into responses of that item."""
+    try:
+        try:
+            verify_with_replica_key(sub_request, public_key, metrics)
+        except verification_failures:
+            record_failure(user_id, session_id)
+            raise
+
+        # signature_required of the target view doesn't need to verify the request again
+        sub_request.dreiattest_verified = True
+
+        # The middlewares don't run for batch items, so only views verifying the signature themselves are reachable
+        match = resolve(sub_request.path_info)
+        if not getattr(match.func, "dreiattest_signature_required", False):
+            raise Http404
+
+        if iscoroutinefunction(match.func):
+            return async_to_sync(match.func)(sub_request, *match.args, **match.kwargs)
+
+        return match.func(sub_request, *match.args, **match.kwargs)
+
+    except relevant_base as exception:
+        return HandleDreiattestExceptionsMiddleware(None).handle(sub_request, exception)
+
+    except Exception as exception:
+        return response_for_exception(sub_request, exception)
+
+
+def serialize_response(response: HttpResponse) -> dict:
+    content = b"".join(response.streaming_content) if response.streaming else response.content
+
+    return {
+        "status": response.status_code,
+        "headers": dict(response.items()),
+        "body": base64.b64encode(content).decode(),
+    }
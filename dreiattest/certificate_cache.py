@@ -0,0 +1,117 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from hashlib import sha256
+from threading import Lock
+
+from asn1crypto.x509 import Certificate
+from certvalidator import CertificateValidator, ValidationContext
+from certvalidator.errors import PathBuildingError, PathValidationError
+from certvalidator.path import ValidationPath
+from pyattest.configs.apple import AppleConfig
+from pyattest.exceptions import InvalidCertificateChainException
+from pyattest.verifiers.apple_attestation import AppleAttestationVerifier
+
+from . import settings as dreiattest_settings
+
+
+class IntermediateCertificateCache:
+    """
+    Bounded LRU cache of intermediate certificates that were verified against a root certificate. Entries expire at
+    the notAfter of the certificate, or after DREIATTEST_INTERMEDIATE_CACHE_TIMEOUT seconds if that is earlier.
+    """
+
+    def __init__(self, max_size: int, timeout: int):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[bytes, bytes], float] = OrderedDict()
+        self._lock = Lock()
+
+    def is_trusted(self, certificate: bytes, root_ca: bytes) -> bool:
+        """Check if the DER encoded certificate was verified against given root certificate and hasn't expired."""
+        cache_key = self._cache_key(certificate, root_ca)
+        with self._lock:
+            expires_at = self._entries.get(cache_key)
+            if expires_at is not None and expires_at > time.time():
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return True
+
+            self._entries.pop(cache_key, None)
+            self.misses += 1
+
+        return False
+
+    def add(self, certificate: bytes, root_ca: bytes, not_after: datetime):
+        """Remember that the DER encoded certificate was verified against given root certificate."""
+        if self.max_size <= 0:
+            return
+
+        cache_key = self._cache_key(certificate, root_ca)
+        expires_at = min(not_after.timestamp(), time.time() + self.timeout)
+        with self._lock:
+            self._entries[cache_key] = expires_at
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
+
+    @staticmethod
+    def _cache_key(certificate: bytes, root_ca: bytes) -> tuple[bytes, bytes]:
+        return sha256(certificate).digest(), sha256(root_ca).digest()
+
+
+intermediate_cache = IntermediateCertificateCache(
+    dreiattest_settings.DREIATTEST_INTERMEDIATE_CACHE_SIZE,
+    dreiattest_settings.DREIATTEST_INTERMEDIATE_CACHE_TIMEOUT,
+)
+
+
+class CachingAppleAttestationVerifier(AppleAttestationVerifier):
+    """
+    Apple attestation verifier which remembers the intermediate certificates it verified against the root
+    certificate. Chains with a known intermediate only need their leaf to be verified against that intermediate.
+    """
+
+    def verify_certificate_chain(self, chain: list) -> ValidationPath:
+        if len(chain) != 2:
+            return super().verify_certificate_chain(chain)
+
+        leaf, intermediate = chain
+        root_ca = self.attestation.config.root_ca
+        if intermediate_cache.is_trusted(intermediate, root_ca):
+            context = ValidationContext(trust_roots=[intermediate])
+            validator = CertificateValidator(leaf, validation_context=context)
+
+            try:
+                return validator.validate_usage({"digital_signature"})
+            except (PathBuildingError, PathValidationError) as exception:
+                raise InvalidCertificateChainException from exception
+
+        path = super().verify_certificate_chain(chain)
+
+        fingerprint = Certificate.load(intermediate).sha256
+        for certificate in path:
+            if certificate.sha256 == fingerprint:
+                intermediate_cache.add(intermediate, root_ca, certificate.not_valid_after)
+
+        return path
+
+
+class CachingAppleConfig(AppleConfig):
+    attestation_verifier_class = CachingAppleAttestationVerifier
@@ -0,0 +1,123 @@
+from uuid import UUID
+
+from django.core.handlers.wsgi import WSGIRequest
+
+from . import settings as dreiattest_settings
+from .exceptions import InvalidHeaderException
+from .helpers import is_valid_uuid
+
+# Marks attributes of a RequestContext which were not parsed yet
+_unset = object()
+
+
+class RequestContext:
+    """
+    The dreiattest headers of a request, each parsed and validated once on first access. Use request_context to get
+    the context of a request, it's shared by all of dreiattest and the plugins as `request.dreiattest`.
+    """
+
+    __slots__ = ("_meta", "_uid", "_user_headers", "driver")
+
+    def __init__(self, request: WSGIRequest):
+        self._meta = request.META
+        self._uid = _unset
+        self._user_headers = _unset
+        # Driver of the key the request is verified with or registers, once it is known
+        self.driver: str | None = None
+
+    @property
+    def uid(self) -> tuple[str, UUID]:
+        """The validated user_id and session_id of the uid header, raises InvalidHeaderException if it's invalid."""
+        if self._uid is _unset:
+            header = self._meta.get(dreiattest_settings.DREIATTEST_UID_HEADER)
+            if not header:
+                raise InvalidHeaderException
+
+            self._uid = parse_header(header)
+
+        return self._uid
+
+    @property
+    def user_id(self) -> str:
+        return self.uid[0]
+
+    @property
+    def session_id(self) -> UUID:
+        return self.uid[1]
+
+    @property
+    def nonce(self) -> str | None:
+        return self._meta.get(dreiattest_settings.DREIATTEST_NONCE_HEADER) or None
+
+    @property
+    def signature(self) -> str:
+        return self._meta.get(dreiattest_settings.DREIATTEST_ASSERTION_HEADER, "")
+
+    @property
+    def user_headers(self) -> list[str]:
+        """Names of the headers included in the signature of the request."""
+        if self._user_headers is _unset:
+            header = self._meta.get(dreiattest_settings.DREIATTEST_USER_HEADERS_HEADER, "")
+            self._user_headers = header.split(",")
+
+        return self._user_headers
+
+    @property
+    def app_id(self) -> str | None:
+        return self._meta.get(dreiattest_settings.DREIATTEST_APPID_HEADER)
+
+    @property
+    def shared_secret(self) -> str | None:
+        return self._meta.get(dreiattest_settings.DREIATTEST_BYPASS_HEADER) or None
+
+    @property
+    def ticket(self) -> str | None:
+        return self._meta.get(dreiattest_settings.DREIATTEST_TICKET_HEADER) or None
+
+    @property
+    def library_version(self) -> str | None:
+        return self._meta.get(dreiattest_settings.DREIATTEST_LIBRARY_VERSION_HEADER)
+
+    @property
+    def app_version(self) -> str | None:
+        return self._meta.get(dreiattest_settings.DREIATTEST_APP_VERSION_HEADER)
+
+    @property
+    def app_build(self) -> str | None:
+        return self._meta.get(dreiattest_settings.DREIATTEST_APP_BUILD_HEADER)
+
+    @property
+    def os(self) -> str | None:
+        return self._meta.get(dreiattest_settings.DREIATTEST_OS_HEADER)
+
+
+def request_context(request: WSGIRequest) -> RequestContext:
+    """Return the dreiattest context of given request, it's created on first use."""
+    try:
+        return request.dreiattest
+    except AttributeError:
+        context = request.dreiattest = RequestContext(request)
+        return context
+
+
+def parse_header(header: str) -> tuple[str, UUID]:
+    """
+    The format is user_id;session_id where the identifier has to be a string with maxlength 128 and the
+    session_id has to be a valid v4 uuid.
+    """
+    try:
+        user_id, session_id = header.split(";")
+    except ValueError as error:
+        raise InvalidHeaderException from error
+
+    if not is_valid_uuid(session_id):
+        raise InvalidHeaderException
+
+    if not is_valid_user_id(user_id):
+        raise InvalidHeaderException
+
+    return user_id, UUID(session_id)
+
+
+def is_valid_user_id(user_id: str) -> bool:
+    return len(user_id) <= 128
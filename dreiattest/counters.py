@@ -0,0 +1,150 @@
+import logging
+import time
+from collections import OrderedDict
+from contextlib import suppress
+from threading import Lock
+
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from pyattest.exceptions import InvalidCounterException
+
+from . import settings as dreiattest_settings
+from .exceptions import ExecutorBusyException
+from .executors import get_plugin_executor
+from .models import Key
+
+logger = logging.getLogger("dreiattest")
+
+# Seconds the highest counter of a key and the markers of its accepted counters are kept in the shared cache, long
+# after they were written to the database. Entries of keys which were replaced or pruned expire.
+_COUNTER_TIMEOUT = 24 * 60 * 60
+
+
+class AssertionCounterTracker:
+    """
+    Tracks the highest counter of the apple assertions per key and rejects assertions whose counter isn't higher,
+    which prevents them from being replayed. The counters are kept in process memory, or in the django cache
+    DREIATTEST_ASSERTION_COUNTER_CACHE to share them between processes, and are written to the database in batches
+    every DREIATTEST_ASSERTION_COUNTER_FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        # Both map the primary key of a key to its public_key_id and the highest counter seen
+        self._seen: OrderedDict[int, tuple[str, int]] = OrderedDict()
+        self._pending: dict[int, tuple[str, int]] = {}
+        self._lock = Lock()
+        self._last_flush = time.monotonic()
+
+    def check(self, key: Key, counter: int):
+        """Raise an InvalidCounterException if given counter is not higher than the last one of the key."""
+        if dreiattest_settings.DREIATTEST_ASSERTION_COUNTER_CACHE:
+            self._check_shared(key, counter)
+        else:
+            self._check_local(key, counter)
+
+        self._maybe_flush()
+
+    def invalidate(self, pk: int):
+        """Forget the counter of the key with given primary key, e.g. after it was replaced by a new key."""
+        with self._lock:
+            self._seen.pop(pk, None)
+
+    def flush(self) -> int:
+        """Write all pending counters to the database with a single query. Counters are never decreased."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        # Keys which were replaced since their counter was seen keep the counter of their new key
+        cases = [
+            When(
+                pk=pk,
+                public_key_id=public_key_id,
+                then=Greatest(Coalesce("assertion_counter", Value(0)), Value(counter)),
+            )
+            for pk, (public_key_id, counter) in pending.items()
+        ]
+
+        try:
+            return Key.objects.filter(pk__in=pending).update(
+                assertion_counter=Case(*cases, default=F("assertion_counter"))
+            )
+        except Exception:
+            with self._lock:
+                for pk, entry in pending.items():
+                    # Counters seen since the flush started are at least as recent
+                    self._pending.setdefault(pk, entry)
+            raise
+
+    def _check_local(self, key: Key, counter: int):
+        with self._lock:
+            last = self._last_counter(key)
+            if counter <= last:
+                raise InvalidCounterException
+
+            self._seen[key.pk] = (key.public_key_id, counter)
+            self._seen.move_to_end(key.pk)
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+
+            self._add_pending(key.pk, (key.public_key_id, counter))
+
+    def _check_shared(self, key: Key, counter: int):
+        cache = caches[dreiattest_settings.DREIATTEST_ASSERTION_COUNTER_CACHE]
+        cache_key = f"dreiattest:counter:{key.pk}:{key.public_key_id}"
+
+        last = cache.get(cache_key)
+        if last is None:
+            last = key.assertion_counter or 0
+        # The cache has no compare-and-set, but adding the marker of a counter is atomic, so every counter is accepted
+        # once even if concurrent requests race on the highest counter
+        if counter <= last or not cache.add(f"{cache_key}:{counter}", True, timeout=_COUNTER_TIMEOUT):
+            raise InvalidCounterException
+
+        # A concurrent request may still overwrite this counter with a lower one, the marker keeps rejecting its replay
+        if counter > (cache.get(cache_key) or 0):
+            cache.set(cache_key, counter, timeout=_COUNTER_TIMEOUT)
+
+        with self._lock:
+            self._add_pending(key.pk, (key.public_key_id, counter))
+
+    def _last_counter(self, key: Key) -> int:
+        for entries in (self._seen, self._pending):
+            entry = entries.get(key.pk)
+            if entry is not None and entry[0] == key.public_key_id:
+                return entry[1]
+
+        return key.assertion_counter or 0
+
+    def _add_pending(self, pk: int, entry: tuple[str, int]):
+        current = self._pending.get(pk)
+        if current is None or current[0] != entry[0] or current[1] < entry[1]:
+            self._pending[pk] = entry
+
+    def _maybe_flush(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_flush < dreiattest_settings.DREIATTEST_ASSERTION_COUNTER_FLUSH_INTERVAL:
+                return
+
+            self._last_flush = now
+
+        # The counters stay pending until the next flush if the executor is busy
+        with suppress(ExecutorBusyException):
+            get_plugin_executor().submit(self._flush_in_background)
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to write the assertion counters")
+        finally:
+            close_old_connections()
+
+
+assertion_counters = AssertionCounterTracker()
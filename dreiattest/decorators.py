@@ -1,28 +1,56 @@
 import base64
 from functools import wraps
 from hashlib import sha256
+from inspect import iscoroutinefunction
 
 from django.core.handlers.wsgi import WSGIRequest
 from pyattest.assertion import Assertion
+from pyattest.verifiers.apple_assertion import AppleAssertionVerifier
 
-from dreiattest.device_session import device_session_from_request
+from dreiattest.context import request_context
+from dreiattest.counters import assertion_counters
+from dreiattest.device_session import (
+    areload_replica_key,
+    asession_and_key_from_request,
+    reload_replica_key,
+    session_and_key_from_request,
+    uid_from_request,
+)
 from dreiattest.exceptions import (
-    InvalidHeaderException,
     InvalidDriverException,
+    InvalidHeaderException,
     NoKeyForSessionException,
+    TooManyFailuresException,
 )
-from dreiattest.helpers import request_hash
+from dreiattest.executors import run_in_verify_executor
+from dreiattest.helpers import close_body_spool, request_hash
+from dreiattest.metrics import RequestMetrics, disabled_metrics, start_request_metrics
 from dreiattest.models import Key
+from dreiattest.public_key_cache import public_key_cache
+from dreiattest.throttling import (
+    ais_throttled,
+    arecord_failure,
+    is_throttled,
+    record_failure,
+    verification_failures,
+)
+from dreiattest.tickets import TICKET_RESPONSE_HEADER, has_valid_ticket, issue_ticket
+
 from . import settings as dreiattest_settings
 from .generate_config import (
     apple_config,
-    google_safety_net_config,
     google_play_integrity_api_config,
+    google_safety_net_config,
 )
 
 
 def verify_assertion(
-    app_id: str, key: Key, nonce: bytes, assertion: str, expected_hash: bytes
+    app_id: str,
+    key: Key,
+    nonce: bytes,
+    assertion: str,
+    expected_hash: bytes,
+    metrics: RequestMetrics = disabled_metrics,
 ):
     # For verifying the assertion (request signature) the app_id doesn't matter. We, therefore, just use the first
     # config.
@@ -39,18 +67,29 @@ def verify_assertion(
         raise InvalidDriverException
 
     expected_hash = sha256(expected_hash + nonce).digest()
-    pem_key = key.load_pem()
+    with metrics.phase("public_key_load"):
+        pem_key = public_key_cache.load(key)
 
-    assertion = Assertion(base64.b64decode(assertion), expected_hash, pem_key, config[0])
-    assertion.verify()
+    raw_assertion = base64.b64decode(assertion)
+    assertion = Assertion(raw_assertion, expected_hash, pem_key, config[0])
+    with metrics.phase("assertion_verify"):
+        assertion.verify()
+
+    if key.driver == "apple" and dreiattest_settings.DREIATTEST_ASSERTION_COUNTER_CHECK:
+        counter = AppleAssertionVerifier.unpack(raw_assertion)["counter"]
+        assertion_counters.check(key, counter)
 
 
 def should_bypass(request: WSGIRequest) -> bool:
     """
     Check if given requests can be bypassed. This is the case if the client sends us a shared secret
-    via the bypass-header and this value matches with ou configured bypass secret.
+    via the bypass-header and this value matches with ou configured bypass secret, or if the request was
+    verified already, e.g. as item of a batch request.
     """
-    shared_secret = request.META.get(dreiattest_settings.DREIATTEST_BYPASS_HEADER, None)
+    if getattr(request, "dreiattest_verified", False):
+        return True
+
+    shared_secret = request_context(request).shared_secret
     expected_shared_secret = dreiattest_settings.DREIATTEST_BYPASS_SECRET
 
     if not shared_secret or not expected_shared_secret:
@@ -59,41 +98,176 @@ def should_bypass(request: WSGIRequest) -> bool:
     return shared_secret == expected_shared_secret
 
 
-def signature_required():
-    """Check that the given request has a valid signature from a known device session."""
+def verify_request(request: WSGIRequest) -> Key:
+    """
+    Verify the assertion of given request with the key of its device session and return that key. Sessions
+    which failed too many verifications are rejected before anything is looked up.
+    """
+    with start_request_metrics(request, "signature_required") as metrics:
+        user_id, session_id = uid_from_request(request)
+        if is_throttled(user_id, session_id):
+            raise TooManyFailuresException
 
-    def decorator(func):
-        @wraps(func)
-        def inner(request: WSGIRequest, *args, **kwargs):
-            if should_bypass(request):
-                return func(request, *args, **kwargs)
+        try:
+            with metrics.phase("key_lookup"):
+                _, public_key = session_and_key_from_request(request, replica=True)
+            if not public_key:
+                raise NoKeyForSessionException
+
+            public_key = verify_with_replica_key(request, public_key, metrics)
+        except verification_failures:
+            record_failure(user_id, session_id)
+            raise
+
+    return public_key
 
-            session = device_session_from_request(request, create=False)
-            if not session:
-                raise InvalidHeaderException
 
-            public_key = (
-                Key.objects.filter(device_session=session).order_by("-id").first()
-            )
+async def averify_request(request: WSGIRequest) -> Key:
+    """Async version of verify_request, the verification itself runs in the verify executor."""
+    with start_request_metrics(request, "signature_required") as metrics:
+        user_id, session_id = uid_from_request(request)
+        if await ais_throttled(user_id, session_id):
+            raise TooManyFailuresException
+
+        try:
+            with metrics.phase("key_lookup"):
+                _, public_key = await asession_and_key_from_request(request, replica=True)
             if not public_key:
                 raise NoKeyForSessionException
 
-            app_id = request.META.get(dreiattest_settings.DREIATTEST_APPID_HEADER)
-            nonce = request.META.get(
-                dreiattest_settings.DREIATTEST_NONCE_HEADER
-            ).encode("utf-8")
-            assertion = request.META.get(
-                dreiattest_settings.DREIATTEST_ASSERTION_HEADER, ""
-            )
-            headers = request.META.get(
-                dreiattest_settings.DREIATTEST_USER_HEADERS_HEADER, ""
-            )
-            expected_hash = request_hash(request, headers.split(","))
+            public_key = await averify_with_replica_key(request, public_key, metrics)
+        except verification_failures:
+            await arecord_failure(user_id, session_id)
+            raise
+
+    return public_key
+
+
+def verify_with_replica_key(request: WSGIRequest, public_key: Key, metrics: RequestMetrics = disabled_metrics) -> Key:
+    """
+    Verify given request with a key which may have been read from a replica. If that fails and the device registered a
+    new key the replica doesn't have yet, the verification is retried once with the key of the primary. Returns the key
+    the request was verified with.
+    """
+    try:
+        verify_request_signature(request, public_key, metrics)
+        return public_key
+    except verification_failures:
+        reloaded = reload_replica_key(request, public_key)
+        if not reloaded:
+            raise
+
+    verify_request_signature(request, reloaded, metrics)
+    return reloaded
+
+
+async def averify_with_replica_key(
+    request: WSGIRequest, public_key: Key, metrics: RequestMetrics = disabled_metrics
+) -> Key:
+    """Async version of verify_with_replica_key, the verification runs in the verify executor."""
+    try:
+        await run_in_verify_executor(verify_request_signature, request, public_key, metrics)
+        return public_key
+    except verification_failures:
+        reloaded = await areload_replica_key(request, public_key)
+        if not reloaded:
+            raise
+
+    await run_in_verify_executor(verify_request_signature, request, reloaded, metrics)
+    return reloaded
 
-            verify_assertion(app_id, public_key, nonce, assertion, expected_hash)
 
-            return func(request, *args, **kwargs)
+def verify_request_signature(request: WSGIRequest, public_key: Key, metrics: RequestMetrics = disabled_metrics):
+    context = request_context(request)
+    context.driver = public_key.driver
+    metrics.set_labels(public_key.driver, context.app_id)
+    if not context.nonce:
+        raise InvalidHeaderException
 
+    nonce = context.nonce.encode("utf-8")
+    with metrics.phase("request_hash"):
+        expected_hash = request_hash(request, context.user_headers)
+
+    verify_assertion(
+        context.app_id,
+        public_key,
+        nonce,
+        context.signature,
+        expected_hash,
+        metrics=metrics,
+    )
+
+
+def signature_required(ticket_lifetime: int | None = None):
+    """
+    Check that the given request has a valid signature from a known device session. Coroutine views are wrapped
+    natively, their session and key lookup uses the async ORM.
+
+    If ticket_lifetime is set, verified requests get a session ticket valid for that many seconds (at most
+    DREIATTEST_TICKET_MAX_LIFETIME) in the Dreiattest-Ticket response header. Requests to the same view sending a valid
+    ticket are accepted without looking up the key or verifying their signature. A ticket only proves the device
+    session, not the content of the request, so only enable this for views where that is enough, e.g. polling.
+    """
+
+    def decorator(func):
+        # Tickets are only accepted by the view which issued them
+        view = f"{func.__module__}.{func.__qualname__}"
+
+        if iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_inner(request: WSGIRequest, *args, **kwargs):
+                key = _verified_key(request)
+                if not should_bypass(request) and not _has_ticket(request, view, ticket_lifetime):
+                    key = await averify_request(request)
+
+                try:
+                    response = await func(request, *args, **kwargs)
+                finally:
+                    close_body_spool(request)
+
+                return _with_ticket(request, response, key, view, ticket_lifetime)
+
+            _mark_view(async_inner, view, ticket_lifetime)
+            return async_inner
+
+        @wraps(func)
+        def inner(request: WSGIRequest, *args, **kwargs):
+            key = _verified_key(request)
+            if not should_bypass(request) and not _has_ticket(request, view, ticket_lifetime):
+                key = verify_request(request)
+
+            try:
+                response = func(request, *args, **kwargs)
+            finally:
+                close_body_spool(request)
+
+            return _with_ticket(request, response, key, view, ticket_lifetime)
+
+        _mark_view(inner, view, ticket_lifetime)
         return inner
 
     return decorator
+
+
+def _mark_view(inner, view: str, ticket_lifetime: int | None):
+    # Batch requests are only dispatched to marked views, the SignatureRequiredMiddleware accepts their tickets
+    inner.dreiattest_signature_required = True
+    inner.dreiattest_ticket = (view, ticket_lifetime) if ticket_lifetime else None
+
+
+def _verified_key(request: WSGIRequest) -> Key | None:
+    """The key a request was verified with by the SignatureRequiredMiddleware, so a ticket can still be issued."""
+    return getattr(request, "dreiattest_key", None)
+
+
+def _has_ticket(request: WSGIRequest, view: str, ticket_lifetime: int | None) -> bool:
+    return bool(ticket_lifetime) and has_valid_ticket(request, view, ticket_lifetime)
+
+
+def _with_ticket(request: WSGIRequest, response, key: Key | None, view: str, ticket_lifetime: int | None):
+    """Add a new ticket to the response of a request which was verified with given key."""
+    if ticket_lifetime and key:
+        response[TICKET_RESPONSE_HEADER] = issue_ticket(request, view, ticket_lifetime)
+
+    return response
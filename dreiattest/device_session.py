@@ -1,71 +1,115 @@
-from typing import Optional, Tuple
 from uuid import UUID
 
-from . import settings as dreiattest_settings
-
 from django.core.handlers.wsgi import WSGIRequest
+from django.db.models import QuerySet
+
+from . import settings as dreiattest_settings
 
-from .exceptions import InvalidHeaderException
-from .helpers import is_valid_uuid
-from .models import DeviceSession
+# Moved to the request context, still importable from here
+from .context import is_valid_user_id, parse_header, request_context  # noqa: F401
+from .models import DeviceSession, Key
+from .routers import replica_database
+from .session_registry import session_registry
 
 
-def get_or_create_device_session(
-    user_id: str, session_id: UUID, create: bool = True
-) -> DeviceSession:
-    """Return matching DeviceSession model from the db, user_id and session_id need to be validated."""
-    if create:
-        session, _ = DeviceSession.objects.get_or_create(
-            session_id=session_id, user_id=user_id
-        )
-        return session
+def get_or_create_device_session(user_id: str, session_id: UUID, create: bool = True) -> DeviceSession:
+    """Return matching DeviceSession from the session registry, user_id and session_id need to be validated."""
+    return session_registry.get(user_id, session_id, create)
 
-    session = DeviceSession.objects.filter(
-        session_id=session_id, user_id=user_id
-    ).first()
-    if not session:
-        raise InvalidHeaderException
 
-    return session
+async def aget_or_create_device_session(user_id: str, session_id: UUID, create: bool = True) -> DeviceSession:
+    """Async version of get_or_create_device_session."""
+    return await session_registry.aget(user_id, session_id, create)
 
 
-def device_session_from_request(
-    request: WSGIRequest, create: bool = True
-) -> DeviceSession:
+def device_session_from_request(request: WSGIRequest, create: bool = True) -> DeviceSession:
     """Get the uid from given request. If the data is not present or valid an exception is raised."""
-    header = request.META.get(dreiattest_settings.DREIATTEST_UID_HEADER, None)
-    if not header:
-        raise InvalidHeaderException
-
-    user_id, session_id = parse_header(header)
+    user_id, session_id = uid_from_request(request)
 
     return get_or_create_device_session(user_id, session_id, create)
 
 
-def parse_header(header: str) -> Optional[Tuple[str, UUID]]:
+async def adevice_session_from_request(request: WSGIRequest, create: bool = True) -> DeviceSession:
+    """Async version of device_session_from_request."""
+    user_id, session_id = uid_from_request(request)
+
+    return await aget_or_create_device_session(user_id, session_id, create)
+
+
+def session_and_key_from_request(request: WSGIRequest, replica: bool = False) -> tuple[DeviceSession, Key | None]:
     """
-    The format is user_id;session_id where the identifier has to be a string with maxlength 128 and the
-    session_id has to be a valid v4 uuid.
+    Get the DeviceSession and its Key for the uid of given request. Both are fetched with a single joined
+    query, the session is only looked up on its own if it doesn't have a key yet. With replica set the key is
+    read from one of the DREIATTEST_REPLICA_DATABASES first, falling back to the primary if it's not there yet.
     """
-    try:
-        user_id, session_id = header.split(";")
-    except ValueError:
-        raise InvalidHeaderException
+    user_id, session_id = uid_from_request(request)
+
+    alias = replica_database() if replica else None
+    if alias:
+        key = _key_of_session(user_id, session_id).using(alias).first()
+        if key:
+            return key.device_session, key
+
+    key = _key_of_session(user_id, session_id).first()
+    if key:
+        return key.device_session, key
+
+    return get_or_create_device_session(user_id, session_id, create=False), None
+
+
+async def asession_and_key_from_request(
+    request: WSGIRequest, replica: bool = False
+) -> tuple[DeviceSession, Key | None]:
+    """Async version of session_and_key_from_request."""
+    user_id, session_id = uid_from_request(request)
+
+    alias = replica_database() if replica else None
+    if alias:
+        key = await _key_of_session(user_id, session_id).using(alias).afirst()
+        if key:
+            return key.device_session, key
+
+    key = await _key_of_session(user_id, session_id).afirst()
+    if key:
+        return key.device_session, key
+
+    return await aget_or_create_device_session(user_id, session_id, create=False), None
+
+
+def reload_replica_key(request: WSGIRequest, key: Key) -> Key | None:
+    """
+    Return the key of the session of given request from the primary if given key was read from a replica, which may
+    lag behind a device registering again. Returns None if the key wasn't read from a replica or wasn't replaced.
+    """
+    if key._state.db not in dreiattest_settings.DREIATTEST_REPLICA_DATABASES:
+        return None
+
+    reloaded = _key_of_session(*uid_from_request(request)).first()
+    if not reloaded or reloaded.public_key_id == key.public_key_id:
+        return None
+
+    return reloaded
+
 
-    if not is_valid_uuid(session_id):
-        raise InvalidHeaderException
+async def areload_replica_key(request: WSGIRequest, key: Key) -> Key | None:
+    """Async version of reload_replica_key."""
+    if key._state.db not in dreiattest_settings.DREIATTEST_REPLICA_DATABASES:
+        return None
 
-    if not is_valid_user_id(user_id):
-        raise InvalidHeaderException
+    reloaded = await _key_of_session(*uid_from_request(request)).afirst()
+    if not reloaded or reloaded.public_key_id == key.public_key_id:
+        return None
 
-    return user_id, UUID(session_id)
+    return reloaded
 
 
-def is_valid_user_id(user_id: str) -> bool:
-    if user_id == "":
-        return True
+def _key_of_session(user_id: str, session_id: UUID) -> QuerySet:
+    # A session has at most one key, so sorting the result for first() is trivial
+    return Key.objects.select_related("device_session").filter(
+        device_session__session_id=session_id, device_session__user_id=user_id
+    )
 
-    if len(user_id) > 128:
-        return False
 
-    return True
+def uid_from_request(request: WSGIRequest) -> tuple[str, UUID]:
+    """Get the validated user_id and session_id from the uid header of given request."""
+    return request_context(request).uid
@@ -0,0 +1,67 @@
+import random
+import time
+from threading import Lock
+
+from . import settings as dreiattest_settings
+
+
+class ExceptionLogLimiter:
+    """
+    Decides which exceptions handled by the HandleDreiattestExceptionsMiddleware are logged. Every exception code has
+    its own token bucket, which allows bursts of DREIATTEST_EXCEPTION_LOG_BURST logs and refills with
+    DREIATTEST_EXCEPTION_LOG_RATE logs per second. Of the logged exceptions only the share given by
+    DREIATTEST_EXCEPTION_LOG_TRACEBACK_RATES carries a traceback. Dropped logs are counted per code.
+    """
+
+    def __init__(self):
+        # Maps an exception code to the tokens left in its bucket and the time they were last refilled
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._suppressed: dict[str, int] = {}
+        self._suppressed_since_log: dict[str, int] = {}
+        self._lock = Lock()
+
+    def acquire(self, code: str) -> int | None:
+        """
+        Take a token of given exception code. Returns None if the exception must not be logged, otherwise the number
+        of its logs that were dropped since the last one.
+        """
+        rate = dreiattest_settings.DREIATTEST_EXCEPTION_LOG_RATE
+        if rate is None:
+            return 0
+
+        burst = dreiattest_settings.DREIATTEST_EXCEPTION_LOG_BURST
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated_at = self._buckets.get(code, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+
+            if tokens < 1:
+                self._buckets[code] = (tokens, now)
+                self._suppressed[code] = self._suppressed.get(code, 0) + 1
+                self._suppressed_since_log[code] = self._suppressed_since_log.get(code, 0) + 1
+                return None
+
+            self._buckets[code] = (tokens - 1, now)
+            return self._suppressed_since_log.pop(code, 0)
+
+    @staticmethod
+    def with_traceback(code: str) -> bool:
+        """Sample whether the log of given exception code includes its traceback."""
+        rate = dreiattest_settings.DREIATTEST_EXCEPTION_LOG_TRACEBACK_RATES.get(code, 1.0)
+
+        return rate >= 1 or random.random() < rate
+
+    def stats(self) -> dict[str, int]:
+        """Return the number of dropped logs per exception code."""
+        with self._lock:
+            return dict(self._suppressed)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._suppressed.clear()
+            self._suppressed_since_log.clear()
+
+
+exception_log_limiter = ExceptionLogLimiter()
@@ -20,3 +20,11 @@ class NoKeyForSessionException(DreiAttestException):
 
 class UnsupportedEncryptionException(DreiAttestException):
     pass
+
+
+class ExecutorBusyException(DreiAttestException):
+    pass
+
+
+class TooManyFailuresException(DreiAttestException):
+    pass
@@ -0,0 +1,117 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache, partial
+from threading import BoundedSemaphore
+
+from . import settings as dreiattest_settings
+from .exceptions import ExecutorBusyException
+
+
+class BoundedExecutor:
+    """Wraps an executor and limits the number of submitted calls that are not finished yet."""
+
+    def __init__(self, executor: Executor, max_pending: int):
+        self.executor = executor
+        self._slots = BoundedSemaphore(max_pending)
+        # Holds the slots reserved by the current thread or task which were not used by a call yet
+        self._reserved: ContextVar[list | None] = ContextVar(f"dreiattest_reserved_{id(self)}", default=None)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Submit given call, an ExecutorBusyException is raised if too many calls are pending already."""
+        reserved = self._reserved.get()
+        if reserved:
+            reserved.pop()
+        elif not self._slots.acquire(blocking=False):
+            raise ExecutorBusyException
+
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+
+        return future
+
+    @contextmanager
+    def reserve(self):
+        """
+        Reserve a slot for the next call submitted within the block, e.g. before work which can't be undone if the
+        call is rejected. An ExecutorBusyException is raised right away if no slot is free, the slot is released again
+        if nothing was submitted.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusyException
+
+        reserved = [True]
+        token = self._reserved.set(reserved)
+        try:
+            yield
+        finally:
+            self._reserved.reset(token)
+            if reserved:
+                self._slots.release()
+
+
+@cache
+def get_plugin_executor() -> BoundedExecutor:
+    executor = ThreadPoolExecutor(
+        max_workers=dreiattest_settings.DREIATTEST_PLUGIN_WORKERS,
+        thread_name_prefix="dreiattest-plugins",
+    )
+
+    return BoundedExecutor(executor, dreiattest_settings.DREIATTEST_PLUGIN_QUEUE_SIZE)
+
+
+@cache
+def get_verify_executor() -> Executor | None:
+    """
+    Return the executor the async views use for the CPU heavy verifications. If DREIATTEST_VERIFY_WORKERS is not set,
+    the default executor of the event loop is used.
+    """
+    if not dreiattest_settings.DREIATTEST_VERIFY_WORKERS:
+        return None
+
+    return ThreadPoolExecutor(
+        max_workers=dreiattest_settings.DREIATTEST_VERIFY_WORKERS,
+        thread_name_prefix="dreiattest-verify",
+    )
+
+
+@cache
+def get_attestation_executor() -> BoundedExecutor | None:
+    """
+    Return the process pool verifying the attestations of key registrations, None if DREIATTEST_ATTESTATION_PROCESSES
+    is not set. The processes are spawned instead of forked, so they don't share the db connections of the parent.
+    """
+    if not dreiattest_settings.DREIATTEST_ATTESTATION_PROCESSES:
+        return None
+
+    executor = ProcessPoolExecutor(
+        max_workers=dreiattest_settings.DREIATTEST_ATTESTATION_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_setup_django,
+    )
+
+    return BoundedExecutor(executor, dreiattest_settings.DREIATTEST_ATTESTATION_QUEUE_SIZE)
+
+
+def _setup_django():
+    import django
+
+    django.setup()
+
+
+async def run_in_verify_executor(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(get_verify_executor(), partial(fn, *args, **kwargs))
@@ -1,40 +1,103 @@
 import base64
+from threading import Lock
 
-from pyattest.configs.apple import AppleConfig
 from pyattest.configs.google import GoogleConfig
 from pyattest.configs.google_play_integrity_api import GooglePlayIntegrityApiConfig
 
 from . import settings as dreiattest_settings
+from .certificate_cache import CachingAppleConfig
+
+# Verification configs compiled from the settings, keyed by (driver, app_id). Apple configs depend on the key id of
+# each request, so only the matching declared app ids are stored for them.
+_config_index: dict[tuple[str, str | None], list] = {}
+_compiled_drivers: set[str] = set()
+_lock = Lock()
 
 
 def google_safety_net_config() -> list[GoogleConfig]:
-    key_id = base64.b64encode(
-        bytes.fromhex(dreiattest_settings.__DREIATTEST_GOOGLE_APK_CERTIFICATE_DIGEST)
-    )
-    return [
-        GoogleConfig(
-            key_ids=[key_id],
-            apk_package_name=dreiattest_settings.__DREIATTEST_GOOGLE_APK_NAME,
-            production=dreiattest_settings.DREIATTEST_PRODUCTION,
-        )
-    ]
+    return _get_configs("google", None)
 
 
 def google_play_integrity_api_config(app_id: str) -> list[GooglePlayIntegrityApiConfig]:
+    return _get_configs("google_play_integrity_api", app_id)
+
+
+def apple_config(app_id: str, public_key_id: str) -> list[CachingAppleConfig]:
     return [
-        _generate_play_integrity_config(settings)
-        for settings in dreiattest_settings.DREIATTEST_PLAY_INTEGRITY_CONFIGS
-        if settings.get("apk_name") == app_id
+        _generate_apple_config(app_id=declared_app_id, public_key_id=public_key_id)
+        for declared_app_id in _get_configs("apple", app_id)
     ]
 
 
-def _generate_play_integrity_config(
-    settings: dict[str, any]
-) -> GooglePlayIntegrityApiConfig:
-    if settings.get("certificate_digest"):
-        signatures = [settings.get("certificate_digest")]
-    else:
-        signatures = None
+def is_configured_app_id(driver: str | None, app_id: str | None) -> bool:
+    """Check if there are configs for given driver and app id. The google safety net driver ignores the app id."""
+    if driver not in _compilers:
+        return False
+
+    return bool(_get_configs(driver, None if driver == "google" else app_id))
+
+
+def reset_config_index():
+    """Drop all compiled configs, they are compiled again on their next use. Useful if the settings change in tests."""
+    with _lock:
+        _config_index.clear()
+        _compiled_drivers.clear()
+
+
+def _get_configs(driver: str, app_id: str | None) -> list:
+    if driver not in _compiled_drivers:
+        with _lock:
+            if driver not in _compiled_drivers:
+                _config_index.update(_compilers[driver]())
+                _compiled_drivers.add(driver)
+
+    return _config_index.get((driver, app_id), [])
+
+
+def _compile_google_safety_net() -> dict[tuple[str, None], list[GoogleConfig]]:
+    key_id = base64.b64encode(bytes.fromhex(dreiattest_settings.__DREIATTEST_GOOGLE_APK_CERTIFICATE_DIGEST))
+    config = GoogleConfig(
+        key_ids=[key_id],
+        apk_package_name=dreiattest_settings.__DREIATTEST_GOOGLE_APK_NAME,
+        production=dreiattest_settings.DREIATTEST_PRODUCTION,
+    )
+
+    return {("google", None): [config]}
+
+
+def _compile_google_play_integrity_api() -> dict[tuple[str, str], list[GooglePlayIntegrityApiConfig]]:
+    index = {}
+    for settings in dreiattest_settings.DREIATTEST_PLAY_INTEGRITY_CONFIGS:
+        if not settings.get("apk_name"):
+            continue
+
+        index.setdefault(("google_play_integrity_api", settings["apk_name"]), []).append(
+            _generate_play_integrity_config(settings)
+        )
+
+    return index
+
+
+def _compile_apple() -> dict[tuple[str, str], list[str]]:
+    index = {}
+    for declared_app_id in dreiattest_settings.DREIATTEST_APPLE_APPIDS:
+        if not declared_app_id:
+            continue
+
+        index.setdefault(("apple", _get_bundle_id(declared_app_id)), []).append(declared_app_id)
+
+    return index
+
+
+_compilers = {
+    "google": _compile_google_safety_net,
+    "google_play_integrity_api": _compile_google_play_integrity_api,
+    "apple": _compile_apple,
+}
+
+
+def _generate_play_integrity_config(settings: dict[str, any]) -> GooglePlayIntegrityApiConfig:
+    signatures = [settings.get("certificate_digest")] if settings.get("certificate_digest") else None
 
     return GooglePlayIntegrityApiConfig(
         decryption_key=settings.get("decryption_key"),
@@ -43,22 +106,12 @@ def _generate_play_integrity_config(
         production=dreiattest_settings.DREIATTEST_PRODUCTION,
         allow_non_play_distribution=settings.get("allow_non_play_installs", False),
         verify_code_signature_hex=signatures,
-        required_device_verdict=settings.get(
-            "required_device_verdict", "MEETS_DEVICE_INTEGRITY"
-        ),
+        required_device_verdict=settings.get("required_device_verdict", "MEETS_DEVICE_INTEGRITY"),
     )
 
 
-def apple_config(app_id: str, public_key_id: str) -> list[AppleConfig]:
-    return [
-        _generate_apple_config(app_id=declared_app_id, public_key_id=public_key_id)
-        for declared_app_id in dreiattest_settings.DREIATTEST_APPLE_APPIDS
-        if _get_bundle_id(declared_app_id) == app_id
-    ]
-
-
-def _generate_apple_config(app_id: str, public_key_id: str) -> AppleConfig:
-    return AppleConfig(
+def _generate_apple_config(app_id: str, public_key_id: str) -> CachingAppleConfig:
+    return CachingAppleConfig(
         key_id=base64.b64decode(public_key_id),
         app_id=app_id,
         production=dreiattest_settings.DREIATTEST_PRODUCTION,
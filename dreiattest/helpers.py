@@ -1,10 +1,18 @@
 import json
+import re
+from collections.abc import Iterator
+from functools import cache
 from hashlib import sha256
-from typing import Optional
+from tempfile import SpooledTemporaryFile
 from uuid import UUID
 
 from django.core.handlers.wsgi import WSGIRequest
 
+from . import settings as dreiattest_settings
+
+# Size of the chunks in which a request body is read while hashing it
+HASH_CHUNK_SIZE = 64 * 1024
+
 
 def remove_scheme(uri: str, scheme: str) -> str:
     if uri.startswith(scheme):
@@ -13,28 +21,73 @@ def remove_scheme(uri: str, scheme: str) -> str:
 
 
 def request_hash(request: WSGIRequest, header_keys: list) -> bytes:
-    """Convert given request to a hash. The same hash is done on the client side and signed."""
+    """
+    Convert given request to a hash. The same hash is done on the client side and signed. It's the sha256 of the
+    uri, method, json encoded headers and body concatenated, the body is streamed into the hash though.
+    """
     uri = remove_scheme(request.build_absolute_uri(), request.scheme).encode()
     method = request.method.encode()
-    body = request.body
 
     headers = {key: request.headers.get(key) for key in filter(None, header_keys)}
-    headers_json = json.dumps(
-        headers, sort_keys=True, indent=None, separators=(",", ":")
-    )
+    headers_json = json.dumps(headers, sort_keys=True, indent=None, separators=(",", ":"))
+
+    digest = sha256(uri + method + headers_json.encode("utf-8"))
+    for chunk in _iter_body(request):
+        digest.update(chunk)
+
+    return digest.digest()
+
+
+def close_body_spool(request: WSGIRequest):
+    """Close the temporary file request_hash put the body of given request into, once the view is done with it."""
+    spool = getattr(request, "dreiattest_body_spool", None)
+    if spool is not None:
+        spool.close()
+
 
-    data = uri + method + headers_json.encode("utf-8") + body
+def _iter_body(request: WSGIRequest) -> Iterator[bytes]:
+    """
+    Yield the body of given request in chunks. If the body wasn't read yet, the request stream is tee'd into a
+    temporary file which is spooled to disk above DREIATTEST_BODY_SPOOL_MAX_MEMORY_SIZE. The file then replaces the
+    request stream, so the body can still be read by the view, and is closed by close_body_spool.
+    """
+    # Django doesn't tell publicly if the body was read already
+    if hasattr(request, "_body") or request._read_started:
+        yield request.body
+        return
 
-    return sha256(data).digest()
+    # Outlives this function, it's closed by close_body_spool after the view
+    spool = SpooledTemporaryFile(max_size=dreiattest_settings.DREIATTEST_BODY_SPOOL_MAX_MEMORY_SIZE)  # noqa: SIM115
+    request.dreiattest_body_spool = spool
+    while chunk := request.read(HASH_CHUNK_SIZE):
+        spool.write(chunk)
+        yield chunk
 
+    spool.seek(0)
+    request._stream = spool
+    request._read_started = False
 
-def is_valid_uuid(uuid: Optional[str] = None, version=4) -> bool:
+
+def uid_cache_key(prefix: str, user_id: str, session_id: UUID) -> str:
+    """Return the key of given device session in a django cache, e.g. dreiattest:failures:<hash>."""
+    # The user id is chosen by the client, hash it so the key is valid for every cache backend
+    uid = sha256(f"{user_id};{str(session_id).lower()}".encode()).hexdigest()
+
+    return f"{prefix}:{uid}"
+
+
+def is_valid_uuid(uuid: str | None = None, version=4) -> bool:
+    """Check if given string is a uuid of given version in its canonical form, upper or lower case."""
     if not uuid:
         return False
 
-    try:
-        uuid_obj = UUID(uuid, version=version)
-    except ValueError:
-        return False
+    return _uuid_pattern(version).fullmatch(uuid) is not None
+
 
-    return str(uuid_obj).lower() == uuid.lower()
+@cache
+def _uuid_pattern(version: int) -> re.Pattern:
+    # The variant bits of RFC 4122 uuids are 10, so the first digit of the fourth group is one of 8, 9, a and b
+    return re.compile(
+        rf"[0-9a-f]{{8}}-[0-9a-f]{{4}}-{version}[0-9a-f]{{3}}-[89ab][0-9a-f]{{3}}-[0-9a-f]{{12}}",
+        re.IGNORECASE,
+    )
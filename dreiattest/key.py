@@ -1,77 +1,342 @@
+import asyncio
 import base64
 import json
+import logging
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import AbstractContextManager, nullcontext
+from functools import cache
 from hashlib import sha256
 from json import JSONDecodeError
-from typing import Tuple
 
-from asn1crypto import pem
+from asgiref.sync import sync_to_async
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric.ec import EllipticCurvePublicKey
+from cryptography.hazmat.primitives.asymmetric.ec import SECP256R1, EllipticCurvePublicKey
 from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from cryptography.hazmat.primitives.asymmetric.types import PublicKeyTypes
 from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections, connections
 from django.utils.module_loading import import_string
 from pyattest.attestation import Attestation
 from pyattest.configs.config import Config
-from pyattest.exceptions import PyAttestException, InvalidAppIdException
+from pyattest.exceptions import InvalidAppIdException, PyAttestException
 
 from dreiattest import settings as dreiattest_settings
+from dreiattest.context import request_context
+from dreiattest.counters import assertion_counters
 from dreiattest.exceptions import (
-    InvalidPayloadException,
+    ExecutorBusyException,
     InvalidDriverException,
+    InvalidPayloadException,
     UnsupportedEncryptionException,
 )
-from dreiattest.models import Nonce, Key, DeviceSession
+from dreiattest.executors import (
+    BoundedExecutor,
+    get_attestation_executor,
+    get_plugin_executor,
+    run_in_verify_executor,
+)
+from dreiattest.metrics import RequestMetrics, disabled_metrics
+from dreiattest.models import DeviceSession, Key, Nonce
+from dreiattest.plugins import BasePlugin
+from dreiattest.public_key_cache import public_key_cache
+from dreiattest.throttling import areset_failures, reset_failures
+
 from .generate_config import (
     apple_config,
-    google_safety_net_config,
     google_play_integrity_api_config,
+    google_safety_net_config,
 )
 
-_dreiattest_app_id_header = dreiattest_settings.DREIATTEST_APPID_HEADER
+logger = logging.getLogger("dreiattest")
+
+
+@cache
+def get_plugins() -> list[BasePlugin]:
+    """Import and instantiate the configured plugins once, they are shared by all key registrations."""
+    return [import_string(plugin)() for plugin in dreiattest_settings.DREIATTEST_PLUGINS]
 
 
 def resolve_plugins(request: WSGIRequest, attestation: Attestation):
-    plugins = []
-    for plugin in dreiattest_settings.DREIATTEST_PLUGINS:
-        mod = import_string(plugin)
-        plugins.append(mod)
+    """Run all synchronous plugins. They are run before the key is stored and can reject it by raising."""
+    for plugin in get_plugins():
+        if not getattr(plugin, "deferred", False):
+            plugin.run(request, attestation)
+
 
-    for plugin in plugins:
-        plugin().run(request, attestation)
+def defer_plugins(request: WSGIRequest, attestation: Attestation):
+    """Hand all deferred plugins to the plugin executor. If its queue is full they are run right away."""
+    for plugin in get_plugins():
+        if not getattr(plugin, "deferred", False):
+            continue
+
+        try:
+            get_plugin_executor().submit(_run_plugin_in_background, plugin, request, attestation)
+        except ExecutorBusyException:
+            logger.warning("Plugin queue is full, running %s inline", plugin.__class__.__name__)
+            _run_deferred_plugin(plugin, request, attestation)
+
+
+def _run_deferred_plugin(plugin: BasePlugin, request: WSGIRequest, attestation: Attestation):
+    try:
+        plugin.run(request, attestation)
+    except Exception:
+        logger.exception("Deferred plugin %s failed", plugin.__class__.__name__)
+
+
+def _run_plugin_in_background(plugin: BasePlugin, request: WSGIRequest, attestation: Attestation):
+    try:
+        _run_deferred_plugin(plugin, request, attestation)
+    finally:
+        # Background threads are not covered by the request signals which normally clean up db connections
+        close_old_connections()
 
 
 def key_from_request(
-    request: WSGIRequest, nonce: Nonce, device_session: DeviceSession
+    request: WSGIRequest,
+    nonce: Nonce,
+    device_session: DeviceSession,
+    metrics: RequestMetrics = disabled_metrics,
 ) -> Key:
     """
     Get the public key from given request, validate the attestation and either create or update the given key
-    for that session.
+    for that session. The given nonce needs to be consumed already, see nonce_from_request.
     """
-    nonce.mark_used()
+    app_id, data = _payload_from_request(request)
+    request_context(request).driver = data.get("driver", None)
+    metrics.set_labels(request_context(request).driver, app_id)
+    with metrics.phase("attestation_verify"):
+        attestation, defaults = verify_attestation_in_pool(app_id, data, device_session, nonce)
+
+    with metrics.phase("plugins"):
+        resolve_plugins(request, attestation)
+
+    with metrics.phase("key_store"):
+        key = store_key(device_session, defaults)
+    public_key_cache.invalidate(key.pk)
+    assertion_counters.invalidate(key.pk)
+    reset_failures(device_session.user_id, device_session.session_id)
+    defer_plugins(request, attestation)
+
+    return key
+
+
+async def akey_from_request(
+    request: WSGIRequest,
+    nonce: Nonce,
+    device_session: DeviceSession,
+    metrics: RequestMetrics = disabled_metrics,
+) -> Key:
+    """Async version of key_from_request, the attestation is verified in an executor."""
+    app_id, data = _payload_from_request(request)
+    request_context(request).driver = data.get("driver", None)
+    metrics.set_labels(request_context(request).driver, app_id)
+    with metrics.phase("attestation_verify"):
+        attestation, defaults = await averify_attestation_in_pool(app_id, data, device_session, nonce)
+
+    with metrics.phase("plugins"):
+        await sync_to_async(resolve_plugins)(request, attestation)
+
+    with metrics.phase("key_store"):
+        key = await astore_key(device_session, defaults)
+    public_key_cache.invalidate(key.pk)
+    assertion_counters.invalidate(key.pk)
+    await areset_failures(device_session.user_id, device_session.session_id)
+    await sync_to_async(defer_plugins)(request, attestation)
+
+    return key
 
-    try:
-        data = json.loads(request.body.decode())
-    except JSONDecodeError:
-        raise InvalidPayloadException
 
-    app_id = request.META.get(_dreiattest_app_id_header, None)
-    driver = data.get("driver", None)
-    driver_handler = drivers.get(driver, None)
+def store_key(device_session: DeviceSession, defaults: dict) -> Key:
+    """
+    Insert the key of given session or replace its existing key with a single upsert statement if the database
+    supports it. The fields of the key are given by defaults, see verify_attestation.
+    """
+    features = connections[Key.objects.db].features
+    if not features.supports_update_conflicts:
+        key, _ = Key.objects.update_or_create(device_session=device_session, defaults=defaults)
+        return key
+
+    key = Key(device_session=device_session, **defaults)
+    Key.objects.bulk_create([key], **_upsert_options(defaults, features))
+
+    # Backends like MySQL don't return the primary key of upserted rows
+    if key.pk is None:
+        key = Key.objects.get(device_session=device_session)
+
+    return key
+
+
+async def astore_key(device_session: DeviceSession, defaults: dict) -> Key:
+    """Async version of store_key."""
+    features = connections[Key.objects.db].features
+    if not features.supports_update_conflicts:
+        key, _ = await Key.objects.aupdate_or_create(device_session=device_session, defaults=defaults)
+        return key
+
+    key = Key(device_session=device_session, **defaults)
+    await Key.objects.abulk_create([key], **_upsert_options(defaults, features))
+
+    if key.pk is None:
+        key = await Key.objects.aget(device_session=device_session)
+
+    return key
+
+
+def _upsert_options(defaults: dict, features) -> dict:
+    options = {
+        "update_conflicts": True,
+        "update_fields": [*defaults, "updated_at"],
+    }
+    # MySQL and MariaDB don't take a conflict target, they update on the unique constraint of the device session
+    if features.supports_update_conflicts_with_target:
+        options["unique_fields"] = ["device_session"]
+
+    return options
+
+
+def verify_attestation(
+    app_id: str,
+    data: dict,
+    device_session: DeviceSession,
+    nonce: Nonce,
+    configs: list[Config] | None = None,
+) -> tuple[Attestation, dict]:
+    """Verify the attestation of a key request and return it together with the fields of the key to store."""
+    driver = data.get("driver")
+    driver_handler = drivers.get(driver)
     if not driver_handler:
         raise InvalidDriverException
 
-    attestation, public_key = driver_handler(app_id, data, device_session, nonce)
-    data = {
-        "public_key": public_key,
-        "public_key_id": get_key_id(public_key),
+    if configs is None:
+        configs = configs_for_driver(driver, app_id, data)
+
+    attestation, der_public_key = driver_handler(data, device_session, nonce, configs)
+    defaults = {
+        **key_fields(der_public_key),
         "driver": driver,
+        "assertion_counter": None,
     }
 
-    resolve_plugins(request, attestation)
+    return attestation, defaults
 
-    key, _ = Key.objects.update_or_create(device_session=device_session, defaults=data)
 
-    return key
+def configs_for_driver(driver: str, app_id: str, data: dict) -> list[Config]:
+    """Return the pyattest configs an attestation of given driver and app id is verified with."""
+    if driver == "google":
+        return google_safety_net_config()
+
+    if driver == "google_play_integrity_api":
+        return google_play_integrity_api_config(app_id=app_id)
+
+    if driver == "apple":
+        public_key_id = data.get("key_id")  # base64 encoded
+        if not public_key_id:
+            raise InvalidPayloadException
+
+        return apple_config(app_id=app_id, public_key_id=public_key_id)
+
+    raise InvalidDriverException
+
+
+def _verify_attestation_in_process(
+    app_id: str, data: dict, device_session: DeviceSession, nonce: Nonce
+) -> tuple[Attestation, dict, int]:
+    configs = configs_for_driver(data.get("driver"), app_id, data)
+    attestation, defaults = verify_attestation(app_id, data, device_session, nonce, configs)
+
+    # Some configs hold loaded keys which can't be pickled. The calling process has the same configs, so we only
+    # send back which one verified the attestation.
+    config_index = configs.index(attestation.config)
+    attestation.config = None
+
+    return attestation, defaults, config_index
+
+
+def _submit_attestation(
+    executor: BoundedExecutor,
+    app_id: str,
+    data: dict,
+    device_session: DeviceSession,
+    nonce: Nonce,
+) -> tuple[Future, list[Config]]:
+    # Requests with an unknown driver or app id are rejected before they take up a slot in the pool
+    configs = configs_for_driver(data.get("driver"), app_id, data)
+    if not configs:
+        raise InvalidAppIdException
+
+    future = executor.submit(_verify_attestation_in_process, app_id, data, device_session, nonce)
+
+    return future, configs
+
+
+def _attestation_from_process(result: tuple[Attestation, dict, int], configs: list[Config]) -> tuple[Attestation, dict]:
+    attestation, defaults, config_index = result
+    attestation.config = configs[config_index]
+
+    return attestation, defaults
+
+
+def verify_attestation_in_pool(
+    app_id: str, data: dict, device_session: DeviceSession, nonce: Nonce
+) -> tuple[Attestation, dict]:
+    """
+    Verify the attestation in the attestation process pool if it's enabled. An ExecutorBusyException is raised if the
+    pool has too many pending verifications or the verification doesn't finish within DREIATTEST_ATTESTATION_TIMEOUT.
+    """
+    executor = get_attestation_executor()
+    if not executor:
+        return verify_attestation(app_id, data, device_session, nonce)
+
+    future, configs = _submit_attestation(executor, app_id, data, device_session, nonce)
+    try:
+        result = future.result(timeout=dreiattest_settings.DREIATTEST_ATTESTATION_TIMEOUT)
+    except FutureTimeoutError as error:
+        future.cancel()
+        raise ExecutorBusyException from error
+
+    return _attestation_from_process(result, configs)
+
+
+async def averify_attestation_in_pool(
+    app_id: str, data: dict, device_session: DeviceSession, nonce: Nonce
+) -> tuple[Attestation, dict]:
+    """Async version of verify_attestation_in_pool, without a pool the verify executor is used."""
+    executor = get_attestation_executor()
+    if not executor:
+        return await run_in_verify_executor(verify_attestation, app_id, data, device_session, nonce)
+
+    future, configs = _submit_attestation(executor, app_id, data, device_session, nonce)
+    try:
+        result = await asyncio.wait_for(
+            asyncio.wrap_future(future),
+            timeout=dreiattest_settings.DREIATTEST_ATTESTATION_TIMEOUT,
+        )
+    except TimeoutError as error:
+        raise ExecutorBusyException from error
+
+    return _attestation_from_process(result, configs)
+
+
+def reserve_attestation_slot() -> AbstractContextManager:
+    """
+    Reserve a slot of the attestation process pool for the key registration of the current request, if the pool is
+    enabled. A busy pool is rejected before the nonce of the request is used up, so the client can retry with it.
+    """
+    executor = get_attestation_executor()
+    if not executor:
+        return nullcontext()
+
+    return executor.reserve()
+
+
+def _payload_from_request(request: WSGIRequest) -> tuple[str, dict]:
+    try:
+        data = json.loads(request.body.decode())
+    except JSONDecodeError as error:
+        raise InvalidPayloadException from error
+
+    return request_context(request).app_id, data
 
 
 def get_key_id(pem_public_key: str) -> str:
@@ -82,82 +347,85 @@ def get_key_id(pem_public_key: str) -> str:
     we use them in the unit tests.
     """
     public_key = serialization.load_pem_public_key(pem_public_key.encode())
-    if isinstance(public_key, EllipticCurvePublicKey):
-        public_key_formatted = public_key.public_bytes(
-            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
-        )
-    elif isinstance(public_key, RSAPublicKey):
-        public_key_formatted = public_key.public_bytes(
-            serialization.Encoding.DER, serialization.PublicFormat.PKCS1
+
+    return base64.b64encode(sha256(_key_id_format(public_key)).digest()).decode()
+
+
+def key_fields(der_public_key: bytes) -> dict:
+    """
+    Return the key fields of the Key model for given DER encoded SubjectPublicKeyInfo. The key is parsed once, it's
+    stored as PEM or in binary depending on DREIATTEST_KEY_STORAGE.
+    """
+    try:
+        public_key = serialization.load_der_public_key(der_public_key)
+    except ValueError as error:
+        raise InvalidPayloadException from error
+
+    formatted = _key_id_format(public_key)
+    digest = sha256(formatted).digest()
+    fields = {"public_key_id": base64.b64encode(digest).decode()}
+
+    if dreiattest_settings.DREIATTEST_KEY_STORAGE == "binary":
+        is_p256 = isinstance(public_key, EllipticCurvePublicKey) and isinstance(public_key.curve, SECP256R1)
+        fields.update(
+            public_key="",
+            public_key_raw=formatted if is_p256 else der_public_key,
+            public_key_id_raw=digest,
         )
     else:
-        raise UnsupportedEncryptionException
-
-    return base64.b64encode(sha256(public_key_formatted).digest()).decode()
+        pem_public_key = public_key.public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        fields.update(
+            public_key=pem_public_key.decode(),
+            public_key_raw=None,
+            public_key_id_raw=None,
+        )
 
+    return fields
 
-def google(
-    data: dict, device_session: DeviceSession, nonce: Nonce, configs: list[Config]
-) -> Tuple[Attestation, str]:
-    attestation = data.get("attestation", None)
-    public_key = data.get("public_key", None)  # base64 encoded
-    if not attestation or not public_key:
-        raise InvalidPayloadException
 
-    nonce = str(device_session) + public_key + nonce.value
-    nonce = sha256(nonce.encode()).digest()
+def _key_id_format(public_key: PublicKeyTypes) -> bytes:
+    """Serialize given key the way its id is hashed from."""
+    if isinstance(public_key, EllipticCurvePublicKey):
+        return public_key.public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
 
-    attestation = _verify_with_configs(
-        attestation_data=attestation, nonce=nonce, configs=configs
-    )
+    if isinstance(public_key, RSAPublicKey):
+        return public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.PKCS1)
 
-    # For the google driver the public_key_id is actually the base64 encoded public key
-    public_key = serialization.load_der_public_key(base64.b64decode(public_key))
-    public_key = public_key.public_bytes(
-        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
-    )
+    raise UnsupportedEncryptionException
 
-    return attestation, public_key.decode()
 
+def google(data: dict, device_session: DeviceSession, nonce: Nonce, configs: list[Config]) -> tuple[Attestation, bytes]:
+    attestation = data.get("attestation")
+    public_key = data.get("public_key")  # base64 encoded
+    if not attestation or not public_key:
+        raise InvalidPayloadException
 
-def google_safety_net(
-    app_id: str, data: dict, device_session: DeviceSession, nonce: Nonce
-) -> Tuple[Attestation, str]:
-    configs = google_safety_net_config()
-    return google(data, device_session, nonce, configs)
+    nonce = str(device_session) + public_key + nonce.value
+    nonce = sha256(nonce.encode()).digest()
 
+    attestation = _verify_with_configs(attestation_data=attestation, nonce=nonce, configs=configs)
 
-def google_play_integrity_api(
-    app_id: str, data: dict, device_session: DeviceSession, nonce: Nonce
-) -> Tuple[Attestation, str]:
-    configs = google_play_integrity_api_config(app_id=app_id)
-    return google(data, device_session, nonce, configs)
+    # The google driver sends the DER encoded public key itself, its id is derived from it
+    return attestation, base64.b64decode(public_key)
 
 
-def apple(
-    app_id: str, data: dict, device_session: DeviceSession, nonce: Nonce
-) -> Tuple[Attestation, str]:
-    attestation = base64.b64decode(data.get("attestation", None))
-    public_key_id = data.get("key_id", None)  # base64 encoded
+def apple(data: dict, device_session: DeviceSession, nonce: Nonce, configs: list[Config]) -> tuple[Attestation, bytes]:
+    attestation = base64.b64decode(data.get("attestation"))
+    public_key_id = data.get("key_id")  # base64 encoded
     if not attestation or not public_key_id:
         raise InvalidPayloadException
 
-    configs = apple_config(app_id=app_id, public_key_id=public_key_id)
-
     nonce = (str(device_session) + public_key_id + nonce.value).encode()
-    attestation = _verify_with_configs(
-        attestation_data=attestation, nonce=nonce, configs=configs
-    )
+    attestation = _verify_with_configs(attestation_data=attestation, nonce=nonce, configs=configs)
 
     certificate = attestation.data.get("certs")[-1]
-    public_key = pem.armor("PUBLIC KEY", certificate.public_key.dump()).decode()
 
-    return attestation, public_key
+    return attestation, certificate.public_key.dump()
 
 
-def _verify_with_configs(
-    attestation_data, nonce: bytes, configs: list[Config]
-) -> Attestation:
+def _verify_with_configs(attestation_data, nonce: bytes, configs: list[Config]) -> Attestation:
     if not configs:
         # If configs is empty that means the user did not configure anything for that app id
         raise InvalidAppIdException
@@ -181,7 +449,7 @@ def _verify_with_configs(
 
 
 drivers = {
-    "google": google_safety_net,
-    "google_play_integrity_api": google_play_integrity_api,
+    "google": google,
+    "google_play_integrity_api": google,
     "apple": apple,
 }
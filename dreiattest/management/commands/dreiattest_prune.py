@@ -0,0 +1,93 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, Max, Min, OuterRef, Q, QuerySet
+from django.db.models.deletion import ProtectedError
+from django.utils import timezone
+
+from dreiattest.models import DeviceSession, Key, Nonce
+from dreiattest.nonce_stores import NONCE_LIFETIME
+from dreiattest.session_registry import session_registry
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete used and expired nonces and device sessions that are not referenced anymore. Rows are deleted in "
+        "batches of primary key ranges, so the command can run continuously without long locks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Size of the primary key range deleted with one statement.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.1,
+            help="Seconds to wait after each batch that deleted rows.",
+        )
+        parser.add_argument(
+            "--session-max-age",
+            type=int,
+            default=24,
+            help="Hours since their last update after which unreferenced device sessions are deleted.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the rows that would be deleted.",
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        self.sleep = options["sleep"]
+        self.dry_run = options["dry_run"]
+        now = timezone.now()
+
+        # All relations are protected, so nonces and keys have to be gone before their device session can be deleted.
+        nonces = Nonce.objects.filter(Q(used_at__isnull=False) | Q(created_at__lt=now - NONCE_LIFETIME))
+        self.prune("nonces", nonces)
+
+        sessions = (
+            DeviceSession.objects.filter(updated_at__lt=now - timedelta(hours=options["session_max_age"]))
+            .exclude(Exists(Key.objects.filter(device_session=OuterRef("pk"))))
+            .exclude(Exists(Nonce.objects.filter(device_session=OuterRef("pk"))))
+        )
+        self.prune("device sessions", sessions, evict=session_registry.evict)
+
+    def prune(self, name: str, queryset: QuerySet, evict=None):
+        """Delete the rows of given queryset in batches. evict is called with the uids of deleted device sessions."""
+        bounds = queryset.model.objects.aggregate(first=Min("pk"), last=Max("pk"))
+        if bounds["first"] is None:
+            self.stdout.write(f"No {name} to delete")
+            return
+
+        total = 0
+        for start in range(bounds["first"], bounds["last"] + 1, self.batch_size):
+            batch = queryset.filter(pk__gte=start, pk__lt=start + self.batch_size)
+
+            if self.dry_run:
+                total += batch.count()
+                continue
+
+            uids = list(batch.values_list("user_id", "session_id")) if evict else []
+            try:
+                deleted, _ = batch.delete()
+            except ProtectedError:
+                # A row got referenced again since we selected it, it will be handled by one of the next runs
+                self.stderr.write(f"Skipped {name} between {start} and {start + self.batch_size}")
+                continue
+
+            if uids:
+                evict(uids)
+
+            total += deleted
+            if deleted and self.sleep:
+                time.sleep(self.sleep)
+
+        verb = "Would delete" if self.dry_run else "Deleted"
+        self.stdout.write(f"{verb} {total} {name}")
@@ -0,0 +1,194 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import cache
+from threading import Lock
+from time import perf_counter
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.utils.module_loading import import_string
+
+from . import settings as dreiattest_settings
+from .generate_config import is_configured_app_id
+
+
+class MetricsBackend(ABC):
+    """Receives the metrics of dreiattest, configured with DREIATTEST_METRICS_BACKEND."""
+
+    @abstractmethod
+    def observe(self, name: str, value: float, labels: dict[str, str]):
+        """Record a duration in seconds."""
+
+    @abstractmethod
+    def increment(self, name: str, labels: dict[str, str]):
+        """Increase a counter by one."""
+
+
+class InMemoryMetricsBackend(MetricsBackend):
+    """Aggregate the metrics in process memory as histograms and counters which can be rendered for Prometheus."""
+
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+    def __init__(self):
+        self._histograms: dict[tuple[str, tuple], list] = {}
+        self._counters: dict[tuple[str, tuple], int] = {}
+        self._lock = Lock()
+
+    def observe(self, name: str, value: float, labels: dict[str, str]):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Count per bucket (the last one is +Inf), sum and count
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+            histogram[0][bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def increment(self, name: str, labels: dict[str, str]):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {key: (list(value[0]), value[1], value[2]) for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            metric = f"dreiattest_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for (histogram_name, labels), (counts, total, count) in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+
+                cumulative = 0
+                for bound, bucket_count in zip((*self.buckets, "+Inf"), counts, strict=True):
+                    cumulative += bucket_count
+                    bucket_labels = (*labels, ("le", str(bound)))
+                    lines.append(f"{metric}_bucket{_render_labels(bucket_labels)} {cumulative}")
+
+                lines.append(f"{metric}_sum{_render_labels(labels)} {total}")
+                lines.append(f"{metric}_count{_render_labels(labels)} {count}")
+
+        for name in sorted({name for name, _ in counters}):
+            metric = f"dreiattest_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{metric}{_render_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _render_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RequestMetrics:
+    """
+    Collects the durations of the phases of a single request. They are reported together once the request is done,
+    so all of them carry the driver and app id, which are only known after some phases, and the outcome.
+    """
+
+    __slots__ = ("backend", "labels", "_phases", "_start")
+
+    def __init__(self, backend: MetricsBackend, view: str):
+        self.backend = backend
+        self.labels = {"view": view, "driver": "", "app_id": ""}
+        self._phases: list[tuple[str, float]] = []
+        self._start = perf_counter()
+
+    def __enter__(self) -> "RequestMetrics":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._phases.append(("total", perf_counter() - self._start))
+        labels = {**self.labels, "outcome": exc_type.__name__ if exc_type else "ok"}
+        for phase, duration in self._phases:
+            self.backend.observe("phase_duration_seconds", duration, {**labels, "phase": phase})
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._phases.append((name, perf_counter() - start))
+
+    def set_labels(self, driver: str | None, app_id: str | None):
+        # The app id is sent by the client, only configured ones are used as label to keep the number of series bounded
+        self.labels["driver"] = driver or ""
+        self.labels["app_id"] = app_id if is_configured_app_id(driver, app_id) else "unknown"
+
+
+class DisabledRequestMetrics:
+    """Stand-in for RequestMetrics if no backend is configured, it doesn't do anything."""
+
+    __slots__ = ()
+
+    _phase = nullcontext()
+
+    def __enter__(self) -> "DisabledRequestMetrics":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def phase(self, name: str) -> nullcontext:
+        return self._phase
+
+    def set_labels(self, driver: str | None, app_id: str | None):
+        pass
+
+
+disabled_metrics = DisabledRequestMetrics()
+
+
+@cache
+def get_metrics_backend() -> MetricsBackend | None:
+    if not dreiattest_settings.DREIATTEST_METRICS_BACKEND:
+        return None
+
+    return import_string(dreiattest_settings.DREIATTEST_METRICS_BACKEND)()
+
+
+def start_request_metrics(request: WSGIRequest, view: str):
+    """Start collecting the metrics of given request, use the returned object as context manager around the view."""
+    backend = get_metrics_backend()
+    if backend is None:
+        return disabled_metrics
+
+    metrics = RequestMetrics(backend, view)
+    request.dreiattest_metrics = metrics
+
+    return metrics
+
+
+def record_exception(request: WSGIRequest, code: str):
+    """Count an exception handled by the HandleDreiattestExceptionsMiddleware."""
+    backend = get_metrics_backend()
+    if backend is None:
+        return
+
+    labels = {"view": "", "driver": "", "app_id": ""}
+    metrics = getattr(request, "dreiattest_metrics", None)
+    if metrics is not None:
+        labels.update(metrics.labels)
+
+    backend.increment("exceptions", {**labels, "code": code})
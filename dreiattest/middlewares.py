@@ -1,23 +1,34 @@
-from cryptography.exceptions import InvalidSignature, InvalidKey
+import logging
+import re
+from functools import cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from cryptography.exceptions import InvalidKey, InvalidSignature
 from django.core.handlers.wsgi import WSGIRequest
 from django.http import JsonResponse
+from django.urls import Resolver404, resolve
 from pyattest.exceptions import (
-    PyAttestException,
-    InvalidNonceException,
+    ExtensionNotFoundException,
     InvalidCertificateChainException,
     InvalidKeyIdException,
-    ExtensionNotFoundException,
+    InvalidNonceException,
+    PyAttestException,
 )
 
+from dreiattest import settings as dreiattest_settings
+from dreiattest.context import request_context
+from dreiattest.decorators import averify_request, should_bypass, verify_request
+from dreiattest.exception_log import exception_log_limiter
 from dreiattest.exceptions import (
     DreiAttestException,
-    UnsupportedEncryptionException,
+    ExecutorBusyException,
     NoKeyForSessionException,
+    TooManyFailuresException,
+    UnsupportedEncryptionException,
 )
-from dreiattest import settings as dreiattest_settings
-import logging
-
-
+from dreiattest.helpers import close_body_spool
+from dreiattest.metrics import record_exception
+from dreiattest.tickets import has_valid_ticket
 
 relevant_base = (PyAttestException, DreiAttestException, InvalidSignature, InvalidKey)
 nonce_mismatch = (InvalidNonceException,)
@@ -29,11 +40,13 @@ invalid_key = (
     InvalidSignature,
     InvalidKey,
     NoKeyForSessionException,
+    TooManyFailuresException,
 )
 
 logger = logging.getLogger("dreiattest")
 
-class HandleDreiattestExceptionsMiddleware(object):
+
+class HandleDreiattestExceptionsMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
@@ -49,10 +62,53 @@ class HandleDreiattestExceptionsMiddleware(object):
         if code.endswith("Exception"):
             code = code[:-9]
 
-        logger.exception("Dreiattest-Exception", exc_info=exception)
+        record_exception(request, code)
+
+        if isinstance(exception, ExecutorBusyException):
+            return self.busy(code)
+
+        header = self.get_header(exception)
+        self.log(request, exception, code, header)
 
         response = JsonResponse(data={"code": code}, status=403)
-        response["Dreiattest-error"] = self.get_header(exception)
+        response["Dreiattest-error"] = header
+
+        return response
+
+    def log(self, request: WSGIRequest, exception: Exception, code: str, header: str):
+        """
+        Log a summary of a rejected request, rate limited per exception code so floods of invalid requests don't turn
+        into floods of tracebacks.
+        """
+        suppressed = exception_log_limiter.acquire(code)
+        if suppressed is None:
+            return
+
+        context = request_context(request)
+        summary = {
+            "code": code,
+            "header": header,
+            "driver": context.driver,
+            "app_id": context.app_id,
+            "suppressed": suppressed,
+        }
+        message = "Dreiattest-Exception: %(code)s (%(header)s), driver %(driver)s, app id %(app_id)s"
+        if suppressed:
+            message += ", %(suppressed)d similar suppressed"
+
+        if isinstance(exception, TooManyFailuresException):
+            # Throttled sessions are rejected before any verification, their traceback doesn't tell anything
+            logger.info(message, summary, extra={"dreiattest": summary})
+        else:
+            exc_info = exception if exception_log_limiter.with_traceback(code) else None
+            logger.error(message, summary, exc_info=exc_info, extra={"dreiattest": summary})
+
+    def busy(self, code: str):
+        """Overloaded workers are not the fault of the client, tell it to try again later."""
+        logger.warning("Dreiattest is busy, rejecting request")
+
+        response = JsonResponse(data={"code": code}, status=503)
+        response["Retry-After"] = str(dreiattest_settings.DREIATTEST_RETRY_AFTER)
 
         return response
 
@@ -65,3 +121,100 @@ class HandleDreiattestExceptionsMiddleware(object):
             return "dreiAttest_invalid_key"
 
         return "dreiAttest_policy_violation"
+
+
+@cache
+def get_path_matcher() -> re.Pattern | None:
+    """
+    Compile the include and exclude patterns of the SignatureRequiredMiddleware into a single regex. The dreiattest
+    endpoints are always excluded, their requests are not signed.
+    """
+    include = dreiattest_settings.DREIATTEST_SIGNATURE_REQUIRED_PATHS
+    if not include:
+        return None
+
+    exclude = [
+        re.escape(dreiattest_settings.DREIATTEST_BASE_URL) + "(?:nonce|key|batch)",
+        *dreiattest_settings.DREIATTEST_SIGNATURE_EXEMPT_PATHS,
+    ]
+
+    return re.compile(
+        "(?!{exclude})(?:{include})".format(
+            exclude="|".join(f"(?:{pattern})" for pattern in exclude),
+            include="|".join(f"(?:{pattern})" for pattern in include),
+        )
+    )
+
+
+class SignatureRequiredMiddleware:
+    """
+    Verify the signature of every request whose path matches DREIATTEST_SIGNATURE_REQUIRED_PATHS but none of
+    DREIATTEST_SIGNATURE_EXEMPT_PATHS, like signature_required does for single views. Invalid requests are answered
+    right away like the HandleDreiattestExceptionsMiddleware does, so they never reach the middlewares listed after this
+    one or the view. Tickets are accepted for the views of signature_required with a ticket_lifetime, which also issues
+    new ones for the requests verified here.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: WSGIRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if self.requires_signature(request):
+            try:
+                if not self.has_ticket(request):
+                    request.dreiattest_key = verify_request(request)
+            except relevant_base as exception:
+                return HandleDreiattestExceptionsMiddleware(None).handle(request, exception)
+
+            request.dreiattest_verified = True
+
+        try:
+            return self.get_response(request)
+        finally:
+            close_body_spool(request)
+
+    async def __acall__(self, request: WSGIRequest):
+        if self.requires_signature(request):
+            try:
+                if not self.has_ticket(request):
+                    request.dreiattest_key = await averify_request(request)
+            except relevant_base as exception:
+                return HandleDreiattestExceptionsMiddleware(None).handle(request, exception)
+
+            request.dreiattest_verified = True
+
+        try:
+            return await self.get_response(request)
+        finally:
+            close_body_spool(request)
+
+    @staticmethod
+    def requires_signature(request: WSGIRequest) -> bool:
+        # Patterns are matched against the start of the path without its leading slash, like django url patterns
+        matcher = get_path_matcher()
+        if matcher is None or not matcher.match(request.path_info.lstrip("/")):
+            return False
+
+        return not should_bypass(request)
+
+    @staticmethod
+    def has_ticket(request: WSGIRequest) -> bool:
+        """Check if given request carries a valid ticket of the signature_required view it is routed to."""
+        if not request_context(request).ticket:
+            return False
+
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+
+        ticket = getattr(match.func, "dreiattest_ticket", None)
+        return bool(ticket) and has_valid_ticket(request, *ticket)
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dreiattest', '0006_rename_devicesession_user_id_session_id_dreiattest__user_id_0e3f7c_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='key',
+            index=models.Index(fields=['device_session', '-id'], name='dreiattest__device__53bc62_idx'),
+        ),
+    ]
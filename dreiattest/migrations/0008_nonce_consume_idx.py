@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dreiattest', '0007_key_device_session_newest_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='nonce',
+            index=models.Index(fields=['device_session', 'value', 'used_at', 'created_at'], name='dreiattest__device__73ef1d_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dreiattest', '0008_nonce_consume_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='key',
+            name='assertion_counter',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
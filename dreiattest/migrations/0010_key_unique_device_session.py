@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def delete_superseded_keys(apps, schema_editor):
+    """Only the newest key of a session was ever used, drop the older ones before they become a constraint violation."""
+    Key = apps.get_model("dreiattest", "Key")
+    newer_keys = Key.objects.filter(device_session=OuterRef("device_session"), id__gt=OuterRef("id"))
+    Key.objects.using(schema_editor.connection.alias).filter(Exists(newer_keys)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dreiattest', '0009_key_assertion_counter'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_superseded_keys, migrations.RunPython.noop),
+        # The index of the constraint replaces the others, it needs to exist before them being dropped on MySQL
+        migrations.AddConstraint(
+            model_name='key',
+            constraint=models.UniqueConstraint(fields=('device_session',), name='dreiattest_key_unique_device_session'),
+        ),
+        migrations.RemoveIndex(
+            model_name='key',
+            name='dreiattest__device__53bc62_idx',
+        ),
+        migrations.AlterField(
+            model_name='key',
+            name='device_session',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='dreiattest.devicesession'),
+        ),
+    ]
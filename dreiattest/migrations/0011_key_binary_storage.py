@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dreiattest', '0010_key_unique_device_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='key',
+            name='public_key_id_raw',
+            field=models.BinaryField(max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='key',
+            name='public_key_raw',
+            field=models.BinaryField(null=True),
+        ),
+    ]
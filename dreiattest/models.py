@@ -1,15 +1,28 @@
-from datetime import datetime
+from cryptography.hazmat.primitives.asymmetric.ec import (
+    SECP256R1,
+    EllipticCurvePublicKey,
+)
+from cryptography.hazmat.primitives.asymmetric.types import PublicKeyTypes
+from cryptography.hazmat.primitives.serialization.base import (
+    load_der_public_key,
+    load_pem_public_key,
+)
 from django.db.models import (
-    Model,
+    PROTECT,
+    BigIntegerField,
+    BinaryField,
     CharField,
-    UUIDField,
     DateTimeField,
     ForeignKey,
-    PROTECT,
-    TextField,
     Index,
+    Model,
+    TextField,
+    UniqueConstraint,
+    UUIDField,
 )
-from cryptography.hazmat.primitives.serialization.base import load_pem_public_key
+
+# Length of an uncompressed X9.62 point of a P-256 key, the keys of apple and google attestations
+X962_P256_LENGTH = 65
 
 
 class DeviceSession(Model):
@@ -33,18 +46,40 @@ class Nonce(Model):
     created_at = DateTimeField(auto_now_add=True)
     updated_at = DateTimeField(auto_now=True)
 
-    def mark_used(self):
-        self.used_at = datetime.now()
-        self.save()
+    class Meta:
+        indexes = [Index(fields=["device_session", "value", "used_at", "created_at"])]
 
 
 class Key(Model):
-    device_session = ForeignKey(DeviceSession, on_delete=PROTECT)
+    # Indexed by the unique constraint below
+    device_session = ForeignKey(DeviceSession, on_delete=PROTECT, db_index=False)
     public_key_id = CharField(max_length=255)
     public_key = TextField()
+    # Binary storage of the key, see DREIATTEST_KEY_STORAGE: the uncompressed X9.62 point of P-256 keys or the DER
+    # SubjectPublicKeyInfo of other keys, and the raw sha256 digest behind public_key_id
+    public_key_raw = BinaryField(null=True)
+    public_key_id_raw = BinaryField(max_length=32, null=True)
     driver = CharField(max_length=255)
+    # Highest counter of the apple assertions signed with this key, written behind by the AssertionCounterTracker
+    assertion_counter = BigIntegerField(null=True)
     created_at = DateTimeField(auto_now_add=True)
     updated_at = DateTimeField(auto_now=True)
 
-    def load_pem(self):
-        return load_pem_public_key(self.public_key.encode())
+    class Meta:
+        # A session has a single key, registering a new one replaces it
+        constraints = [UniqueConstraint(fields=["device_session"], name="dreiattest_key_unique_device_session")]
+
+    def load_pem(self) -> PublicKeyTypes:
+        """Kept for compatibility, the key is loaded from whichever format it's stored in."""
+        return self.load_public_key()
+
+    def load_public_key(self) -> PublicKeyTypes:
+        """Load the key from its binary storage if it has one, otherwise from the PEM of keys stored before."""
+        if not self.public_key_raw:
+            return load_pem_public_key(self.public_key.encode())
+
+        raw = bytes(self.public_key_raw)
+        if len(raw) == X962_P256_LENGTH and raw[0] == 0x04:
+            return EllipticCurvePublicKey.from_encoded_point(SECP256R1(), raw)
+
+        return load_der_public_key(raw)
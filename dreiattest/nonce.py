@@ -1,38 +1,44 @@
-import base64
-import os
-from datetime import timedelta, datetime
-
 from django.core.handlers.wsgi import WSGIRequest
 
 from dreiattest.models import DeviceSession, Nonce
-from . import settings as dreiattest_settings
+
+from .context import request_context
 from .exceptions import InvalidHeaderException
+from .nonce_stores import get_nonce_store
 
 
 def create_nonce(device_session: DeviceSession) -> Nonce:
-    value = base64.b64encode(os.urandom(32)).decode()
+    return get_nonce_store().create(device_session)
 
-    nonce = Nonce(device_session=device_session, value=value)
-    nonce.save()
 
-    return nonce
+async def acreate_nonce(device_session: DeviceSession) -> Nonce:
+    return await get_nonce_store().acreate(device_session)
 
 
 def nonce_from_request(request: WSGIRequest, device_session: DeviceSession) -> Nonce:
-    """Get the nonce from given request. If the data is not present or valid an exception is raised."""
-    header = request.META.get(dreiattest_settings.DREIATTEST_NONCE_HEADER, None)
-    if not header:
+    """
+    Get the nonce from given request and mark it as used. If the data is not present or valid an exception is
+    raised.
+    """
+    nonce = get_nonce_store().consume(device_session, _nonce_header(request))
+    if not nonce:
         raise InvalidHeaderException
 
-    one_minute_ago = datetime.now() - timedelta(minutes=1)
-    nonce = Nonce.objects.filter(
-        value=header,
-        device_session=device_session,
-        used_at__isnull=True,
-        created_at__gte=one_minute_ago,
-    ).first()
+    return nonce
+
 
+async def anonce_from_request(request: WSGIRequest, device_session: DeviceSession) -> Nonce:
+    """Async version of nonce_from_request."""
+    nonce = await get_nonce_store().aconsume(device_session, _nonce_header(request))
     if not nonce:
         raise InvalidHeaderException
 
     return nonce
+
+
+def _nonce_header(request: WSGIRequest) -> str:
+    header = request_context(request).nonce
+    if not header:
+        raise InvalidHeaderException
+
+    return header
@@ -0,0 +1,254 @@
+import base64
+import binascii
+import os
+import struct
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import cache
+from threading import Lock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db.models import QuerySet
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.module_loading import import_string
+
+from . import settings as dreiattest_settings
+from .models import DeviceSession, Nonce
+
+# A nonce can only be used within this timespan after it was issued
+NONCE_LIFETIME = timedelta(minutes=1)
+
+
+class BaseNonceStore(ABC):
+    """
+    Persists the nonces handed out by the nonce endpoint until they are used for a key registration. Stores that
+    don't keep nonces in the database return unsaved Nonce instances, only `value` and `device_session` are relevant
+    for the key registration.
+    """
+
+    @abstractmethod
+    def create(self, device_session: DeviceSession) -> Nonce: ...
+
+    @abstractmethod
+    def consume(self, device_session: DeviceSession, value: str) -> Nonce | None:
+        """
+        Mark the matching nonce as used and return it if it was issued for given session, is not used yet and not
+        expired. This needs to be atomic, a nonce must never be returned twice.
+        """
+
+    # The async versions run the sync methods in a thread by default, stores should override them where possible
+    async def acreate(self, device_session: DeviceSession) -> Nonce:
+        return await sync_to_async(self.create)(device_session)
+
+    async def aconsume(self, device_session: DeviceSession, value: str) -> Nonce | None:
+        return await sync_to_async(self.consume)(device_session, value)
+
+    @staticmethod
+    def generate_value() -> str:
+        return base64.b64encode(os.urandom(32)).decode()
+
+
+class ModelNonceStore(BaseNonceStore):
+    """Keep nonces in the database using the Nonce model."""
+
+    def create(self, device_session: DeviceSession) -> Nonce:
+        nonce = Nonce(device_session=device_session, value=self.generate_value())
+        nonce.save()
+
+        return nonce
+
+    async def acreate(self, device_session: DeviceSession) -> Nonce:
+        nonce = Nonce(device_session=device_session, value=self.generate_value())
+        await nonce.asave()
+
+        return nonce
+
+    def consume(self, device_session: DeviceSession, value: str) -> Nonce | None:
+        """A single conditional update, the affected row count tells us if the nonce was valid."""
+        now = timezone.now()
+        consumed = self._unused(device_session, value, now).update(used_at=now, updated_at=now)
+
+        if not consumed:
+            return None
+
+        return Nonce(device_session=device_session, value=value, used_at=now)
+
+    async def aconsume(self, device_session: DeviceSession, value: str) -> Nonce | None:
+        now = timezone.now()
+        consumed = await self._unused(device_session, value, now).aupdate(used_at=now, updated_at=now)
+
+        if not consumed:
+            return None
+
+        return Nonce(device_session=device_session, value=value, used_at=now)
+
+    @staticmethod
+    def _unused(device_session: DeviceSession, value: str, now: datetime) -> QuerySet:
+        return Nonce.objects.filter(
+            device_session=device_session,
+            value=value,
+            used_at__isnull=True,
+            created_at__gte=now - NONCE_LIFETIME,
+        )
+
+
+class CacheNonceStore(BaseNonceStore):
+    """Keep nonces in the django cache configured by DREIATTEST_NONCE_CACHE, expiring them with the cache timeout."""
+
+    def __init__(self):
+        self.cache = caches[dreiattest_settings.DREIATTEST_NONCE_CACHE]
+
+    def create(self, device_session: DeviceSession) -> Nonce:
+        nonce = Nonce(device_session=device_session, value=self.generate_value())
+        self.cache.set(
+            self._cache_key(device_session, nonce.value),
+            True,
+            timeout=NONCE_LIFETIME.total_seconds(),
+        )
+
+        return nonce
+
+    async def acreate(self, device_session: DeviceSession) -> Nonce:
+        nonce = Nonce(device_session=device_session, value=self.generate_value())
+        await self.cache.aset(
+            self._cache_key(device_session, nonce.value),
+            True,
+            timeout=NONCE_LIFETIME.total_seconds(),
+        )
+
+        return nonce
+
+    def consume(self, device_session: DeviceSession, value: str) -> Nonce | None:
+        # Only one of multiple concurrent deletes of the same key reports a deleted entry
+        if not self.cache.delete(self._cache_key(device_session, value)):
+            return None
+
+        return Nonce(device_session=device_session, value=value)
+
+    async def aconsume(self, device_session: DeviceSession, value: str) -> Nonce | None:
+        if not await self.cache.adelete(self._cache_key(device_session, value)):
+            return None
+
+        return Nonce(device_session=device_session, value=value)
+
+    @staticmethod
+    def _cache_key(device_session: DeviceSession, value: str) -> str:
+        return f"dreiattest:nonce:{device_session.pk}:{value}"
+
+
+class MemoryNonceStore(BaseNonceStore):
+    """Keep nonces in the memory of the current process. This is only meant to be used in tests."""
+
+    def __init__(self):
+        self._expires_at: OrderedDict[tuple[int, str], float] = OrderedDict()
+        self._lock = Lock()
+
+    def create(self, device_session: DeviceSession) -> Nonce:
+        nonce = Nonce(device_session=device_session, value=self.generate_value())
+        now = time.monotonic()
+
+        with self._lock:
+            # All nonces share the same lifetime, so the oldest ones are always at the front
+            while self._expires_at and next(iter(self._expires_at.values())) < now:
+                self._expires_at.popitem(last=False)
+
+            self._expires_at[(device_session.pk, nonce.value)] = now + NONCE_LIFETIME.total_seconds()
+
+        return nonce
+
+    def consume(self, device_session: DeviceSession, value: str) -> Nonce | None:
+        with self._lock:
+            expires_at = self._expires_at.pop((device_session.pk, value), None)
+
+        if expires_at is None or expires_at < time.monotonic():
+            return None
+
+        return Nonce(device_session=device_session, value=value)
+
+    async def acreate(self, device_session: DeviceSession) -> Nonce:
+        return self.create(device_session)
+
+    async def aconsume(self, device_session: DeviceSession, value: str) -> Nonce | None:
+        return self.consume(device_session, value)
+
+
+class SignedNonceStore(BaseNonceStore):
+    """
+    Stateless nonces carrying a random id and their issue time, bound to the device session by a HMAC under
+    DREIATTEST_SIGNING_SECRET. Nothing is persisted when a nonce is issued. Used nonce ids are remembered in the django
+    cache configured by DREIATTEST_NONCE_CACHE until the nonce expires, use a cache shared by all processes.
+    """
+
+    key_salt = "dreiattest.nonce_stores.SignedNonceStore"
+    id_length = 16
+    _issued_at = struct.Struct("!Q")
+
+    def __init__(self):
+        self.lifetime = int(NONCE_LIFETIME.total_seconds())
+        self.cache = caches[dreiattest_settings.DREIATTEST_NONCE_CACHE]
+
+    def create(self, device_session: DeviceSession) -> Nonce:
+        payload = os.urandom(self.id_length) + self._issued_at.pack(int(time.time()))
+        value = base64.b64encode(payload + self._sign(device_session, payload))
+
+        return Nonce(device_session=device_session, value=value.decode())
+
+    def consume(self, device_session: DeviceSession, value: str) -> Nonce | None:
+        unpacked = self._unpack(device_session, value)
+        # Only the first of multiple concurrent adds of the same key succeeds
+        if not unpacked or not self.cache.add(*self._used_entry(*unpacked)):
+            return None
+
+        return Nonce(device_session=device_session, value=value)
+
+    async def acreate(self, device_session: DeviceSession) -> Nonce:
+        return self.create(device_session)
+
+    async def aconsume(self, device_session: DeviceSession, value: str) -> Nonce | None:
+        unpacked = self._unpack(device_session, value)
+        if not unpacked or not await self.cache.aadd(*self._used_entry(*unpacked)):
+            return None
+
+        return Nonce(device_session=device_session, value=value)
+
+    def _used_entry(self, nonce_id: bytes, issued_at: int) -> tuple[str, bool, int]:
+        """Cache key, value and timeout marking given nonce as used for the rest of its lifetime."""
+        remaining = issued_at + self.lifetime - int(time.time())
+        return f"dreiattest:used_nonce:{nonce_id.hex()}", True, max(remaining, 1)
+
+    def _unpack(self, device_session: DeviceSession, value: str) -> tuple[bytes, int] | None:
+        """Return the id and issue time of given nonce if it was signed by us for given session and is not expired."""
+        try:
+            raw = base64.b64decode(value, validate=True)
+        except binascii.Error:
+            return None
+
+        payload_length = self.id_length + self._issued_at.size
+        payload, signature = raw[:payload_length], raw[payload_length:]
+        if not constant_time_compare(signature, self._sign(device_session, payload)):
+            return None
+
+        nonce_id = payload[: self.id_length]
+        (issued_at,) = self._issued_at.unpack(payload[self.id_length :])
+        if not 0 <= time.time() - issued_at <= self.lifetime:
+            return None
+
+        return nonce_id, issued_at
+
+    def _sign(self, device_session: DeviceSession, payload: bytes) -> bytes:
+        return salted_hmac(
+            self.key_salt,
+            str(device_session).encode() + payload,
+            secret=dreiattest_settings.DREIATTEST_SIGNING_SECRET,
+            algorithm="sha256",
+        ).digest()
+
+
+@cache
+def get_nonce_store() -> BaseNonceStore:
+    """Return the nonce store configured by DREIATTEST_NONCE_STORE."""
+    return import_string(dreiattest_settings.DREIATTEST_NONCE_STORE)()
@@ -5,5 +5,10 @@ from pyattest.attestation import Attestation
 
 
 class BasePlugin(ABC):
+    # Deferred plugins run in a background thread after the key was stored. They can't reject the registration and
+    # exceptions they raise are only logged.
+    deferred = False
+
+    # The parsed dreiattest headers of the request are available via dreiattest.context.request_context(request)
     @abstractmethod
     def run(self, request: WSGIRequest, attestation: Attestation): ...
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from threading import Lock
+
+from cryptography.hazmat.primitives.asymmetric.types import PublicKeyTypes
+
+from . import settings as dreiattest_settings
+from .models import Key
+
+
+class PublicKeyCache:
+    """
+    Bounded LRU cache for loaded public keys. Entries are stored per key primary key together with the
+    public_key_id they were loaded for, so a key that was replaced in the database is never served from a stale entry.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[str, PublicKeyTypes]] = OrderedDict()
+        self._lock = Lock()
+
+    def load(self, key: Key) -> PublicKeyTypes:
+        """Return the loaded public key of given key, parsing it only if it's not cached yet."""
+        with self._lock:
+            entry = self._entries.get(key.pk)
+            if entry is not None and entry[0] == key.public_key_id:
+                self._entries.move_to_end(key.pk)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+
+        public_key = key.load_public_key()
+        if self.max_size <= 0 or key.pk is None:
+            return public_key
+
+        with self._lock:
+            self._entries[key.pk] = (key.public_key_id, public_key)
+            self._entries.move_to_end(key.pk)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return public_key
+
+    def invalidate(self, pk: int):
+        """Drop the cached public key of the key with given primary key, e.g. after it was replaced."""
+        with self._lock:
+            self._entries.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
+
+
+public_key_cache = PublicKeyCache(dreiattest_settings.DREIATTEST_PUBLIC_KEY_CACHE_SIZE)
@@ -0,0 +1,58 @@
+import random
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Model
+
+from . import settings as dreiattest_settings
+
+APP_LABEL = "dreiattest"
+
+
+class DreiattestRouter:
+    """
+    Sends the queries of the dreiattest models to their primary database DREIATTEST_DATABASE, or the default database
+    if it's not set, and only migrates them there. Add it to DATABASE_ROUTERS before the routers of your project. The
+    replicas of DREIATTEST_REPLICA_DATABASES are only used explicitly for the key lookups of signed requests, objects
+    loaded from them are still written to the primary.
+    """
+
+    def db_for_read(self, model: type[Model], **hints) -> str | None:
+        return self._db_for_model(model)
+
+    def db_for_write(self, model: type[Model], **hints) -> str | None:
+        return self._db_for_model(model)
+
+    def allow_relation(self, obj1: Model, obj2: Model, **hints) -> bool | None:
+        # Objects loaded from a replica relate to the ones of the primary
+        if obj1._meta.app_label == obj2._meta.app_label == APP_LABEL:
+            return True
+
+        return None
+
+    def allow_migrate(self, db: str, app_label: str, model_name: str | None = None, **hints) -> bool | None:
+        # Other apps are left to the routers of the project
+        if app_label != APP_LABEL:
+            return None
+
+        return db == primary_database()
+
+    @staticmethod
+    def _db_for_model(model: type[Model]) -> str | None:
+        if model._meta.app_label == APP_LABEL:
+            return primary_database()
+
+        return None
+
+
+def primary_database() -> str:
+    """Return the alias of the database the dreiattest models are written to."""
+    return dreiattest_settings.DREIATTEST_DATABASE or DEFAULT_DB_ALIAS
+
+
+def replica_database() -> str | None:
+    """Return the alias of one of the replicas the key lookups of signed requests are sent to, if any are configured."""
+    replicas = dreiattest_settings.DREIATTEST_REPLICA_DATABASES
+    if not replicas:
+        return None
+
+    return random.choice(replicas)
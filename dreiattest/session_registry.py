@@ -0,0 +1,100 @@
+from collections.abc import Iterable
+from uuid import UUID
+
+from django.core.cache import BaseCache, caches
+
+from . import settings as dreiattest_settings
+from .exceptions import InvalidHeaderException
+from .helpers import uid_cache_key
+from .models import DeviceSession
+
+
+class DeviceSessionRegistry:
+    """
+    Resolves the uid of a device session to its primary key. Known sessions are looked up in the django cache
+    DREIATTEST_SESSION_CACHE first, so issuing a nonce for them doesn't need the database. On a miss the session is
+    selected and only inserted if it doesn't exist yet, existing sessions are never updated.
+
+    The returned sessions only have their id, user_id and session_id loaded, which is all the nonce stores and keys
+    need. Other fields are fetched from the database when they are accessed.
+    """
+
+    def get(self, user_id: str, session_id: UUID, create: bool = True) -> DeviceSession:
+        """Return the matching session, raise InvalidHeaderException if it doesn't exist and create is False."""
+        cache = self._get_cache()
+        cache_key = self._cache_key(user_id, session_id)
+        pk = cache.get(cache_key) if cache else None
+
+        if pk is None:
+            pk = self._select(user_id, session_id).first()
+            if pk is None and create:
+                # Inserted without updating a session created concurrently, which is selected again
+                DeviceSession.objects.bulk_create(
+                    [DeviceSession(user_id=user_id, session_id=session_id)],
+                    ignore_conflicts=True,
+                )
+                pk = self._select(user_id, session_id).first()
+
+            if pk is None:
+                raise InvalidHeaderException
+
+            if cache:
+                cache.set(cache_key, pk)
+
+        return self._session(pk, user_id, session_id)
+
+    async def aget(self, user_id: str, session_id: UUID, create: bool = True) -> DeviceSession:
+        """Async version of get."""
+        cache = self._get_cache()
+        cache_key = self._cache_key(user_id, session_id)
+        pk = await cache.aget(cache_key) if cache else None
+
+        if pk is None:
+            pk = await self._select(user_id, session_id).afirst()
+            if pk is None and create:
+                await DeviceSession.objects.abulk_create(
+                    [DeviceSession(user_id=user_id, session_id=session_id)],
+                    ignore_conflicts=True,
+                )
+                pk = await self._select(user_id, session_id).afirst()
+
+            if pk is None:
+                raise InvalidHeaderException
+
+            if cache:
+                await cache.aset(cache_key, pk)
+
+        return self._session(pk, user_id, session_id)
+
+    def evict(self, uids: Iterable[tuple[str, UUID]]):
+        """Forget the sessions with given user_id and session_id, e.g. after they were deleted."""
+        cache = self._get_cache()
+        if cache:
+            cache.delete_many([self._cache_key(user_id, session_id) for user_id, session_id in uids])
+
+    @staticmethod
+    def _select(user_id: str, session_id: UUID):
+        # A session_id taken by another user doesn't match, so it can't be hijacked by sending a different user_id
+        return DeviceSession.objects.filter(session_id=session_id, user_id=user_id).values_list("pk", flat=True)
+
+    @staticmethod
+    def _session(pk: int, user_id: str, session_id: UUID) -> DeviceSession:
+        return DeviceSession.from_db(
+            DeviceSession.objects.db,
+            ["id", "user_id", "session_id"],
+            [pk, user_id, session_id],
+        )
+
+    @staticmethod
+    def _get_cache() -> BaseCache | None:
+        if not dreiattest_settings.DREIATTEST_SESSION_CACHE:
+            return None
+
+        return caches[dreiattest_settings.DREIATTEST_SESSION_CACHE]
+
+    @staticmethod
+    def _cache_key(user_id: str, session_id: UUID) -> str:
+        return uid_cache_key("dreiattest:session", user_id, session_id)
+
+
+session_registry = DeviceSessionRegistry()
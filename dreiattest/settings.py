@@ -28,6 +28,11 @@ DREIATTEST_BYPASS_HEADER = getattr(
     settings, "DREIATTEST_BYPASS_HEADER", "HTTP_DREIATTEST_SHARED_SECRET"
 )
 
+# Header containing the session ticket issued by views using signature_required(ticket_lifetime=...)
+DREIATTEST_TICKET_HEADER = getattr(
+    settings, "DREIATTEST_TICKET_HEADER", "HTTP_DREIATTEST_TICKET"
+)
+
 # Header containing the app identifier (bundle id on iOS, package id on Android). Used for selecting the appropriate
 # verification configuration.
 # e.g. ch.dreipol.example.app
@@ -115,3 +120,148 @@ DREIATTEST_BYPASS_SECRET = getattr(settings, "DREIATTEST_BYPASS_SECRET", None)
 
 # Give the user a chance to hook into the key registration process
 DREIATTEST_PLUGINS = getattr(settings, "DREIATTEST_PLUGINS", [])
+
+# Number of loaded public keys kept in memory for signature verification. Set to 0 to disable the cache.
+DREIATTEST_PUBLIC_KEY_CACHE_SIZE = getattr(
+    settings, "DREIATTEST_PUBLIC_KEY_CACHE_SIZE", 1024
+)
+
+# Backend persisting the issued nonces until they are used. Available are ModelNonceStore (database), CacheNonceStore
+# (django cache) and MemoryNonceStore (in process, for tests) from dreiattest.nonce_stores.
+DREIATTEST_NONCE_STORE = getattr(
+    settings, "DREIATTEST_NONCE_STORE", "dreiattest.nonce_stores.ModelNonceStore"
+)
+
+# Alias of the django cache used by the CacheNonceStore and to remember the used nonces of the SignedNonceStore
+DREIATTEST_NONCE_CACHE = getattr(settings, "DREIATTEST_NONCE_CACHE", "default")
+
+# Secret used to sign stateless values like the nonces of the SignedNonceStore. Defaults to the SECRET_KEY.
+DREIATTEST_SIGNING_SECRET = getattr(settings, "DREIATTEST_SIGNING_SECRET", None)
+
+# Number of background threads running deferred plugins
+DREIATTEST_PLUGIN_WORKERS = getattr(settings, "DREIATTEST_PLUGIN_WORKERS", 2)
+
+# Maximum number of deferred plugin runs waiting for a background thread. If the queue is full plugins run inline.
+DREIATTEST_PLUGIN_QUEUE_SIZE = getattr(settings, "DREIATTEST_PLUGIN_QUEUE_SIZE", 100)
+
+# Request bodies larger than this are spooled to disk while they are hashed for the signature verification
+DREIATTEST_BODY_SPOOL_MAX_MEMORY_SIZE = getattr(
+    settings,
+    "DREIATTEST_BODY_SPOOL_MAX_MEMORY_SIZE",
+    settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+)
+
+# Number of threads the async views use to verify attestations and assertions. If not set, the default executor of
+# the event loop is used.
+DREIATTEST_VERIFY_WORKERS = getattr(settings, "DREIATTEST_VERIFY_WORKERS", None)
+
+# Route the dreiattest urls to the async versions of the views. Use this when serving the app with ASGI.
+DREIATTEST_ASYNC_VIEWS = getattr(settings, "DREIATTEST_ASYNC_VIEWS", False)
+
+# Number of processes verifying the attestations of key registrations. Set to 0 to verify them in the request thread.
+# The processes are started with spawn, so DJANGO_SETTINGS_MODULE needs to point to the settings of the project.
+DREIATTEST_ATTESTATION_PROCESSES = getattr(
+    settings, "DREIATTEST_ATTESTATION_PROCESSES", 0
+)
+
+# Maximum number of attestations waiting for or being verified by a process. Key registrations beyond that are
+# answered with 503 right away.
+DREIATTEST_ATTESTATION_QUEUE_SIZE = getattr(
+    settings, "DREIATTEST_ATTESTATION_QUEUE_SIZE", 32
+)
+
+# Seconds a key registration waits for the verification of its attestation before it is answered with 503
+DREIATTEST_ATTESTATION_TIMEOUT = getattr(settings, "DREIATTEST_ATTESTATION_TIMEOUT", 10)
+
+# Seconds sent in the Retry-After header of 503 responses
+DREIATTEST_RETRY_AFTER = getattr(settings, "DREIATTEST_RETRY_AFTER", 5)
+
+# Number of verified intermediate certificates of Apple attestations kept in memory. Set to 0 to disable the cache.
+DREIATTEST_INTERMEDIATE_CACHE_SIZE = getattr(
+    settings, "DREIATTEST_INTERMEDIATE_CACHE_SIZE", 16
+)
+
+# Seconds a verified intermediate certificate is trusted at most, entries also expire at the notAfter of the certificate
+DREIATTEST_INTERMEDIATE_CACHE_TIMEOUT = getattr(
+    settings, "DREIATTEST_INTERMEDIATE_CACHE_TIMEOUT", 24 * 60 * 60
+)
+
+# Number of failed signature verifications after which requests of a device session are rejected without verifying
+# them, until the window ends or the session registers a new key. Set to 0 to disable the throttling.
+DREIATTEST_FAILURE_LIMIT = getattr(settings, "DREIATTEST_FAILURE_LIMIT", 0)
+
+# Seconds the failed verifications of a device session are counted, starting with the first failure
+DREIATTEST_FAILURE_WINDOW = getattr(settings, "DREIATTEST_FAILURE_WINDOW", 300)
+
+# Alias of the django cache counting the failed verifications. Use a cache shared by all processes.
+DREIATTEST_FAILURE_CACHE = getattr(settings, "DREIATTEST_FAILURE_CACHE", "default")
+
+# Dotted path of a MetricsBackend receiving the phase durations of the dreiattest views and signature_required, e.g.
+# dreiattest.metrics.InMemoryMetricsBackend. Nothing is measured if this is not set.
+DREIATTEST_METRICS_BACKEND = getattr(settings, "DREIATTEST_METRICS_BACKEND", None)
+
+# Maximum number of signed requests in a single batch request
+DREIATTEST_BATCH_MAX_SIZE = getattr(settings, "DREIATTEST_BATCH_MAX_SIZE", 50)
+
+# Route the batch endpoint. Its requests are only dispatched to views decorated with signature_required.
+DREIATTEST_BATCH_ENABLED = getattr(settings, "DREIATTEST_BATCH_ENABLED", False)
+
+# Reject apple assertions whose counter isn't higher than the one of the last assertion of the same key
+DREIATTEST_ASSERTION_COUNTER_CHECK = getattr(
+    settings, "DREIATTEST_ASSERTION_COUNTER_CHECK", False
+)
+
+# Alias of the django cache sharing the assertion counters between processes. If not set, each process checks the
+# counters of the assertions it has seen itself.
+DREIATTEST_ASSERTION_COUNTER_CACHE = getattr(
+    settings, "DREIATTEST_ASSERTION_COUNTER_CACHE", None
+)
+
+# Seconds between the batched writes of the assertion counters to the database
+DREIATTEST_ASSERTION_COUNTER_FLUSH_INTERVAL = getattr(
+    settings, "DREIATTEST_ASSERTION_COUNTER_FLUSH_INTERVAL", 30
+)
+
+# Maximum number of seconds a session ticket is valid, regardless of the lifetime requested by signature_required
+DREIATTEST_TICKET_MAX_LIFETIME = getattr(settings, "DREIATTEST_TICKET_MAX_LIFETIME", 60)
+
+# Alias of the django cache mapping device sessions to their primary key, so issuing nonces for known sessions doesn't
+# need the database. Use a cache shared by all processes and the dreiattest_prune command. Disabled if not set.
+DREIATTEST_SESSION_CACHE = getattr(settings, "DREIATTEST_SESSION_CACHE", None)
+
+# Number of logs per second and exception code the HandleDreiattestExceptionsMiddleware writes at most, further
+# exceptions are only counted. Set to None to log every exception.
+DREIATTEST_EXCEPTION_LOG_RATE = getattr(settings, "DREIATTEST_EXCEPTION_LOG_RATE", 1)
+
+# Number of logs per exception code which can be written at once before DREIATTEST_EXCEPTION_LOG_RATE applies
+DREIATTEST_EXCEPTION_LOG_BURST = getattr(settings, "DREIATTEST_EXCEPTION_LOG_BURST", 10)
+
+# Share of the logged exceptions which include their traceback per exception code, e.g. {"InvalidSignature": 0.01}.
+# Exceptions that are not listed always include it.
+DREIATTEST_EXCEPTION_LOG_TRACEBACK_RATES = getattr(
+    settings, "DREIATTEST_EXCEPTION_LOG_TRACEBACK_RATES", {}
+)
+
+# Regexes of the paths whose requests are verified by the SignatureRequiredMiddleware, e.g. ["api/"]. They are matched
+# against the start of the path without the leading slash.
+DREIATTEST_SIGNATURE_REQUIRED_PATHS = getattr(
+    settings, "DREIATTEST_SIGNATURE_REQUIRED_PATHS", []
+)
+
+# Regexes of paths which are not verified by the SignatureRequiredMiddleware even if they match one of
+# DREIATTEST_SIGNATURE_REQUIRED_PATHS, e.g. ["api/health$"]
+DREIATTEST_SIGNATURE_EXEMPT_PATHS = getattr(
+    settings, "DREIATTEST_SIGNATURE_EXEMPT_PATHS", []
+)
+
+# Format new keys are stored in. "pem" stores them as PEM text, "binary" stores P-256 keys as their raw X9.62 point
+# (other keys as DER) together with the binary key id, which is loaded faster. Keys stored as PEM stay readable.
+DREIATTEST_KEY_STORAGE = getattr(settings, "DREIATTEST_KEY_STORAGE", "pem")
+
+# Alias of the database the dreiattest models are stored in when the DreiattestRouter is installed. Uses the default
+# routing if not set.
+DREIATTEST_DATABASE = getattr(settings, "DREIATTEST_DATABASE", None)
+
+# Aliases of read replicas of DREIATTEST_DATABASE the key lookups of signed requests are sent to. Keys not found on a
+# replica are looked up on the primary again, so a key registered just before isn't rejected because of replication lag.
+DREIATTEST_REPLICA_DATABASES = getattr(settings, "DREIATTEST_REPLICA_DATABASES", [])
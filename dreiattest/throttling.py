@@ -0,0 +1,92 @@
+from uuid import UUID
+
+from cryptography.exceptions import InvalidKey, InvalidSignature
+from django.core.cache import BaseCache, caches
+from pyattest.exceptions import PyAttestException
+
+from . import settings as dreiattest_settings
+from .exceptions import NoKeyForSessionException
+from .helpers import uid_cache_key
+
+# Exceptions of a signature verification that count as a failure of the device session
+verification_failures = (
+    PyAttestException,
+    InvalidSignature,
+    InvalidKey,
+    NoKeyForSessionException,
+)
+
+
+def is_throttled(user_id: str, session_id: UUID) -> bool:
+    """Check if the device session failed too many verifications within the current window."""
+    if not dreiattest_settings.DREIATTEST_FAILURE_LIMIT:
+        return False
+
+    failures = _get_cache().get(_cache_key(user_id, session_id), 0)
+
+    return failures >= dreiattest_settings.DREIATTEST_FAILURE_LIMIT
+
+
+async def ais_throttled(user_id: str, session_id: UUID) -> bool:
+    """Async version of is_throttled."""
+    if not dreiattest_settings.DREIATTEST_FAILURE_LIMIT:
+        return False
+
+    failures = await _get_cache().aget(_cache_key(user_id, session_id), 0)
+
+    return failures >= dreiattest_settings.DREIATTEST_FAILURE_LIMIT
+
+
+def record_failure(user_id: str, session_id: UUID):
+    """Count a failed verification, the window starts with the first failure."""
+    if not dreiattest_settings.DREIATTEST_FAILURE_LIMIT:
+        return
+
+    cache = _get_cache()
+    cache_key = _cache_key(user_id, session_id)
+    timeout = dreiattest_settings.DREIATTEST_FAILURE_WINDOW
+    if cache.add(cache_key, 1, timeout=timeout):
+        return
+
+    try:
+        cache.incr(cache_key)
+    except ValueError:
+        # The window expired between add and incr
+        cache.add(cache_key, 1, timeout=timeout)
+
+
+async def arecord_failure(user_id: str, session_id: UUID):
+    """Async version of record_failure."""
+    if not dreiattest_settings.DREIATTEST_FAILURE_LIMIT:
+        return
+
+    cache = _get_cache()
+    cache_key = _cache_key(user_id, session_id)
+    timeout = dreiattest_settings.DREIATTEST_FAILURE_WINDOW
+    if await cache.aadd(cache_key, 1, timeout=timeout):
+        return
+
+    try:
+        await cache.aincr(cache_key)
+    except ValueError:
+        await cache.aadd(cache_key, 1, timeout=timeout)
+
+
+def reset_failures(user_id: str, session_id: UUID):
+    """Forget the failures of a device session, e.g. after it registered a new key."""
+    if dreiattest_settings.DREIATTEST_FAILURE_LIMIT:
+        _get_cache().delete(_cache_key(user_id, session_id))
+
+
+async def areset_failures(user_id: str, session_id: UUID):
+    """Async version of reset_failures."""
+    if dreiattest_settings.DREIATTEST_FAILURE_LIMIT:
+        await _get_cache().adelete(_cache_key(user_id, session_id))
+
+
+def _get_cache() -> BaseCache:
+    return caches[dreiattest_settings.DREIATTEST_FAILURE_CACHE]
+
+
+def _cache_key(user_id: str, session_id: UUID) -> str:
+    return uid_cache_key("dreiattest:failures", user_id, session_id)
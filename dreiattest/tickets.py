@@ -0,0 +1,70 @@
+import base64
+import binascii
+import struct
+import time
+from hashlib import sha256
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from . import settings as dreiattest_settings
+from .context import request_context
+
+# Response header carrying a newly issued session ticket
+TICKET_RESPONSE_HEADER = "Dreiattest-Ticket"
+
+_key_salt = "dreiattest.tickets"
+_issued_at = struct.Struct("!Q")
+_signature_length = sha256().digest_size
+
+
+def issue_ticket(request: WSGIRequest, view: str, lifetime: int) -> str:
+    """
+    Create a session ticket for the device session of given verified request. The ticket carries its issue time, bound
+    to the device session, the qualified name of the issuing view and its lifetime by a HMAC under
+    DREIATTEST_SIGNING_SECRET. The lifetime is capped at DREIATTEST_TICKET_MAX_LIFETIME seconds.
+    """
+    payload = _issued_at.pack(int(time.time()))
+
+    return base64.urlsafe_b64encode(payload + _sign(request, view, lifetime, payload)).decode()
+
+
+def has_valid_ticket(request: WSGIRequest, view: str, lifetime: int) -> bool:
+    """
+    Check if given request carries an unexpired ticket issued by given view with the same lifetime for its device
+    session, without any database work.
+    """
+    ticket = request_context(request).ticket
+    if not ticket:
+        return False
+
+    try:
+        raw = base64.urlsafe_b64decode(ticket.encode())
+    except (binascii.Error, ValueError):
+        return False
+
+    payload, signature = raw[:-_signature_length], raw[-_signature_length:]
+    if len(payload) != _issued_at.size:
+        return False
+
+    if not constant_time_compare(signature, _sign(request, view, lifetime, payload)):
+        return False
+
+    (issued_at,) = _issued_at.unpack(payload)
+    # Tickets issued before the maximum lifetime was lowered don't match the signature anymore
+    return 0 <= time.time() - issued_at <= _capped(lifetime)
+
+
+def _capped(lifetime: int) -> int:
+    return min(lifetime, dreiattest_settings.DREIATTEST_TICKET_MAX_LIFETIME)
+
+
+def _sign(request: WSGIRequest, view: str, lifetime: int, payload: bytes) -> bytes:
+    user_id, session_id = request_context(request).uid
+
+    return salted_hmac(
+        _key_salt,
+        f"{user_id};{session_id};{view};{_capped(lifetime)}".encode() + payload,
+        secret=dreiattest_settings.DREIATTEST_SIGNING_SECRET,
+        algorithm="sha256",
+    ).digest()
@@ -1,17 +1,32 @@
-from . import settings as dreiattest_settings, views
-
 from django.urls import re_path
 
+from . import settings as dreiattest_settings
+from . import views
+
+if dreiattest_settings.DREIATTEST_ASYNC_VIEWS:
+    nonce_view, key_view = views.anonce, views.akey
+else:
+    nonce_view, key_view = views.nonce, views.key
+
 app_name = "dreiattest"
 urlpatterns = [
     re_path(
         dreiattest_settings.DREIATTEST_BASE_URL + "nonce",
-        views.nonce,
+        nonce_view,
         name="dreiattest.nonce",
     ),
     re_path(
         dreiattest_settings.DREIATTEST_BASE_URL + "key",
-        views.key,
+        key_view,
         name="dreiattest.key",
     ),
 ]
+
+if dreiattest_settings.DREIATTEST_BATCH_ENABLED:
+    urlpatterns.append(
+        re_path(
+            dreiattest_settings.DREIATTEST_BASE_URL + "batch",
+            views.batch,
+            name="dreiattest.batch",
+        )
+    )
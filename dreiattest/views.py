@@ -3,9 +3,19 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
-from dreiattest.device_session import device_session_from_request
-from dreiattest.key import key_from_request
-from dreiattest.nonce import create_nonce, nonce_from_request
+from dreiattest.batch import dispatch_batch
+from dreiattest.device_session import (
+    adevice_session_from_request,
+    device_session_from_request,
+)
+from dreiattest.key import akey_from_request, key_from_request, reserve_attestation_slot
+from dreiattest.metrics import start_request_metrics
+from dreiattest.nonce import (
+    acreate_nonce,
+    anonce_from_request,
+    create_nonce,
+    nonce_from_request,
+)
 
 
 @require_http_methods(["GET"])
@@ -14,8 +24,11 @@ def nonce(request: WSGIRequest):
     Request a nonce to create the attestation on the device. The Dreiattest-Uid header needs to be set
     with a valid device session id. The server will persist the nonce and persist it with the given uid.
     """
-    device_session = device_session_from_request(request)
-    nonce = create_nonce(device_session)
+    with start_request_metrics(request, "nonce") as metrics:
+        with metrics.phase("session_lookup"):
+            device_session = device_session_from_request(request)
+        with metrics.phase("nonce_create"):
+            nonce = create_nonce(device_session)
 
     return JsonResponse(nonce.value, safe=False)
 
@@ -24,8 +37,51 @@ def nonce(request: WSGIRequest):
 @csrf_exempt
 def key(request: WSGIRequest):
     """Store a public key belonging to a user in the database. Upcoming requests can be signed with said key."""
-    device_session = device_session_from_request(request, create=False)
-    nonce = nonce_from_request(request, device_session)
-    public_key = key_from_request(request, nonce, device_session)
+    with start_request_metrics(request, "key") as metrics:
+        with metrics.phase("session_lookup"):
+            device_session = device_session_from_request(request, create=False)
+        with reserve_attestation_slot():
+            with metrics.phase("nonce_consume"):
+                nonce = nonce_from_request(request, device_session)
+            public_key = key_from_request(request, nonce, device_session, metrics)
+
+    return JsonResponse({"success": True, "key_id": public_key.public_key_id})
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+def batch(request: WSGIRequest):
+    """
+    Verify and dispatch multiple signed requests of the same device session, e.g. requests which were queued while the
+    device was offline. The session and its key are only looked up once. Returns the response of every request.
+    """
+    results = dispatch_batch(request)
+
+    return JsonResponse({"results": results})
+
+
+@require_http_methods(["GET"])
+async def anonce(request: WSGIRequest):
+    """Async version of the nonce view."""
+    with start_request_metrics(request, "nonce") as metrics:
+        with metrics.phase("session_lookup"):
+            device_session = await adevice_session_from_request(request)
+        with metrics.phase("nonce_create"):
+            nonce = await acreate_nonce(device_session)
+
+    return JsonResponse(nonce.value, safe=False)
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+async def akey(request: WSGIRequest):
+    """Async version of the key view."""
+    with start_request_metrics(request, "key") as metrics:
+        with metrics.phase("session_lookup"):
+            device_session = await adevice_session_from_request(request, create=False)
+        with reserve_attestation_slot():
+            with metrics.phase("nonce_consume"):
+                nonce = await anonce_from_request(request, device_session)
+            public_key = await akey_from_request(request, nonce, device_session, metrics)
 
     return JsonResponse({"success": True, "key_id": public_key.public_key_id})
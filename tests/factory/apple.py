@@ -6,7 +6,7 @@ import struct
 from hashlib import sha256
 from pathlib import Path
 
-from _cbor2 import dumps as cbor_encode
+from cbor2 import dumps as cbor_encode
 from asn1crypto.core import OctetString
 from cryptography import x509
 from cryptography.hazmat._oid import ObjectIdentifier
@@ -100,3 +100,24 @@ def get(
     }
 
     return cbor_encode(data), public_key
+
+
+def assertion(
+    private_key: ec.EllipticCurvePrivateKey,
+    expected_hash: bytes,
+    nonce: bytes,
+    counter: int = 1,
+    app_id: str = "foo",
+) -> str:
+    """Helper to create an apple assertion of given request hash and nonce, signed like the iOS client does."""
+    authenticator_data = (
+        sha256(app_id.encode()).digest() + b"\x00" + struct.pack("!I", counter)
+    )
+    client_data_hash = sha256(expected_hash + nonce).digest()
+    signature = private_key.sign(
+        sha256(authenticator_data + client_data_hash).digest(),
+        ec.ECDSA(hashes.SHA256()),
+    )
+    data = {"signature": signature, "authenticatorData": authenticator_data}
+
+    return base64.b64encode(cbor_encode(data)).decode()
@@ -0,0 +1,83 @@
+import json
+import uuid
+from inspect import iscoroutinefunction
+from unittest.mock import patch
+
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+
+from dreiattest import views
+from dreiattest.decorators import signature_required
+from dreiattest.exceptions import InvalidDriverException, NoKeyForSessionException
+from dreiattest.models import DeviceSession, Key, Nonce
+from dreiattest.nonce import acreate_nonce
+
+
+class AsyncViews(TestCase):
+    def setUp(self):
+        self.rf = RequestFactory()
+        self.uid = f"test;{uuid.uuid4()}"
+
+    async def test_nonce(self):
+        response = await views.anonce(self.rf.get("/nonce", HTTP_DREIATTEST_UID=self.uid))
+
+        nonce = await Nonce.objects.select_related("device_session").aget()
+        self.assertEqual(json.loads(response.content), nonce.value)
+        self.assertEqual(str(nonce.device_session), self.uid)
+
+    async def test_key_consumes_nonce(self):
+        device_session = await DeviceSession.objects.acreate(session_id=self.uid.split(";")[1], user_id="test")
+        nonce = await acreate_nonce(device_session)
+        request = self.rf.post(
+            "/key",
+            {"driver": "invalid"},
+            content_type="application/json",
+            HTTP_DREIATTEST_UID=self.uid,
+            HTTP_DREIATTEST_NONCE=nonce.value,
+        )
+
+        with self.assertRaises(InvalidDriverException):
+            await views.akey(request)
+
+        await nonce.arefresh_from_db()
+        self.assertIsNotNone(nonce.used_at)
+
+
+class AsyncSignatureRequired(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get(
+            "/foo",
+            HTTP_DREIATTEST_UID=f"test;{uuid.uuid4()}",
+            HTTP_DREIATTEST_NONCE="nonce",
+        )
+
+        async def view(request):
+            return HttpResponse("async")
+
+        self.view = signature_required()(view)
+
+    def test_wraps_coroutine_views_natively(self):
+        self.assertTrue(iscoroutinefunction(self.view))
+        self.assertFalse(iscoroutinefunction(signature_required()(lambda request: HttpResponse())))
+
+    @patch("dreiattest.decorators.verify_assertion")
+    async def test_verifies_assertion(self, verify_assertion):
+        session_id = self.request.META["HTTP_DREIATTEST_UID"].split(";")[1]
+        device_session = await DeviceSession.objects.acreate(session_id=session_id, user_id="test")
+        key = await Key.objects.acreate(
+            device_session=device_session, public_key_id="id", public_key="", driver="apple"
+        )
+
+        response = await self.view(self.request)
+
+        self.assertEqual(response.content, b"async")
+        self.assertEqual(verify_assertion.call_args.args[1], key)
+
+    async def test_session_without_key(self):
+        await DeviceSession.objects.acreate(
+            session_id=self.request.META["HTTP_DREIATTEST_UID"].split(";")[1],
+            user_id="test",
+        )
+
+        with self.assertRaises(NoKeyForSessionException):
+            await self.view(self.request)
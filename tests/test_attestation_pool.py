@@ -0,0 +1,156 @@
+import base64
+import json
+import pickle
+import pkgutil
+import time
+import uuid
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from hashlib import sha256
+from unittest.mock import patch
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.x509.base import load_pem_x509_certificate
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from pyattest.configs.apple import AppleConfig
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest import views
+from dreiattest.exceptions import ExecutorBusyException
+from dreiattest.executors import BoundedExecutor
+from dreiattest.key import akey_from_request, key_from_request
+from dreiattest.middlewares import HandleDreiattestExceptionsMiddleware
+from dreiattest.models import DeviceSession, Nonce
+from dreiattest.nonce import create_nonce
+from tests.factory import apple as apple_factory
+
+
+class PicklingExecutor(Executor):
+    """Runs calls right away but pickles arguments and results like a process pool does."""
+
+    def submit(self, fn, *args, **kwargs):
+        args, kwargs = pickle.loads(pickle.dumps((args, kwargs)))
+        future = Future()
+        future.set_result(pickle.loads(pickle.dumps(fn(*args, **kwargs))))
+
+        return future
+
+
+class AttestationPool(TestCase):
+    def setUp(self):
+        root_ca = load_pem_x509_certificate(pkgutil.get_data("pyattest", "testutils/fixtures/root_cert.pem"))
+        self.root_ca_pem = root_ca.public_bytes(serialization.Encoding.PEM)
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        self.nonce = create_nonce(self.device_session)
+
+        attest, public_key = apple_factory.get(app_id="foo", nonce=self.nonce, device_session=self.device_session)
+        self.key_id = sha256(public_key).digest()
+        self.request = RequestFactory().post(
+            "/key",
+            {
+                "driver": "apple",
+                "key_id": base64.b64encode(self.key_id).decode(),
+                "attestation": base64.b64encode(attest).decode(),
+            },
+            content_type="application/json",
+        )
+
+    def apple_config(self, app_id: str, public_key_id: str) -> list[AppleConfig]:
+        return [AppleConfig(key_id=self.key_id, app_id="foo", production=False, root_ca=self.root_ca_pem)]
+
+    def test_attestation_is_verified_in_pool(self):
+        executor = BoundedExecutor(PicklingExecutor(), 1)
+
+        with (
+            patch("dreiattest.key.apple_config", self.apple_config),
+            patch("dreiattest.key.get_attestation_executor", return_value=executor),
+            patch("dreiattest.key.resolve_plugins") as resolve_plugins,
+        ):
+            key = key_from_request(self.request, self.nonce, self.device_session)
+
+        attestation = resolve_plugins.call_args.args[1]
+        self.assertEqual(key.public_key_id, base64.b64encode(self.key_id).decode())
+        self.assertEqual(attestation.config.key_id, self.key_id)
+
+    async def test_async_attestation_is_verified_in_pool(self):
+        executor = BoundedExecutor(PicklingExecutor(), 1)
+
+        with (
+            patch("dreiattest.key.apple_config", self.apple_config),
+            patch("dreiattest.key.get_attestation_executor", return_value=executor),
+        ):
+            key = await akey_from_request(self.request, self.nonce, self.device_session)
+
+        self.assertEqual(key.public_key_id, base64.b64encode(self.key_id).decode())
+
+    def test_full_queue(self):
+        executor = BoundedExecutor(ThreadPoolExecutor(max_workers=1), 1)
+        self.addCleanup(executor.executor.shutdown)
+        executor.submit(time.sleep, 0.5)
+
+        with (
+            patch("dreiattest.key.apple_config", self.apple_config),
+            patch("dreiattest.key.get_attestation_executor", return_value=executor),
+            self.assertRaises(ExecutorBusyException),
+        ):
+            key_from_request(self.request, self.nonce, self.device_session)
+
+    def test_full_queue_keeps_the_nonce(self):
+        executor = BoundedExecutor(ThreadPoolExecutor(max_workers=1), 1)
+        self.addCleanup(executor.executor.shutdown)
+        executor.submit(time.sleep, 0.5)
+        self.request.META["HTTP_DREIATTEST_UID"] = str(self.device_session)
+        self.request.META["HTTP_DREIATTEST_NONCE"] = self.nonce.value
+
+        with (
+            patch("dreiattest.key.get_attestation_executor", return_value=executor),
+            self.assertRaises(ExecutorBusyException),
+        ):
+            views.key(self.request)
+
+        self.assertFalse(Nonce.objects.filter(used_at__isnull=False).exists())
+
+    @patch.object(dreiattest_settings, "DREIATTEST_ATTESTATION_TIMEOUT", 0.01)
+    def test_timeout(self):
+        executor = BoundedExecutor(ThreadPoolExecutor(max_workers=1), 2)
+        self.addCleanup(executor.executor.shutdown)
+        executor.submit(time.sleep, 0.5)
+
+        with (
+            patch("dreiattest.key.apple_config", self.apple_config),
+            patch("dreiattest.key.get_attestation_executor", return_value=executor),
+            self.assertRaises(ExecutorBusyException),
+        ):
+            key_from_request(self.request, self.nonce, self.device_session)
+
+
+class Reservation(SimpleTestCase):
+    def setUp(self):
+        self.executor = BoundedExecutor(PicklingExecutor(), 1)
+
+    def test_reserved_slot_is_used_by_the_next_call(self):
+        with self.executor.reserve():
+            with self.assertRaises(ExecutorBusyException), self.executor.reserve():
+                pass
+
+            self.assertEqual(self.executor.submit(abs, -1).result(), 1)
+
+        self.assertEqual(self.executor.submit(abs, -2).result(), 2)
+
+    def test_unused_slot_is_released(self):
+        with self.assertRaises(ValueError), self.executor.reserve():
+            raise ValueError
+
+        with self.executor.reserve():
+            pass
+
+
+class BusyResponse(SimpleTestCase):
+    @patch.object(dreiattest_settings, "DREIATTEST_RETRY_AFTER", 7)
+    def test_busy_is_answered_with_503(self):
+        middleware = HandleDreiattestExceptionsMiddleware(lambda request: None)
+
+        response = middleware.process_exception(RequestFactory().post("/key"), ExecutorBusyException())
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertEqual(json.loads(response.content), {"code": "ExecutorBusy"})
@@ -0,0 +1,155 @@
+import base64
+import json
+import uuid
+from unittest.mock import patch
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import include, path
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest import urls, views
+from dreiattest.decorators import signature_required
+from dreiattest.exceptions import InvalidPayloadException
+from dreiattest.helpers import request_hash
+from dreiattest.key import get_key_id
+from dreiattest.models import DeviceSession, Key
+from dreiattest.public_key_cache import public_key_cache
+from tests.factory import apple as apple_factory
+
+
+@signature_required()
+def echo(request, pk):
+    return JsonResponse({"pk": pk, "body": request.body.decode(), "foo": request.GET.get("foo")})
+
+
+def unsigned(request):
+    return JsonResponse({})
+
+
+urlpatterns = [
+    path("", include("dreiattest.urls")),
+    path("dreiattest/batch", views.batch),
+    path("api/echo/<int:pk>", echo),
+    path("api/unsigned", unsigned),
+]
+
+
+@override_settings(ROOT_URLCONF="tests.test_batch")
+class Batch(TestCase):
+    def setUp(self):
+        public_key_cache.clear()
+        self.addCleanup(public_key_cache.clear)
+        dreiattest_settings.DREIATTEST_APPLE_APPIDS, apple_appids = (
+            ["0000000000.foo"],
+            dreiattest_settings.DREIATTEST_APPLE_APPIDS,
+        )
+        self.addCleanup(setattr, dreiattest_settings, "DREIATTEST_APPLE_APPIDS", apple_appids)
+
+        self.private_key = ec.generate_private_key(ec.SECP256R1())
+        public_key = (
+            self.private_key.public_key()
+            .public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+            .decode()
+        )
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        Key.objects.create(
+            device_session=self.device_session,
+            public_key=public_key,
+            public_key_id=get_key_id(public_key),
+            driver="apple",
+        )
+
+    def item(self, url: str, body: bytes = b"", private_key=None) -> dict:
+        nonce = str(uuid.uuid4())
+        request = RequestFactory().post(url, body, content_type="text/plain")
+        assertion = apple_factory.assertion(
+            private_key or self.private_key, request_hash(request, [""]), nonce.encode()
+        )
+
+        return {
+            "method": "POST",
+            "path": url,
+            "headers": {
+                "Content-Type": "text/plain",
+                "Dreiattest-Nonce": nonce,
+                "Dreiattest-Signature": assertion,
+            },
+            "body": base64.b64encode(body).decode(),
+        }
+
+    def post(self, items: list):
+        return self.client.post(
+            "/dreiattest/batch",
+            {"requests": items},
+            content_type="application/json",
+            HTTP_DREIATTEST_UID=str(self.device_session),
+            HTTP_DREIATTEST_APP_IDENTIFIER="foo",
+        )
+
+    def test_items_are_verified_and_dispatched(self):
+        items = [self.item("/api/echo/1?foo=bar", b"first"), self.item("/api/echo/2", b"second")]
+
+        with self.assertNumQueries(1):
+            response = self.post(items)
+
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], [200, 200])
+        self.assertEqual(
+            json.loads(base64.b64decode(results[0]["body"])),
+            {"pk": 1, "body": "first", "foo": "bar"},
+        )
+        self.assertEqual(json.loads(base64.b64decode(results[1]["body"]))["body"], "second")
+
+    def test_items_are_answered_individually(self):
+        items = [
+            self.item("/api/echo/1", b"foo", private_key=ec.generate_private_key(ec.SECP256R1())),
+            self.item("/api/unknown"),
+            self.item("/api/echo/3", b"foo"),
+        ]
+
+        results = self.post(items).json()["results"]
+
+        self.assertEqual([result["status"] for result in results], [403, 404, 200])
+        self.assertEqual(results[0]["headers"]["Dreiattest-error"], "dreiAttest_invalid_key")
+
+    def test_only_signature_required_views_are_dispatched(self):
+        results = self.post([self.item("/api/unsigned")]).json()["results"]
+
+        self.assertEqual(results[0]["status"], 404)
+
+    def test_disabled_by_default(self):
+        self.assertFalse(any(pattern.name == "dreiattest.batch" for pattern in urls.urlpatterns))
+
+    def test_tampered_body(self):
+        item = self.item("/api/echo/1", b"foo")
+        item["body"] = base64.b64encode(b"bar").decode()
+
+        results = self.post([item]).json()["results"]
+
+        self.assertEqual(results[0]["status"], 403)
+
+    def test_batch_size_is_limited(self):
+        item = self.item("/api/echo/1")
+        dreiattest_settings.DREIATTEST_BATCH_MAX_SIZE, max_size = 1, dreiattest_settings.DREIATTEST_BATCH_MAX_SIZE
+        self.addCleanup(setattr, dreiattest_settings, "DREIATTEST_BATCH_MAX_SIZE", max_size)
+
+        with self.assertRaises(InvalidPayloadException):
+            self.post([item, item])
+
+    @patch("dreiattest.batch.dispatch")
+    def test_items_are_validated_before_dispatching(self, dispatch):
+        invalid_headers = self.item("/api/echo/2")
+        invalid_headers["headers"] = ["Content-Type"]
+        invalid_body = self.item("/api/echo/2")
+        invalid_body["body"] = "not base64"
+        invalid_path = self.item("/api/echo/2")
+        invalid_path["path"] = 2
+
+        for invalid in (invalid_headers, invalid_body, invalid_path):
+            with self.subTest(item=invalid), self.assertRaises(InvalidPayloadException):
+                self.post([self.item("/api/echo/1"), invalid])
+
+        dispatch.assert_not_called()
@@ -0,0 +1,135 @@
+import datetime
+from unittest.mock import patch
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from django.test import SimpleTestCase
+from pyattest.attestation import Attestation
+from pyattest.exceptions import InvalidCertificateChainException
+
+from dreiattest import certificate_cache
+from dreiattest.certificate_cache import (
+    CachingAppleAttestationVerifier,
+    CachingAppleConfig,
+    IntermediateCertificateCache,
+)
+
+
+def make_certificate(
+    common_name: str,
+    issuer: x509.Certificate | None = None,
+    issuer_key: ec.EllipticCurvePrivateKey | None = None,
+    ca: bool = False,
+) -> tuple[x509.Certificate, ec.EllipticCurvePrivateKey]:
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.UTC)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(issuer.subject if issuer else name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+    )
+    if ca:
+        builder = builder.add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+    else:
+        builder = builder.add_extension(
+            x509.KeyUsage(True, False, False, False, False, False, False, False, False),
+            critical=False,
+        )
+
+    return builder.sign(issuer_key or key, hashes.SHA256()), key
+
+
+def der(certificate: x509.Certificate) -> bytes:
+    return certificate.public_bytes(serialization.Encoding.DER)
+
+
+class IntermediateCertificateCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.certificate = der(make_certificate("intermediate", ca=True)[0])
+        self.in_a_day = datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=1)
+
+    def test_added_certificates_are_trusted(self):
+        cache = IntermediateCertificateCache(max_size=10, timeout=60)
+
+        self.assertFalse(cache.is_trusted(self.certificate, b"root"))
+        cache.add(self.certificate, b"root", self.in_a_day)
+
+        self.assertTrue(cache.is_trusted(self.certificate, b"root"))
+        self.assertFalse(cache.is_trusted(self.certificate, b"other root"))
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_entries_expire_at_not_after(self):
+        cache = IntermediateCertificateCache(max_size=10, timeout=60)
+        cache.add(
+            self.certificate,
+            b"root",
+            datetime.datetime.now(datetime.UTC) - datetime.timedelta(seconds=1),
+        )
+
+        self.assertFalse(cache.is_trusted(self.certificate, b"root"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_entries_expire_after_timeout(self):
+        cache = IntermediateCertificateCache(max_size=10, timeout=0)
+        cache.add(self.certificate, b"root", self.in_a_day)
+
+        self.assertFalse(cache.is_trusted(self.certificate, b"root"))
+
+    def test_disabled_cache(self):
+        cache = IntermediateCertificateCache(max_size=0, timeout=60)
+        cache.add(self.certificate, b"root", self.in_a_day)
+
+        self.assertFalse(cache.is_trusted(self.certificate, b"root"))
+
+
+class CachingAppleAttestationVerifierTest(SimpleTestCase):
+    def setUp(self):
+        root, root_key = make_certificate("root", ca=True)
+        intermediate, intermediate_key = make_certificate("intermediate", root, root_key, ca=True)
+        leaf, _ = make_certificate("leaf", intermediate, intermediate_key)
+        self.root_ca = root.public_bytes(serialization.Encoding.PEM)
+        self.intermediate = der(intermediate)
+        self.leaf = der(leaf)
+
+        config = CachingAppleConfig(key_id=b"", app_id="foo", production=False, root_ca=self.root_ca)
+        self.verifier = CachingAppleAttestationVerifier(Attestation(b"", b"", config))
+        self.cache = IntermediateCertificateCache(max_size=10, timeout=60)
+        patcher = patch.object(certificate_cache, "intermediate_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_known_intermediate_skips_chain_validation(self):
+        path = self.verifier.verify_certificate_chain([self.leaf, self.intermediate])
+        self.assertEqual(len(path), 3)
+        self.assertTrue(self.cache.is_trusted(self.intermediate, self.root_ca))
+
+        with patch(
+            "pyattest.verifiers.apple_attestation.AppleAttestationVerifier.verify_certificate_chain"
+        ) as full_validation:
+            path = self.verifier.verify_certificate_chain([self.leaf, self.intermediate])
+
+        full_validation.assert_not_called()
+        self.assertEqual(len(path), 2)
+        self.assertEqual(list(path)[-1].dump(), self.leaf)
+
+    def test_leaf_is_verified_against_known_intermediate(self):
+        self.verifier.verify_certificate_chain([self.leaf, self.intermediate])
+        other_leaf, _ = make_certificate("leaf")
+
+        with self.assertRaises(InvalidCertificateChainException):
+            self.verifier.verify_certificate_chain([der(other_leaf), self.intermediate])
+
+    def test_invalid_chain_is_not_cached(self):
+        other_intermediate, _ = make_certificate("intermediate", ca=True)
+
+        with self.assertRaises(InvalidCertificateChainException):
+            self.verifier.verify_certificate_chain([self.leaf, der(other_intermediate)])
+
+        self.assertEqual(self.cache.stats()["size"], 0)
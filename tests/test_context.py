@@ -0,0 +1,55 @@
+import uuid
+from unittest.mock import patch
+
+from django.test import RequestFactory, SimpleTestCase
+
+from dreiattest.context import RequestContext, parse_header, request_context
+from dreiattest.exceptions import InvalidHeaderException
+from dreiattest.helpers import is_valid_uuid
+
+
+class RequestContextTest(SimpleTestCase):
+    def test_headers_are_parsed_once(self):
+        session_id = uuid.uuid4()
+        request = RequestFactory().get(
+            "/foo",
+            HTTP_DREIATTEST_UID=f"test;{session_id}",
+            HTTP_DREIATTEST_USER_HEADERS="Authorization,Accept",
+            HTTP_DREIATTEST_APP_IDENTIFIER="ch.dreipol.one",
+            HTTP_DREIATTEST_OS="iOS 16.7.2",
+        )
+
+        with patch("dreiattest.context.parse_header", wraps=parse_header) as parse:
+            context = request_context(request)
+            self.assertEqual(context.uid, ("test", session_id))
+            self.assertEqual(context.session_id, session_id)
+            self.assertEqual(context.user_id, "test")
+
+        parse.assert_called_once()
+        self.assertIs(request_context(request), context)
+        self.assertIs(request.dreiattest, context)
+        self.assertIs(context.user_headers, context.user_headers)
+        self.assertEqual(context.user_headers, ["Authorization", "Accept"])
+        self.assertEqual(context.app_id, "ch.dreipol.one")
+        self.assertEqual(context.os, "iOS 16.7.2")
+        self.assertIsNone(context.nonce)
+        self.assertFalse(hasattr(context, "__dict__"))
+
+    def test_invalid_uid(self):
+        for header in ("", "test", f"test;{uuid.uuid4()};foo", "test;foo", f"{'a' * 129};{uuid.uuid4()}"):
+            with self.subTest(header=header):
+                context = RequestContext(RequestFactory().get("/foo", HTTP_DREIATTEST_UID=header))
+
+                with self.assertRaises(InvalidHeaderException):
+                    _ = context.uid
+
+    def test_valid_uuid(self):
+        value = str(uuid.uuid4())
+
+        self.assertTrue(is_valid_uuid(value))
+        self.assertTrue(is_valid_uuid(value.upper()))
+        self.assertFalse(is_valid_uuid(str(uuid.uuid1())))
+        self.assertFalse(is_valid_uuid(value.replace("-", "")))
+        self.assertFalse(is_valid_uuid(f"{{{value}}}"))
+        self.assertFalse(is_valid_uuid(value[:19] + "c" + value[20:]))
+        self.assertFalse(is_valid_uuid(None))
@@ -0,0 +1,142 @@
+import uuid
+from hashlib import sha256
+from unittest.mock import patch
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.core.cache import cache
+from django.test import TestCase
+from pyattest.exceptions import InvalidCounterException
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.counters import AssertionCounterTracker
+from dreiattest.decorators import verify_assertion
+from dreiattest.key import get_key_id
+from dreiattest.models import DeviceSession, Key
+from tests.factory import apple as apple_factory
+
+
+def make_key(private_key: ec.EllipticCurvePrivateKey) -> Key:
+    device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+    public_key = (
+        private_key.public_key()
+        .public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+        .decode()
+    )
+
+    return Key.objects.create(
+        device_session=device_session,
+        public_key=public_key,
+        public_key_id=get_key_id(public_key),
+        driver="apple",
+    )
+
+
+class AssertionCounterTrackerTest(TestCase):
+    def setUp(self):
+        self.tracker = AssertionCounterTracker()
+        self.key = make_key(ec.generate_private_key(ec.SECP256R1()))
+
+    def test_counters_need_to_increase(self):
+        self.tracker.check(self.key, 1)
+        self.tracker.check(self.key, 5)
+
+        for counter in (5, 3):
+            with self.assertRaises(InvalidCounterException):
+                self.tracker.check(self.key, counter)
+
+    def test_replaced_key_starts_over(self):
+        self.tracker.check(self.key, 5)
+        self.key.public_key_id = "new key"
+
+        self.tracker.check(self.key, 1)
+
+    def test_stored_counter_is_respected(self):
+        Key.objects.filter(pk=self.key.pk).update(assertion_counter=10)
+        self.key.refresh_from_db()
+
+        with self.assertRaises(InvalidCounterException):
+            self.tracker.check(self.key, 10)
+
+    def test_flush_writes_all_counters_at_once(self):
+        other_key = make_key(ec.generate_private_key(ec.SECP256R1()))
+        replaced_key = make_key(ec.generate_private_key(ec.SECP256R1()))
+        self.tracker.check(self.key, 3)
+        self.tracker.check(other_key, 7)
+        self.tracker.check(replaced_key, 2)
+        Key.objects.filter(pk=other_key.pk).update(assertion_counter=9)
+        Key.objects.filter(pk=replaced_key.pk).update(public_key_id="new key")
+
+        with self.assertNumQueries(1):
+            self.tracker.flush()
+
+        self.assertEqual(
+            dict(Key.objects.values_list("pk", "assertion_counter")),
+            {self.key.pk: 3, other_key.pk: 9, replaced_key.pk: None},
+        )
+        self.assertEqual(self.tracker.flush(), 0)
+
+    @patch.object(dreiattest_settings, "DREIATTEST_ASSERTION_COUNTER_FLUSH_INTERVAL", 0)
+    @patch("dreiattest.counters.get_plugin_executor")
+    def test_flush_is_scheduled_after_interval(self, get_plugin_executor):
+        self.tracker.check(self.key, 1)
+
+        get_plugin_executor.return_value.submit.assert_called_once_with(self.tracker._flush_in_background)
+
+    @patch.object(dreiattest_settings, "DREIATTEST_ASSERTION_COUNTER_CACHE", "default")
+    def test_shared_counters(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        other_process = AssertionCounterTracker()
+
+        self.tracker.check(self.key, 1)
+        with self.assertRaises(InvalidCounterException):
+            other_process.check(self.key, 1)
+
+        other_process.check(self.key, 2)
+        with self.assertRaises(InvalidCounterException):
+            self.tracker.check(self.key, 2)
+
+    @patch.object(dreiattest_settings, "DREIATTEST_ASSERTION_COUNTER_CACHE", "default")
+    def test_shared_counter_is_never_decreased(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        cache_key = f"dreiattest:counter:{self.key.pk}:{self.key.public_key_id}"
+
+        self.tracker.check(self.key, 5)
+        # A slower request with a lower counter doesn't overwrite the higher one
+        with self.assertRaises(InvalidCounterException):
+            AssertionCounterTracker().check(self.key, 3)
+
+        self.assertEqual(cache.get(cache_key), 5)
+
+    @patch.object(dreiattest_settings, "DREIATTEST_ASSERTION_COUNTER_CACHE", "default")
+    def test_shared_counter_is_accepted_once(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        cache_key = f"dreiattest:counter:{self.key.pk}:{self.key.public_key_id}"
+
+        self.tracker.check(self.key, 6)
+        # A concurrent request with a lower counter overwrote the highest one
+        cache.set(cache_key, 5)
+
+        with self.assertRaises(InvalidCounterException):
+            AssertionCounterTracker().check(self.key, 6)
+        AssertionCounterTracker().check(self.key, 7)
+
+
+@patch.object(dreiattest_settings, "DREIATTEST_APPLE_APPIDS", ["0000000000.foo"])
+@patch.object(dreiattest_settings, "DREIATTEST_ASSERTION_COUNTER_CHECK", True)
+@patch("dreiattest.decorators.assertion_counters", new_callable=AssertionCounterTracker)
+class VerifyAssertionCounter(TestCase):
+    def setUp(self):
+        self.private_key = ec.generate_private_key(ec.SECP256R1())
+        self.key = make_key(self.private_key)
+
+    def test_replayed_assertion_is_rejected(self, assertion_counters):
+        request_hash = sha256(b"request").digest()
+        assertion = apple_factory.assertion(self.private_key, request_hash, b"nonce")
+
+        verify_assertion("foo", self.key, b"nonce", assertion, request_hash)
+        with self.assertRaises(InvalidCounterException):
+            verify_assertion("foo", self.key, b"nonce", assertion, request_hash)
@@ -0,0 +1,147 @@
+import uuid
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest import views
+from dreiattest.decorators import signature_required
+from dreiattest.device_session import (
+    device_session_from_request,
+    session_and_key_from_request,
+)
+from dreiattest.exceptions import InvalidHeaderException, NoKeyForSessionException
+from dreiattest.models import DeviceSession, Key
+from dreiattest.session_registry import session_registry
+
+
+class SessionAndKeyResolution(TestCase):
+    def setUp(self):
+        self.rf = RequestFactory()
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+
+    def request(self):
+        return self.rf.get(
+            "/foo",
+            HTTP_DREIATTEST_UID=str(self.device_session),
+            HTTP_DREIATTEST_NONCE="nonce",
+        )
+
+    def create_key(self, public_key_id: str) -> Key:
+        return Key.objects.create(
+            device_session=self.device_session,
+            public_key_id=public_key_id,
+            public_key="",
+            driver="apple",
+        )
+
+    def test_resolves_key_with_one_query(self):
+        created = self.create_key("new")
+
+        with self.assertNumQueries(1):
+            session, key = session_and_key_from_request(self.request())
+            self.assertEqual(session, self.device_session)
+            self.assertEqual(key, created)
+
+    def test_session_without_key(self):
+        with self.assertNumQueries(2):
+            session, key = session_and_key_from_request(self.request())
+
+        self.assertEqual(session, self.device_session)
+        self.assertIsNone(key)
+
+    def test_unknown_session(self):
+        request = self.rf.get("/foo", HTTP_DREIATTEST_UID=f"test;{uuid.uuid4()}")
+
+        with self.assertRaises(InvalidHeaderException):
+            session_and_key_from_request(request)
+
+    def test_key_registration_looks_up_the_session_only(self):
+        request = self.rf.post("/key", HTTP_DREIATTEST_UID=str(self.device_session), HTTP_DREIATTEST_NONCE="nonce")
+
+        # The session and the nonce, which is unknown
+        with self.assertNumQueries(2), self.assertRaises(InvalidHeaderException):
+            views.key(request)
+
+    @patch("dreiattest.decorators.verify_assertion")
+    def test_signature_required_uses_one_query(self, verify_assertion):
+        key = self.create_key("new")
+        view = signature_required()(lambda request: HttpResponse())
+
+        with self.assertNumQueries(1):
+            view(self.request())
+
+        self.assertEqual(verify_assertion.call_args.args[1], key)
+
+    def test_signature_required_without_key(self):
+        view = signature_required()(lambda request: HttpResponse())
+
+        with self.assertRaises(NoKeyForSessionException):
+            view(self.request())
+
+
+@patch.object(dreiattest_settings, "DREIATTEST_SESSION_CACHE", "default")
+class DeviceSessionRegistry(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.session_id = uuid.uuid4()
+
+    def request(self, user_id: str = "test"):
+        return RequestFactory().get("/foo", HTTP_DREIATTEST_UID=f"{user_id};{self.session_id}")
+
+    def test_known_sessions_dont_need_the_database(self):
+        with self.assertNumQueries(3):
+            created = device_session_from_request(self.request())
+
+        with self.assertNumQueries(0):
+            session = device_session_from_request(self.request())
+
+        self.assertEqual(session, created)
+        self.assertEqual(str(session), f"test;{self.session_id}")
+
+    def test_known_sessions_are_only_selected_without_cache(self):
+        existing = DeviceSession.objects.create(session_id=self.session_id, user_id="test")
+
+        with patch.object(dreiattest_settings, "DREIATTEST_SESSION_CACHE", None), self.assertNumQueries(1):
+            session = device_session_from_request(self.request())
+
+        self.assertEqual(session, existing)
+
+    def test_existing_sessions_are_not_updated(self):
+        existing = DeviceSession.objects.create(session_id=self.session_id, user_id="test")
+
+        session = device_session_from_request(self.request())
+
+        self.assertEqual(session, existing)
+        self.assertEqual(DeviceSession.objects.get().updated_at, existing.updated_at)
+
+    def test_session_of_other_user(self):
+        DeviceSession.objects.create(session_id=self.session_id, user_id="test")
+
+        with self.assertRaises(InvalidHeaderException):
+            device_session_from_request(self.request("other"))
+
+    def test_lookup_without_create(self):
+        with self.assertRaises(InvalidHeaderException):
+            session_registry.get("test", self.session_id, create=False)
+
+        self.assertFalse(DeviceSession.objects.exists())
+
+    def test_async(self):
+        created = async_to_sync(session_registry.aget)("test", self.session_id)
+
+        with self.assertNumQueries(0):
+            session = async_to_sync(session_registry.aget)("test", self.session_id, create=False)
+
+        self.assertEqual(session, created)
+
+    def test_evict(self):
+        session = session_registry.get("test", self.session_id)
+        session_registry.evict([("test", self.session_id)])
+        DeviceSession.objects.filter(pk=session.pk).delete()
+
+        self.assertNotEqual(session_registry.get("test", self.session_id), session)
@@ -0,0 +1,84 @@
+import json
+from unittest.mock import patch
+
+from cryptography.exceptions import InvalidSignature
+from django.test import RequestFactory, SimpleTestCase
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.context import request_context
+from dreiattest.exception_log import exception_log_limiter
+from dreiattest.exceptions import NoKeyForSessionException
+from dreiattest.middlewares import HandleDreiattestExceptionsMiddleware
+
+
+@patch.object(dreiattest_settings, "DREIATTEST_EXCEPTION_LOG_RATE", 1)
+@patch.object(dreiattest_settings, "DREIATTEST_EXCEPTION_LOG_BURST", 2)
+class ExceptionLogging(SimpleTestCase):
+    def setUp(self):
+        exception_log_limiter.clear()
+        self.addCleanup(exception_log_limiter.clear)
+        self.middleware = HandleDreiattestExceptionsMiddleware(lambda request: None)
+
+    def handle(self, exception: Exception):
+        request = RequestFactory().get("/foo", HTTP_DREIATTEST_APP_IDENTIFIER="ch.dreipol.one")
+        request_context(request).driver = "apple"
+
+        return self.middleware.process_exception(request, exception)
+
+    def test_logs_are_limited_per_exception(self):
+        with self.assertLogs("dreiattest") as logs:
+            responses = [self.handle(InvalidSignature()) for _ in range(5)]
+            self.handle(NoKeyForSessionException())
+
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(exception_log_limiter.stats(), {"InvalidSignature": 3})
+        self.assertEqual(
+            logs.records[0].dreiattest,
+            {
+                "code": "InvalidSignature",
+                "header": "dreiAttest_invalid_key",
+                "driver": "apple",
+                "app_id": "ch.dreipol.one",
+                "suppressed": 0,
+            },
+        )
+        self.assertIsNotNone(logs.records[0].exc_info)
+
+        # The response of suppressed exceptions doesn't change
+        for response in responses:
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(response["Dreiattest-error"], "dreiAttest_invalid_key")
+            self.assertEqual(json.loads(response.content), {"code": "InvalidSignature"})
+
+    @patch("dreiattest.exception_log.time.monotonic")
+    def test_suppressed_logs_are_reported_with_the_next_one(self, monotonic):
+        monotonic.return_value = 100
+        for _ in range(4):
+            self.handle(InvalidSignature())
+
+        monotonic.return_value = 101
+        with self.assertLogs("dreiattest") as logs:
+            self.handle(InvalidSignature())
+
+        self.assertEqual(logs.records[0].dreiattest["suppressed"], 2)
+        self.assertIn("2 similar suppressed", logs.output[0])
+
+    @patch.object(dreiattest_settings, "DREIATTEST_EXCEPTION_LOG_TRACEBACK_RATES", {"InvalidSignature": 0})
+    def test_tracebacks_are_sampled(self):
+        with self.assertLogs("dreiattest") as logs:
+            self.handle(InvalidSignature())
+            self.handle(NoKeyForSessionException())
+
+        self.assertIsNone(logs.records[0].exc_info)
+        self.assertIsNotNone(logs.records[1].exc_info)
+
+    def test_unlimited(self):
+        with (
+            patch.object(dreiattest_settings, "DREIATTEST_EXCEPTION_LOG_RATE", None),
+            self.assertLogs("dreiattest") as logs,
+        ):
+            for _ in range(5):
+                self.handle(InvalidSignature())
+
+        self.assertEqual(len(logs.records), 5)
+        self.assertEqual(exception_log_limiter.stats(), {})
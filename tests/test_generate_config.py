@@ -0,0 +1,79 @@
+import base64
+import os
+from unittest.mock import patch
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.test import SimpleTestCase
+
+from dreiattest import generate_config
+from dreiattest import settings as dreiattest_settings
+from dreiattest.generate_config import (
+    apple_config,
+    google_play_integrity_api_config,
+    reset_config_index,
+)
+
+
+def play_integrity_settings(apk_name: str) -> dict:
+    verification_key = ec.generate_private_key(ec.SECP256R1()).public_key()
+    verification_key = verification_key.public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    return {
+        "apk_name": apk_name,
+        "decryption_key": base64.b64encode(os.urandom(32)).decode(),
+        "verification_key": base64.b64encode(verification_key).decode(),
+    }
+
+
+class ConfigIndex(SimpleTestCase):
+    def setUp(self):
+        reset_config_index()
+        self.addCleanup(reset_config_index)
+
+    @patch.object(
+        dreiattest_settings,
+        "DREIATTEST_APPLE_APPIDS",
+        ["0000000000.ch.dreipol.one", "1111111111.ch.dreipol.one", "0000000000.ch.dreipol.two"],
+    )
+    def test_apple_configs_are_selected_by_bundle_id(self):
+        public_key_id = base64.b64encode(b"key id").decode()
+
+        configs = apple_config(app_id="ch.dreipol.one", public_key_id=public_key_id)
+
+        self.assertEqual(
+            [config.app_id for config in configs],
+            ["0000000000.ch.dreipol.one", "1111111111.ch.dreipol.one"],
+        )
+        self.assertTrue(all(config.key_id == b"key id" for config in configs))
+        self.assertEqual(apple_config(app_id="ch.dreipol.three", public_key_id=public_key_id), [])
+
+    @patch.object(
+        dreiattest_settings,
+        "DREIATTEST_PLAY_INTEGRITY_CONFIGS",
+        [play_integrity_settings("ch.dreipol.one"), play_integrity_settings("ch.dreipol.two")],
+    )
+    def test_play_integrity_configs_are_compiled_once(self):
+        with patch.object(
+            generate_config,
+            "_generate_play_integrity_config",
+            wraps=generate_config._generate_play_integrity_config,
+        ) as generate:
+            first = google_play_integrity_api_config(app_id="ch.dreipol.one")
+            second = google_play_integrity_api_config(app_id="ch.dreipol.one")
+            google_play_integrity_api_config(app_id="ch.dreipol.two")
+
+        self.assertEqual(generate.call_count, 2)
+        self.assertEqual(len(first), 1)
+        self.assertIs(first[0], second[0])
+
+    def test_reset_rebuilds_index(self):
+        with patch.object(dreiattest_settings, "DREIATTEST_APPLE_APPIDS", ["0000000000.ch.dreipol.one"]):
+            self.assertEqual(len(apple_config(app_id="ch.dreipol.one", public_key_id="")), 1)
+
+        with patch.object(dreiattest_settings, "DREIATTEST_APPLE_APPIDS", []):
+            self.assertEqual(len(apple_config(app_id="ch.dreipol.one", public_key_id="")), 1)
+            reset_config_index()
+            self.assertEqual(apple_config(app_id="ch.dreipol.one", public_key_id=""), [])
@@ -0,0 +1,91 @@
+import json
+import os
+from hashlib import sha256
+from unittest.mock import patch
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.decorators import signature_required
+from dreiattest.helpers import request_hash
+
+
+def buffered_request_hash(request, header_keys: list) -> bytes:
+    """The hash as it's calculated by the mobile clients."""
+    uri = request.build_absolute_uri()[len(request.scheme + "://") :].encode()
+    headers = {key: request.headers.get(key) for key in filter(None, header_keys)}
+    headers_json = json.dumps(headers, sort_keys=True, indent=None, separators=(",", ":"))
+
+    return sha256(uri + request.method.encode() + headers_json.encode() + request.body).digest()
+
+
+class RequestHash(SimpleTestCase):
+    def setUp(self):
+        self.rf = RequestFactory()
+
+    def post(self, body: bytes):
+        return self.rf.post(
+            "/foo?bar=1",
+            body,
+            content_type="application/octet-stream",
+            HTTP_X_FOO="foo",
+        )
+
+    def test_streamed_hash_matches_buffered_hash(self):
+        body = os.urandom(3 * 64 * 1024 + 17)
+
+        streamed = request_hash(self.post(body), ["X-Foo", ""])
+        buffered = buffered_request_hash(self.post(body), ["X-Foo", ""])
+
+        self.assertEqual(streamed, buffered)
+
+    def test_body_is_still_readable_after_hashing(self):
+        body = os.urandom(1024)
+        request = self.post(body)
+
+        request_hash(request, [])
+
+        self.assertEqual(request.body, body)
+
+    @patch.object(dreiattest_settings, "DREIATTEST_BODY_SPOOL_MAX_MEMORY_SIZE", 10)
+    def test_large_body_is_spooled_to_disk(self):
+        body = os.urandom(1024)
+        request = self.post(body)
+
+        request_hash(request, [])
+
+        self.assertTrue(request._stream._rolled)
+        self.assertEqual(request.read(), body)
+
+    def test_spool_is_closed_after_the_view(self):
+        body = os.urandom(1024)
+        request = self.post(body)
+        view = signature_required()(lambda request: HttpResponse(request.body))
+
+        request_hash(request, [])
+        spool = request.dreiattest_body_spool
+        with patch("dreiattest.decorators.should_bypass", return_value=True):
+            response = view(request)
+
+        self.assertEqual(response.content, body)
+        self.assertTrue(spool.closed)
+
+    def test_form_data_can_be_parsed_after_hashing(self):
+        request = self.rf.post("/foo", {"foo": "bar"})
+
+        request_hash(request, [])
+
+        self.assertEqual(request.POST["foo"], "bar")
+
+    def test_already_read_body(self):
+        request = self.post(b"foo")
+        body = request.body
+
+        self.assertEqual(request_hash(request, []), buffered_request_hash(request, []))
+        self.assertEqual(request.body, body)
+
+    def test_empty_body(self):
+        request = self.rf.get("/foo")
+
+        self.assertEqual(request_hash(request, []), buffered_request_hash(self.rf.get("/foo"), []))
@@ -4,18 +4,29 @@ from hashlib import sha256
 from unittest.mock import patch
 import pkgutil
 
+from asgiref.sync import async_to_sync
+
 from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
 from cryptography.x509.base import load_pem_x509_certificate
 from pyattest.configs.apple import AppleConfig
 from pyattest.configs.google import GoogleConfig
 
-from dreiattest.exceptions import InvalidDriverException
-from dreiattest.key import key_from_request, get_key_id
-from dreiattest.models import DeviceSession
+from dreiattest import settings as dreiattest_settings
+from dreiattest.exceptions import InvalidDriverException, InvalidHeaderException
+from dreiattest.key import (
+    astore_key,
+    get_key_id,
+    key_fields,
+    key_from_request,
+    store_key,
+)
+from dreiattest.models import DeviceSession, Key
+from django.db import connection
 from django.test import RequestFactory
 from django.test import TestCase
 
-from dreiattest.nonce import create_nonce
+from dreiattest.nonce import create_nonce, nonce_from_request
 from tests.factory import apple as apple_factory
 from tests.factory import google as google_factory
 
@@ -29,7 +40,7 @@ class PublicKey(TestCase):
         self.root_ca_pem = self.root_ca.public_bytes(serialization.Encoding.PEM)
         self.rf = RequestFactory()
 
-    @patch("dreiattest.key.AppleConfig")
+    @patch("dreiattest.key.apple_config")
     def test_can_create_key_with_apple_driver(self, mock_config):
         """Mock the apple config so we can inject our custom root_ca which is also used in the apple_factory."""
         device_session = DeviceSession(session_id=uuid.uuid4(), user_id="test")
@@ -40,9 +51,9 @@ class PublicKey(TestCase):
             app_id="foo", nonce=nonce, device_session=device_session
         )
         key_id = sha256(public_key).digest()
-        mock_config.return_value = AppleConfig(
-            key_id=key_id, app_id="foo", production=False, root_ca=self.root_ca_pem
-        )
+        mock_config.return_value = [
+            AppleConfig(key_id=key_id, app_id="foo", production=False, root_ca=self.root_ca_pem)
+        ]
 
         data = {
             "driver": "apple",
@@ -55,9 +66,9 @@ class PublicKey(TestCase):
         nonce.refresh_from_db()
         self.assertEqual(key.public_key_id, base64.b64encode(key_id).decode())
         self.assertEqual(key.driver, "apple")
-        self.assertTrue(bool(nonce.used_at))
+        self.assertIsNone(nonce.used_at)
 
-    @patch("dreiattest.key.GoogleConfig")
+    @patch("dreiattest.key.google_safety_net_config")
     def test_can_create_key_with_google_driver(self, mock_config):
         """Mock the google config so we can inject our custom root_ca which is also used in the apple_factory."""
         device_session = DeviceSession(session_id=uuid.uuid4(), user_id="test")
@@ -71,13 +82,15 @@ class PublicKey(TestCase):
             device_session=device_session,
             apk_cert_digest=apk_cert_digest,
         )
-        mock_config.return_value = GoogleConfig(
-            key_ids=[base64.b64encode(apk_cert_digest)],
-            apk_package_name="foo",
-            root_cn=self.root_cn,
-            root_ca=self.root_ca_pem,
-            production=False,
-        )
+        mock_config.return_value = [
+            GoogleConfig(
+                key_ids=[base64.b64encode(apk_cert_digest)],
+                apk_package_name="foo",
+                root_cn=self.root_cn,
+                root_ca=self.root_ca_pem,
+                production=False,
+            )
+        ]
 
         data = {
             "driver": "google",
@@ -96,7 +109,7 @@ class PublicKey(TestCase):
 
         self.assertEqual(key.driver, "google")
         self.assertEqual(key.public_key_id, key_id)
-        self.assertTrue(bool(nonce.used_at))
+        self.assertIsNone(nonce.used_at)
 
     def test_invalid_driver(self):
         device_session = DeviceSession(session_id=uuid.uuid4(), user_id="test")
@@ -107,3 +120,111 @@ class PublicKey(TestCase):
 
         with self.assertRaises(InvalidDriverException):
             key = key_from_request(request, nonce, device_session)
+
+    def test_nonce_is_used_up_before_the_key_is_created(self):
+        device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        nonce = create_nonce(device_session)
+        request = self.rf.post("/foo", HTTP_DREIATTEST_NONCE=nonce.value)
+
+        self.assertEqual(nonce_from_request(request, device_session).value, nonce.value)
+        nonce.refresh_from_db()
+        self.assertIsNotNone(nonce.used_at)
+
+        with self.assertRaises(InvalidHeaderException):
+            nonce_from_request(request, device_session)
+
+
+class StoreKey(TestCase):
+    def setUp(self):
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+
+    def defaults(self, public_key_id: str) -> dict:
+        return {"public_key": "", "public_key_id": public_key_id, "driver": "apple", "assertion_counter": None}
+
+    def test_new_key_replaces_existing_one(self):
+        old = store_key(self.device_session, self.defaults("old"))
+        Key.objects.filter(pk=old.pk).update(assertion_counter=10)
+
+        with self.assertNumQueries(1):
+            new = store_key(self.device_session, self.defaults("new"))
+
+        self.assertEqual(new.pk, old.pk)
+        self.assertEqual(list(Key.objects.values_list("public_key_id", "assertion_counter")), [("new", None)])
+
+    def test_async(self):
+        old = async_to_sync(astore_key)(self.device_session, self.defaults("old"))
+        new = async_to_sync(astore_key)(self.device_session, self.defaults("new"))
+
+        self.assertEqual(new.pk, old.pk)
+        self.assertEqual(Key.objects.get().public_key_id, "new")
+
+    def test_without_upsert(self):
+        old = store_key(self.device_session, self.defaults("old"))
+
+        with patch.object(type(connection.features), "supports_update_conflicts", False):
+            new = store_key(self.device_session, self.defaults("new"))
+            async_new = async_to_sync(astore_key)(self.device_session, self.defaults("async"))
+
+        self.assertEqual(new.pk, old.pk)
+        self.assertEqual(async_new.pk, old.pk)
+        self.assertEqual(Key.objects.get().public_key_id, "async")
+
+    def test_upsert_without_conflict_target(self):
+        old = store_key(self.device_session, self.defaults("old"))
+
+        # Like MySQL, which doesn't return the primary key of the upserted row either
+        with (
+            patch.object(type(connection.features), "supports_update_conflicts_with_target", False),
+            patch.object(Key.objects, "bulk_create") as bulk_create,
+        ):
+            key = store_key(self.device_session, self.defaults("new"))
+
+        self.assertNotIn("unique_fields", bulk_create.call_args.kwargs)
+        self.assertEqual(key.pk, old.pk)
+
+
+class KeyStorage(TestCase):
+    def setUp(self):
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+
+    def der(self, public_key) -> bytes:
+        return public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    def stored_key(self, der: bytes) -> Key:
+        store_key(self.device_session, {**key_fields(der), "driver": "apple"})
+
+        return Key.objects.get(device_session=self.device_session)
+
+    def test_pem_storage(self):
+        public_key = ec.generate_private_key(ec.SECP256R1()).public_key()
+
+        key = self.stored_key(self.der(public_key))
+
+        self.assertIsNone(key.public_key_raw)
+        self.assertEqual(key.public_key_id, get_key_id(key.public_key))
+        self.assertEqual(key.load_public_key(), public_key)
+
+    @patch.object(dreiattest_settings, "DREIATTEST_KEY_STORAGE", "binary")
+    def test_binary_storage(self):
+        public_key = ec.generate_private_key(ec.SECP256R1()).public_key()
+        previous_key = self.stored_key(self.der(rsa.generate_private_key(65537, 2048).public_key()))
+
+        key = self.stored_key(self.der(public_key))
+
+        self.assertEqual(key.pk, previous_key.pk)
+        self.assertEqual(key.public_key, "")
+        self.assertEqual(len(key.public_key_raw), 65)
+        self.assertEqual(bytes(key.public_key_id_raw), base64.b64decode(key.public_key_id))
+        self.assertEqual(key.load_public_key(), public_key)
+        self.assertEqual(key.load_pem(), public_key)
+        pem = public_key.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+        self.assertEqual(key.public_key_id, get_key_id(pem.decode()))
+
+    @patch.object(dreiattest_settings, "DREIATTEST_KEY_STORAGE", "binary")
+    def test_binary_storage_of_other_keys(self):
+        public_key = rsa.generate_private_key(65537, 2048).public_key()
+
+        key = self.stored_key(self.der(public_key))
+
+        self.assertEqual(bytes(key.public_key_raw), self.der(public_key))
+        self.assertEqual(key.load_public_key(), public_key)
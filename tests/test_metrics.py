@@ -0,0 +1,92 @@
+import uuid
+from unittest.mock import patch
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.decorators import signature_required
+from dreiattest.exceptions import NoKeyForSessionException
+from dreiattest.generate_config import reset_config_index
+from dreiattest.metrics import (
+    InMemoryMetricsBackend,
+    disabled_metrics,
+    get_metrics_backend,
+    start_request_metrics,
+)
+from dreiattest.middlewares import HandleDreiattestExceptionsMiddleware
+from dreiattest.models import DeviceSession, Key
+
+
+class InMemoryMetricsBackendTest(SimpleTestCase):
+    def test_render_prometheus_text_format(self):
+        backend = InMemoryMetricsBackend()
+        backend.observe("phase_duration_seconds", 0.003, {"phase": "request_hash"})
+        backend.observe("phase_duration_seconds", 0.2, {"phase": "request_hash"})
+        backend.increment("exceptions", {"code": 'Invalid"Signature'})
+
+        rendered = backend.render()
+
+        self.assertIn("# TYPE dreiattest_phase_duration_seconds histogram", rendered)
+        self.assertIn('dreiattest_phase_duration_seconds_bucket{phase="request_hash",le="0.0025"} 0', rendered)
+        self.assertIn('dreiattest_phase_duration_seconds_bucket{phase="request_hash",le="0.005"} 1', rendered)
+        self.assertIn('dreiattest_phase_duration_seconds_bucket{phase="request_hash",le="+Inf"} 2', rendered)
+        self.assertIn('dreiattest_phase_duration_seconds_count{phase="request_hash"} 2', rendered)
+        self.assertIn("# TYPE dreiattest_exceptions_total counter", rendered)
+        self.assertIn('dreiattest_exceptions_total{code="Invalid\\"Signature"} 1', rendered)
+
+
+@patch.object(dreiattest_settings, "DREIATTEST_APPLE_APPIDS", ["0000000000.ch.dreipol.one"])
+@patch.object(dreiattest_settings, "DREIATTEST_METRICS_BACKEND", "dreiattest.metrics.InMemoryMetricsBackend")
+class SignatureRequiredMetrics(TestCase):
+    def setUp(self):
+        get_metrics_backend.cache_clear()
+        reset_config_index()
+        self.addCleanup(get_metrics_backend.cache_clear)
+        self.addCleanup(reset_config_index)
+
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        self.view = signature_required()(lambda request: HttpResponse())
+
+    def signed_request(self, app_id: str):
+        return RequestFactory().get(
+            "/foo",
+            HTTP_DREIATTEST_UID=str(self.device_session),
+            HTTP_DREIATTEST_NONCE="nonce",
+            HTTP_DREIATTEST_APP_IDENTIFIER=app_id,
+        )
+
+    @patch("dreiattest.decorators.verify_assertion")
+    def test_phases_are_recorded_with_labels(self, verify_assertion):
+        Key.objects.create(device_session=self.device_session, public_key_id="id", public_key="", driver="apple")
+
+        self.view(self.signed_request("ch.dreipol.one"))
+        self.view(self.signed_request("ch.dreipol.unknown"))
+
+        rendered = get_metrics_backend().render()
+        labels = 'app_id="ch.dreipol.one",driver="apple",outcome="ok"'
+        for phase in ("key_lookup", "request_hash", "total"):
+            self.assertIn(f'_count{{{labels},phase="{phase}",view="signature_required"}} 1', rendered)
+        self.assertIn('app_id="unknown"', rendered)
+
+    def test_exceptions_are_recorded(self):
+        request = self.signed_request("ch.dreipol.one")
+        with self.assertRaises(NoKeyForSessionException) as context:
+            self.view(request)
+
+        HandleDreiattestExceptionsMiddleware(lambda request: None).process_exception(request, context.exception)
+
+        rendered = get_metrics_backend().render()
+        self.assertIn('outcome="NoKeyForSessionException",phase="total"', rendered)
+        self.assertIn(
+            'dreiattest_exceptions_total{app_id="",code="NoKeyForSession",driver="",view="signature_required"} 1',
+            rendered,
+        )
+
+    def test_disabled(self):
+        with patch.object(dreiattest_settings, "DREIATTEST_METRICS_BACKEND", None):
+            get_metrics_backend.cache_clear()
+            request = self.signed_request("ch.dreipol.one")
+
+            self.assertIs(start_request_metrics(request, "signature_required"), disabled_metrics)
+            self.assertFalse(hasattr(request, "dreiattest_metrics"))
@@ -0,0 +1,127 @@
+import time
+import uuid
+from datetime import timedelta
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+from django.utils import timezone
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.models import DeviceSession, Nonce
+from dreiattest.nonce_stores import (
+    NONCE_LIFETIME,
+    CacheNonceStore,
+    MemoryNonceStore,
+    ModelNonceStore,
+    SignedNonceStore,
+)
+
+
+class NonceStoreTestMixin:
+    store_class = None
+
+    def setUp(self):
+        self.store = self.store_class()
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+
+    def test_issued_nonce_can_be_used_once(self):
+        nonce = self.store.create(self.device_session)
+
+        consumed = self.store.consume(self.device_session, nonce.value)
+        self.assertEqual(consumed.value, nonce.value)
+        self.assertIsNone(self.store.consume(self.device_session, nonce.value))
+
+    def test_nonce_is_bound_to_session(self):
+        other_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        nonce = self.store.create(self.device_session)
+
+        self.assertIsNone(self.store.consume(other_session, nonce.value))
+
+    def test_unknown_nonce(self):
+        self.assertIsNone(self.store.consume(self.device_session, "unknown"))
+
+
+class ModelNonceStoreTest(NonceStoreTestMixin, TestCase):
+    store_class = ModelNonceStore
+
+    def test_expired_nonce(self):
+        nonce = self.store.create(self.device_session)
+        Nonce.objects.filter(pk=nonce.pk).update(created_at=timezone.now() - NONCE_LIFETIME - timedelta(seconds=1))
+
+        self.assertIsNone(self.store.consume(self.device_session, nonce.value))
+
+    def test_consume_is_a_single_update(self):
+        nonce = self.store.create(self.device_session)
+
+        with self.assertNumQueries(1):
+            self.store.consume(self.device_session, nonce.value)
+
+        nonce.refresh_from_db()
+        self.assertIsNotNone(nonce.used_at)
+
+
+class CacheNonceStoreTest(NonceStoreTestMixin, TestCase):
+    store_class = CacheNonceStore
+
+    def test_does_not_touch_the_database(self):
+        with self.assertNumQueries(0):
+            nonce = self.store.create(self.device_session)
+            self.store.consume(self.device_session, nonce.value)
+
+
+class MemoryNonceStoreTest(NonceStoreTestMixin, TestCase):
+    store_class = MemoryNonceStore
+
+    def test_expired_nonce(self):
+        nonce = self.store.create(self.device_session)
+        expired = time.monotonic() + NONCE_LIFETIME.total_seconds() + 1
+
+        with patch("dreiattest.nonce_stores.time.monotonic", return_value=expired):
+            self.assertIsNone(self.store.consume(self.device_session, nonce.value))
+
+
+@patch.object(dreiattest_settings, "DREIATTEST_SIGNING_SECRET", "secret")
+class SignedNonceStoreTest(NonceStoreTestMixin, TestCase):
+    store_class = SignedNonceStore
+
+    def test_does_not_touch_the_database(self):
+        with self.assertNumQueries(0):
+            nonce = self.store.create(self.device_session)
+            self.store.consume(self.device_session, nonce.value)
+
+    def test_tampered_nonce(self):
+        nonce = self.store.create(self.device_session)
+        tampered = ("A" if nonce.value[0] != "A" else "B") + nonce.value[1:]
+
+        self.assertIsNone(self.store.consume(self.device_session, tampered))
+        self.assertIsNone(self.store.consume(self.device_session, nonce.value[:-4]))
+
+    def test_nonce_signed_with_other_secret(self):
+        nonce = self.store.create(self.device_session)
+
+        with patch.object(dreiattest_settings, "DREIATTEST_SIGNING_SECRET", "other"):
+            self.assertIsNone(self.store.consume(self.device_session, nonce.value))
+
+    def test_expired_nonce(self):
+        nonce = self.store.create(self.device_session)
+        expired = time.time() + NONCE_LIFETIME.total_seconds() + 1
+
+        with patch("dreiattest.nonce_stores.time.time", return_value=expired):
+            self.assertIsNone(self.store.consume(self.device_session, nonce.value))
+
+    def test_used_nonces_are_shared_between_processes(self):
+        nonce = self.store.create(self.device_session)
+
+        self.assertIsNotNone(self.store.consume(self.device_session, nonce.value))
+        # Another worker process has its own store, but shares the cache
+        self.assertIsNone(SignedNonceStore().consume(self.device_session, nonce.value))
+        self.assertIsNone(async_to_sync(SignedNonceStore().aconsume)(self.device_session, nonce.value))
+
+    def test_used_nonces_expire_with_the_nonce(self):
+        nonce = self.store.create(self.device_session)
+
+        with patch.object(self.store.cache, "add", wraps=self.store.cache.add) as add:
+            self.store.consume(self.device_session, nonce.value)
+
+        self.assertLessEqual(add.call_args.args[2], NONCE_LIFETIME.total_seconds())
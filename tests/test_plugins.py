@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from unittest.mock import patch
+
+from django.test import RequestFactory, SimpleTestCase
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.exceptions import ExecutorBusyException
+from dreiattest.executors import BoundedExecutor
+from dreiattest.key import defer_plugins, get_plugins, resolve_plugins
+from dreiattest.plugins import BasePlugin
+
+
+class RecordingPlugin(BasePlugin):
+    instances = 0
+
+    def __init__(self):
+        RecordingPlugin.instances += 1
+        self.runs = []
+        self.done = Event()
+
+    def run(self, request, attestation):
+        self.runs.append(attestation)
+        self.done.set()
+
+
+class DeferredPlugin(RecordingPlugin):
+    deferred = True
+
+
+class PlainPlugin:
+    """Plugins don't need to subclass BasePlugin."""
+
+    def run(self, request, attestation):
+        self.attestation = attestation
+
+
+@patch.object(
+    dreiattest_settings,
+    "DREIATTEST_PLUGINS",
+    ["tests.test_plugins.RecordingPlugin", "tests.test_plugins.DeferredPlugin"],
+)
+class Plugins(SimpleTestCase):
+    def setUp(self):
+        get_plugins.cache_clear()
+        self.addCleanup(get_plugins.cache_clear)
+        RecordingPlugin.instances = 0
+        self.request = RequestFactory().post("/foo")
+
+    def test_plugins_are_instantiated_once(self):
+        resolve_plugins(self.request, "first")
+        resolve_plugins(self.request, "second")
+
+        self.assertEqual(RecordingPlugin.instances, 2)
+        self.assertEqual(get_plugins()[0].runs, ["first", "second"])
+
+    def test_only_synchronous_plugins_are_resolved(self):
+        synchronous, deferred = get_plugins()
+
+        resolve_plugins(self.request, "attestation")
+
+        self.assertEqual(synchronous.runs, ["attestation"])
+        self.assertEqual(deferred.runs, [])
+
+    def test_deferred_plugins_run_in_background(self):
+        synchronous, deferred = get_plugins()
+
+        defer_plugins(self.request, "attestation")
+
+        self.assertTrue(deferred.done.wait(timeout=5))
+        self.assertEqual(deferred.runs, ["attestation"])
+        self.assertEqual(synchronous.runs, [])
+
+    @patch("dreiattest.key.get_plugin_executor")
+    def test_deferred_plugins_run_inline_if_queue_is_full(self, get_plugin_executor):
+        get_plugin_executor.return_value.submit.side_effect = ExecutorBusyException
+        deferred = get_plugins()[1]
+
+        defer_plugins(self.request, "attestation")
+
+        self.assertEqual(deferred.runs, ["attestation"])
+
+    def test_plugins_without_base_class_are_synchronous(self):
+        with patch.object(dreiattest_settings, "DREIATTEST_PLUGINS", ["tests.test_plugins.PlainPlugin"]):
+            get_plugins.cache_clear()
+
+            resolve_plugins(self.request, "attestation")
+            defer_plugins(self.request, "other")
+
+            self.assertEqual(get_plugins()[0].attestation, "attestation")
+
+
+class BoundedExecutorTest(SimpleTestCase):
+    def test_rejects_calls_if_too_many_are_pending(self):
+        release = Event()
+        executor = BoundedExecutor(ThreadPoolExecutor(max_workers=1), max_pending=1)
+
+        future = executor.submit(release.wait)
+        with self.assertRaises(ExecutorBusyException):
+            executor.submit(release.wait)
+
+        release.set()
+        future.result(timeout=5)
+        executor.submit(lambda: None).result(timeout=5)
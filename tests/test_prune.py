@@ -0,0 +1,86 @@
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.exceptions import InvalidHeaderException
+from dreiattest.models import DeviceSession, Key, Nonce
+from dreiattest.nonce import create_nonce
+from dreiattest.session_registry import session_registry
+
+
+class PruneCommand(TestCase):
+    def setUp(self):
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+
+    def create_key(self, device_session: DeviceSession) -> Key:
+        return Key.objects.create(
+            device_session=device_session,
+            public_key_id="id",
+            public_key="",
+            driver="apple",
+        )
+
+    def create_stale_session(self) -> DeviceSession:
+        session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        DeviceSession.objects.filter(pk=session.pk).update(updated_at=timezone.now() - timedelta(days=2))
+        return session
+
+    def prune(self, *args) -> str:
+        out = StringIO()
+        call_command("dreiattest_prune", "--sleep=0", "--batch-size=2", *args, stdout=out)
+        return out.getvalue()
+
+    def test_deletes_used_and_expired_nonces(self):
+        valid = create_nonce(self.device_session)
+        used = create_nonce(self.device_session)
+        expired = create_nonce(self.device_session)
+        Nonce.objects.filter(pk=used.pk).update(used_at=timezone.now())
+        Nonce.objects.filter(pk=expired.pk).update(created_at=timezone.now() - timedelta(minutes=2))
+
+        output = self.prune()
+
+        self.assertIn("Deleted 2 nonces", output)
+        self.assertQuerySetEqual(Nonce.objects.all(), [valid])
+
+    def test_deletes_stale_unreferenced_sessions(self):
+        stale = self.create_stale_session()
+        with_key = self.create_stale_session()
+        self.create_key(with_key)
+
+        output = self.prune()
+
+        self.assertIn("Deleted 1 device sessions", output)
+        self.assertFalse(DeviceSession.objects.filter(pk=stale.pk).exists())
+        self.assertTrue(DeviceSession.objects.filter(pk=with_key.pk).exists())
+        self.assertTrue(DeviceSession.objects.filter(pk=self.device_session.pk).exists())
+
+    def test_evicts_deleted_sessions_from_the_registry(self):
+        stale = self.create_stale_session()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        with patch.object(dreiattest_settings, "DREIATTEST_SESSION_CACHE", "default"):
+            session_registry.get(stale.user_id, stale.session_id)
+            self.prune()
+
+            with self.assertRaises(InvalidHeaderException):
+                session_registry.get(stale.user_id, stale.session_id, create=False)
+
+    def test_dry_run(self):
+        self.create_stale_session()
+        nonce = create_nonce(self.device_session)
+        Nonce.objects.filter(pk=nonce.pk).update(used_at=timezone.now())
+
+        output = self.prune("--dry-run")
+
+        self.assertIn("Would delete 1 nonces", output)
+        self.assertIn("Would delete 1 device sessions", output)
+        self.assertEqual(Nonce.objects.count(), 1)
+        self.assertEqual(DeviceSession.objects.count(), 2)
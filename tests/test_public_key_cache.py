@@ -0,0 +1,73 @@
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.test import SimpleTestCase
+
+from dreiattest.key import get_key_id
+from dreiattest.models import Key
+from dreiattest.public_key_cache import PublicKeyCache
+
+
+def make_key(pk: int) -> Key:
+    public_key = ec.generate_private_key(ec.SECP256R1()).public_key()
+    pem = public_key.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+
+    return Key(pk=pk, public_key=pem, public_key_id=get_key_id(pem), driver="apple")
+
+
+class PublicKeyCacheTest(SimpleTestCase):
+    def test_repeated_loads_are_served_from_cache(self):
+        cache = PublicKeyCache(max_size=10)
+        key = make_key(pk=1)
+
+        first = cache.load(key)
+        second = cache.load(key)
+
+        self.assertIs(first, second)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_replaced_key_is_not_served_from_stale_entry(self):
+        cache = PublicKeyCache(max_size=10)
+        old_key = make_key(pk=1)
+        new_key = make_key(pk=1)
+
+        cache.load(old_key)
+        loaded = cache.load(new_key)
+
+        self.assertEqual(loaded.public_numbers(), new_key.load_pem().public_numbers())
+        self.assertEqual(cache.misses, 2)
+
+    def test_invalidate(self):
+        cache = PublicKeyCache(max_size=10)
+        key = make_key(pk=1)
+
+        cache.load(key)
+        cache.invalidate(key.pk)
+        cache.load(key)
+
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 2)
+
+    def test_least_recently_used_key_is_evicted(self):
+        cache = PublicKeyCache(max_size=2)
+        keys = [make_key(pk=pk) for pk in (1, 2, 3)]
+
+        cache.load(keys[0])
+        cache.load(keys[1])
+        cache.load(keys[0])
+        cache.load(keys[2])
+        cache.load(keys[1])
+
+        self.assertEqual(cache.stats()["size"], 2)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 4)
+
+    def test_disabled_cache_keeps_nothing(self):
+        cache = PublicKeyCache(max_size=0)
+        key = make_key(pk=1)
+
+        cache.load(key)
+        cache.load(key)
+
+        self.assertEqual(cache.stats()["size"], 0)
+        self.assertEqual(cache.misses, 2)
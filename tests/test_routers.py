@@ -0,0 +1,142 @@
+import uuid
+from unittest.mock import Mock, patch
+
+from asgiref.sync import async_to_sync
+from cryptography.exceptions import InvalidSignature
+from django.db.models import QuerySet
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.decorators import averify_request, verify_request
+from dreiattest.device_session import (
+    asession_and_key_from_request,
+    reload_replica_key,
+    session_and_key_from_request,
+)
+from dreiattest.models import DeviceSession, Key, Nonce
+from dreiattest.routers import DreiattestRouter, replica_database
+
+# Stands in for the models and objects of other apps
+User = Mock(_meta=Mock(app_label="auth"))
+
+
+@patch.object(dreiattest_settings, "DREIATTEST_DATABASE", "attestation")
+@patch.object(dreiattest_settings, "DREIATTEST_REPLICA_DATABASES", ["replica"])
+class Router(SimpleTestCase):
+    def setUp(self):
+        self.router = DreiattestRouter()
+
+    def test_routes_dreiattest_models(self):
+        for model in (DeviceSession, Key, Nonce):
+            with self.subTest(model=model):
+                self.assertEqual(self.router.db_for_read(model), "attestation")
+                self.assertEqual(self.router.db_for_write(model), "attestation")
+
+        self.assertIsNone(self.router.db_for_read(User))
+        self.assertIsNone(self.router.db_for_write(User))
+
+    def test_defaults_to_default_database(self):
+        with patch.object(dreiattest_settings, "DREIATTEST_DATABASE", None):
+            self.assertEqual(self.router.db_for_write(Key), "default")
+            self.assertTrue(self.router.allow_migrate("default", "dreiattest"))
+            self.assertIsNone(self.router.allow_migrate("default", "auth"))
+
+    def test_allow_migrate(self):
+        self.assertTrue(self.router.allow_migrate("attestation", "dreiattest"))
+        self.assertFalse(self.router.allow_migrate("default", "dreiattest"))
+        self.assertFalse(self.router.allow_migrate("replica", "dreiattest"))
+        for db in ("attestation", "default", "replica"):
+            self.assertIsNone(self.router.allow_migrate(db, "auth"))
+
+    def test_allow_relation(self):
+        device_session = DeviceSession(user_id="test", session_id=uuid.uuid4())
+
+        self.assertTrue(self.router.allow_relation(device_session, Key(device_session=device_session)))
+        self.assertIsNone(self.router.allow_relation(device_session, User))
+
+    def test_replica_database(self):
+        self.assertEqual(replica_database(), "replica")
+
+        with patch.object(dreiattest_settings, "DREIATTEST_REPLICA_DATABASES", []):
+            self.assertIsNone(replica_database())
+
+
+@patch("dreiattest.device_session.replica_database", return_value="default")
+class ReplicaLookup(TestCase):
+    def setUp(self):
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        self.request = RequestFactory().get("/foo", HTTP_DREIATTEST_UID=str(self.device_session))
+
+    def create_key(self) -> Key:
+        return Key.objects.create(device_session=self.device_session, public_key_id="id", public_key="", driver="apple")
+
+    def test_key_from_replica(self, replica_database):
+        created = self.create_key()
+
+        with self.assertNumQueries(1):
+            session, key = session_and_key_from_request(self.request, replica=True)
+
+        self.assertEqual(session, self.device_session)
+        self.assertEqual(key, created)
+
+    def test_falls_back_to_primary(self, replica_database):
+        created = self.create_key()
+
+        # A replica lagging behind doesn't know the key registered just before
+        with patch.object(QuerySet, "using", lambda queryset, alias: queryset.none()):
+            with self.assertNumQueries(1):
+                _, key = session_and_key_from_request(self.request, replica=True)
+            self.assertEqual(key, created)
+
+            _, key = async_to_sync(asession_and_key_from_request)(self.request, replica=True)
+            self.assertEqual(key, created)
+
+    def test_session_without_key(self, replica_database):
+        with self.assertNumQueries(3):
+            session, key = session_and_key_from_request(self.request, replica=True)
+
+        self.assertEqual(session, self.device_session)
+        self.assertIsNone(key)
+
+    @patch.object(dreiattest_settings, "DREIATTEST_REPLICA_DATABASES", ["replica"])
+    @patch.object(dreiattest_settings, "DREIATTEST_APPLE_APPIDS", ["0000000000.foo"])
+    def test_replaced_key_is_reloaded_from_primary(self, replica_database):
+        self.create_key()
+        # The replica still returns the key the device replaced by registering again
+        stale = Key.objects.get()
+        stale.public_key_id = "replaced"
+        stale._state.db = "replica"
+        request = RequestFactory().get(
+            "/foo",
+            HTTP_DREIATTEST_UID=str(self.device_session),
+            HTTP_DREIATTEST_NONCE="nonce",
+            HTTP_DREIATTEST_APP_IDENTIFIER="foo",
+        )
+
+        def verify_assertion(app_id, key, *args, **kwargs):
+            if key.public_key_id == "replaced":
+                raise InvalidSignature
+
+        with (
+            patch("dreiattest.decorators.session_and_key_from_request", return_value=(self.device_session, stale)),
+            patch("dreiattest.decorators.asession_and_key_from_request", return_value=(self.device_session, stale)),
+            patch("dreiattest.decorators.verify_assertion", side_effect=verify_assertion),
+            patch("dreiattest.decorators.record_failure") as record_failure,
+        ):
+            self.assertEqual(verify_request(request).public_key_id, "id")
+            self.assertEqual(async_to_sync(averify_request)(request).public_key_id, "id")
+
+        record_failure.assert_not_called()
+
+    @patch.object(dreiattest_settings, "DREIATTEST_REPLICA_DATABASES", ["replica"])
+    def test_key_of_primary_is_not_reloaded(self, replica_database):
+        key = self.create_key()
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(reload_replica_key(self.request, key))
+
+    def test_primary_only_by_default(self, replica_database):
+        self.create_key()
+
+        session_and_key_from_request(self.request)
+        replica_database.assert_not_called()
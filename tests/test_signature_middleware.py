@@ -0,0 +1,120 @@
+import json
+import uuid
+from unittest.mock import Mock, patch
+
+from asgiref.sync import async_to_sync
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import path as url_path
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.decorators import signature_required
+from dreiattest.middlewares import SignatureRequiredMiddleware, get_path_matcher
+from dreiattest.models import DeviceSession, Key
+from dreiattest.tickets import TICKET_RESPONSE_HEADER
+
+
+@signature_required(ticket_lifetime=30)
+def polling(request):
+    return HttpResponse()
+
+
+urlpatterns = [
+    url_path("api/polling", polling),
+]
+
+
+@override_settings(ROOT_URLCONF="tests.test_signature_middleware")
+@patch.object(dreiattest_settings, "DREIATTEST_APPLE_APPIDS", ["0000000000.ch.dreipol.one"])
+@patch.object(dreiattest_settings, "DREIATTEST_SIGNING_SECRET", "secret")
+@patch.object(dreiattest_settings, "DREIATTEST_SIGNATURE_REQUIRED_PATHS", ["api/", "internal/signed$"])
+@patch.object(dreiattest_settings, "DREIATTEST_SIGNATURE_EXEMPT_PATHS", ["api/health$"])
+@patch("dreiattest.decorators.verify_assertion")
+class SignatureRequired(TestCase):
+    def setUp(self):
+        get_path_matcher.cache_clear()
+        self.addCleanup(get_path_matcher.cache_clear)
+
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        self.view = Mock(return_value=HttpResponse())
+        self.middleware = SignatureRequiredMiddleware(self.view)
+
+    def request(self, path: str, **headers):
+        return RequestFactory().get(
+            path,
+            HTTP_DREIATTEST_UID=str(self.device_session),
+            HTTP_DREIATTEST_NONCE="nonce",
+            HTTP_DREIATTEST_APP_IDENTIFIER="ch.dreipol.one",
+            **headers,
+        )
+
+    def create_key(self):
+        Key.objects.create(device_session=self.device_session, public_key_id="id", public_key="", driver="apple")
+
+    def test_invalid_requests_are_rejected_early(self, verify_assertion):
+        response = self.middleware(self.request("/api/foo"))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(json.loads(response.content), {"code": "NoKeyForSession"})
+        self.view.assert_not_called()
+
+    def test_verified_requests_are_not_verified_again(self, verify_assertion):
+        self.create_key()
+        view = signature_required()(lambda request: HttpResponse())
+        middleware = SignatureRequiredMiddleware(view)
+
+        response = middleware(self.request("/api/foo"))
+
+        self.assertEqual(response.status_code, 200)
+        verify_assertion.assert_called_once()
+
+    def test_tickets(self, verify_assertion):
+        self.create_key()
+        middleware = SignatureRequiredMiddleware(polling)
+
+        ticket = middleware(self.request("/api/polling"))[TICKET_RESPONSE_HEADER]
+        with self.assertNumQueries(0):
+            response = middleware(self.request("/api/polling", HTTP_DREIATTEST_TICKET=ticket))
+
+        self.assertEqual(response.status_code, 200)
+        verify_assertion.assert_called_once()
+
+        # Other views don't accept the ticket
+        self.assertEqual(self.middleware(self.request("/api/foo", HTTP_DREIATTEST_TICKET=ticket)).status_code, 200)
+        self.assertEqual(verify_assertion.call_count, 2)
+
+    def test_base_url_is_escaped(self, verify_assertion):
+        with patch.object(dreiattest_settings, "DREIATTEST_BASE_URL", "api/v1.0/"):
+            get_path_matcher.cache_clear()
+
+            self.assertEqual(self.middleware(self.request("/api/v1.0/nonce")).status_code, 200)
+            self.assertEqual(self.middleware(self.request("/api/v1x0/nonce")).status_code, 403)
+
+    def test_unmatched_paths(self, verify_assertion):
+        for path in ("/api/health", "/dreiattest/nonce", "/dreiattest/key", "/other/api/", "/internal/signed/foo"):
+            with self.subTest(path=path):
+                self.assertEqual(self.middleware(self.request(path)).status_code, 200)
+
+        verify_assertion.assert_not_called()
+
+    def test_disabled_without_paths(self, verify_assertion):
+        with patch.object(dreiattest_settings, "DREIATTEST_SIGNATURE_REQUIRED_PATHS", []):
+            get_path_matcher.cache_clear()
+
+            self.assertIsNone(get_path_matcher())
+            self.assertEqual(self.middleware(self.request("/api/foo")).status_code, 200)
+
+    def test_async(self, verify_assertion):
+        async def view(request):
+            return HttpResponse()
+
+        middleware = SignatureRequiredMiddleware(view)
+
+        response = async_to_sync(middleware)(self.request("/api/foo"))
+        self.assertEqual(response.status_code, 403)
+
+        self.create_key()
+        request = self.request("/internal/signed")
+        response = async_to_sync(middleware)(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(request.dreiattest_verified)
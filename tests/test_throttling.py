@@ -0,0 +1,78 @@
+import uuid
+from unittest.mock import Mock, patch
+
+from cryptography.exceptions import InvalidSignature
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.decorators import averify_request, verify_request
+from dreiattest.exceptions import TooManyFailuresException
+from dreiattest.key import key_from_request
+from dreiattest.models import DeviceSession, Key
+from dreiattest.nonce import create_nonce
+
+
+@patch.object(dreiattest_settings, "DREIATTEST_FAILURE_LIMIT", 2)
+@patch("dreiattest.decorators.verify_assertion", side_effect=InvalidSignature)
+class FailureThrottling(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.rf = RequestFactory()
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        Key.objects.create(
+            device_session=self.device_session,
+            public_key_id="id",
+            public_key="",
+            driver="apple",
+        )
+
+    def signed_request(self):
+        return self.rf.get(
+            "/foo",
+            HTTP_DREIATTEST_UID=str(self.device_session),
+            HTTP_DREIATTEST_NONCE="nonce",
+        )
+
+    def test_session_is_throttled_after_failures(self, verify_assertion):
+        for _ in range(2):
+            with self.assertRaises(InvalidSignature):
+                verify_request(self.signed_request())
+
+        with self.assertNumQueries(0), self.assertRaises(TooManyFailuresException):
+            verify_request(self.signed_request())
+
+        self.assertEqual(verify_assertion.call_count, 2)
+
+    async def test_async_session_is_throttled_after_failures(self, verify_assertion):
+        for _ in range(2):
+            with self.assertRaises(InvalidSignature):
+                await averify_request(self.signed_request())
+
+        with self.assertRaises(TooManyFailuresException):
+            await averify_request(self.signed_request())
+
+    def test_new_key_resets_failures(self, verify_assertion):
+        for _ in range(2):
+            with self.assertRaises(InvalidSignature):
+                verify_request(self.signed_request())
+
+        nonce = create_nonce(self.device_session)
+        defaults = {"public_key": "", "public_key_id": "new id", "driver": "apple"}
+        with patch("dreiattest.key.verify_attestation_in_pool", return_value=(Mock(), defaults)):
+            key_from_request(
+                self.rf.post("/key", {}, content_type="application/json"),
+                nonce,
+                self.device_session,
+            )
+
+        with self.assertRaises(InvalidSignature):
+            verify_request(self.signed_request())
+
+    def test_disabled(self, verify_assertion):
+        with patch.object(dreiattest_settings, "DREIATTEST_FAILURE_LIMIT", 0):
+            for _ in range(3):
+                with self.assertRaises(InvalidSignature):
+                    verify_request(self.signed_request())
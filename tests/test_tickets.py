@@ -0,0 +1,105 @@
+import time
+import uuid
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+
+from dreiattest import settings as dreiattest_settings
+from dreiattest.decorators import signature_required
+from dreiattest.models import DeviceSession, Key
+from dreiattest.tickets import TICKET_RESPONSE_HEADER, has_valid_ticket, issue_ticket
+
+
+@patch.object(dreiattest_settings, "DREIATTEST_APPLE_APPIDS", ["0000000000.ch.dreipol.one"])
+@patch.object(dreiattest_settings, "DREIATTEST_SIGNING_SECRET", "secret")
+@patch("dreiattest.decorators.verify_assertion")
+class SessionTickets(TestCase):
+    def setUp(self):
+        self.device_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        Key.objects.create(device_session=self.device_session, public_key_id="id", public_key="", driver="apple")
+
+    def signed_request(self, ticket: str = None, device_session: DeviceSession = None):
+        headers = {
+            "HTTP_DREIATTEST_UID": str(device_session or self.device_session),
+            "HTTP_DREIATTEST_NONCE": "nonce",
+            "HTTP_DREIATTEST_APP_IDENTIFIER": "ch.dreipol.one",
+        }
+        if ticket:
+            headers["HTTP_DREIATTEST_TICKET"] = ticket
+
+        return RequestFactory().get("/foo", **headers)
+
+    def test_ticket_skips_the_verification(self, verify_assertion):
+        view = signature_required(ticket_lifetime=30)(lambda request: HttpResponse())
+
+        ticket = view(self.signed_request())[TICKET_RESPONSE_HEADER]
+        with self.assertNumQueries(0):
+            response = view(self.signed_request(ticket))
+
+        verify_assertion.assert_called_once()
+        self.assertNotIn(TICKET_RESPONSE_HEADER, response)
+
+    def test_async_views(self, verify_assertion):
+        async def view(request):
+            return HttpResponse()
+
+        view = signature_required(ticket_lifetime=30)(view)
+
+        ticket = async_to_sync(view)(self.signed_request())[TICKET_RESPONSE_HEADER]
+        async_to_sync(view)(self.signed_request(ticket))
+
+        verify_assertion.assert_called_once()
+
+    def test_tickets_are_bound_to_the_view(self, verify_assertion):
+        def polling(request):
+            return HttpResponse()
+
+        def other(request):
+            return HttpResponse()
+
+        view = signature_required(ticket_lifetime=5)(polling)
+        ticket = view(self.signed_request())[TICKET_RESPONSE_HEADER]
+
+        signature_required(ticket_lifetime=30)(other)(self.signed_request(ticket))
+        signature_required(ticket_lifetime=30)(polling)(self.signed_request(ticket))
+
+        self.assertEqual(verify_assertion.call_count, 3)
+
+    def test_tickets_are_opt_in(self, verify_assertion):
+        view = signature_required()(lambda request: HttpResponse())
+        ticket = issue_ticket(self.signed_request(), "view", 30)
+
+        response = view(self.signed_request(ticket))
+
+        self.assertEqual(verify_assertion.call_count, 1)
+        self.assertNotIn(TICKET_RESPONSE_HEADER, response)
+
+    def test_invalid_tickets(self, verify_assertion):
+        other_session = DeviceSession.objects.create(session_id=uuid.uuid4(), user_id="test")
+        ticket = issue_ticket(self.signed_request(), "view", 30)
+
+        self.assertTrue(has_valid_ticket(self.signed_request(ticket), "view", 30))
+        self.assertFalse(has_valid_ticket(self.signed_request(ticket, other_session), "view", 30))
+        self.assertFalse(has_valid_ticket(self.signed_request(ticket), "other", 30))
+        self.assertFalse(has_valid_ticket(self.signed_request(ticket), "view", 60))
+        self.assertFalse(has_valid_ticket(self.signed_request(ticket[:-4] + "AAAA"), "view", 30))
+        self.assertFalse(has_valid_ticket(self.signed_request("foo"), "view", 30))
+
+    def test_tickets_expire(self, verify_assertion):
+        ticket = issue_ticket(self.signed_request(), "view", 5)
+
+        with patch("dreiattest.tickets.time.time", return_value=time.time() + 6):
+            self.assertFalse(has_valid_ticket(self.signed_request(ticket), "view", 5))
+
+    def test_lifetime_is_capped(self, verify_assertion):
+        with patch.object(dreiattest_settings, "DREIATTEST_TICKET_MAX_LIFETIME", 10):
+            ticket = issue_ticket(self.signed_request(), "view", 3600)
+
+            with patch("dreiattest.tickets.time.time", return_value=time.time() + 11):
+                self.assertFalse(has_valid_ticket(self.signed_request(ticket), "view", 3600))
+
+            # Tickets issued with a higher maximum lifetime are rejected once it was lowered
+            with patch.object(dreiattest_settings, "DREIATTEST_TICKET_MAX_LIFETIME", 5):
+                self.assertFalse(has_valid_ticket(self.signed_request(ticket), "view", 3600))